@@ -0,0 +1,9 @@
+"""
+Benchmark del servizio: corpus MRF sintetico (mrf_gen) + harness (run).
+
+Dalla cartella backend:
+    python -m bench.run                        # corpus 1MB e 16MB, confronto con bench/baseline.json
+    python -m bench.run --sizes 1GB,4GB --kinds csv,cms --repeat 2
+    python -m bench.run --save-baseline        # riscrive la baseline con i numeri di questa macchina
+    python -m bench.mrf_gen --sizes 64MB       # solo il corpus (deterministico, per seed)
+"""
@@ -0,0 +1,276 @@
+"""
+Generatore deterministico di file MRF sintetici per i benchmark.
+
+Stesso seed + stessa dimensione = stesso file, byte per byte. Copre tutti i percorsi
+di input del servizio:
+  csv_std / csv_semicolon / csv_tab / csv_pipe   CSV "da ospedale" con header e
+                                                  delimitatori diversi (virgolette,
+                                                  tariffe "$1,234.56", celle vuote)
+  csv_wide                                        CSV con 40+ colonne (5 utili)
+  json_flat / json_data / ndjson                  array, { data: [...] }, una riga per oggetto
+  cms                                             in-network CMS annidato (in_network[]
+                                                  .negotiated_rates[].negotiated_prices[])
+  csv_gz / cms_gz                                 gli stessi, gzippati
+  zip_multi                                       ZIP con 4 membri (CSV, JSON, NDJSON, CSV)
+
+La dimensione è quella del testo non compresso (per ZIP: la somma dei membri), da
+1MB a diversi GB: si scrive in streaming, la memoria resta costante. Accanto a ogni
+file un `<file>.meta.json` con il numero di righe atteso.
+"""
+from typing import Any, Callable, Dict, Iterator, List, Optional, TextIO, Tuple
+from pathlib import Path
+import argparse, csv, gzip, io, json, os, random, tempfile, zipfile
+
+GEN_VERSION = 1
+BATCH = 1000  # righe per scrittura
+
+_WORDS = ("office", "visit", "established", "patient", "knee", "arthroscopy", "mri", "without", "contrast",
+          "lumbar", "spine", "injection", "therapeutic", "emergency", "department", "level", "blood", "panel",
+          "comprehensive", "metabolic", "ultrasound", "abdomen", "complete", "colonoscopy", "biopsy", "x-ray")
+_PROVIDER_WORDS = ("Mercy", "Valley", "General", "St. Luke", "Northside", "Pacific", "Summit", "Lakeside",
+                   "Riverside", "County", "Memorial", "Children's", "University", "Heritage")
+_BILLING_CLASSES = ("professional", "institutional")
+
+
+class _Pools:
+    """Codici, descrizioni e provider (fissi per seed) da cui pescano tutte le righe."""
+
+    def __init__(self, rng: random.Random):
+        self.codes = [str(c) for c in rng.sample(range(10000, 99999), 1800)] + [f"J{n:04d}" for n in rng.sample(range(10000), 200)]
+        self.desc = {c: " ".join(rng.choice(_WORDS) for _ in range(rng.randint(2, 6))).capitalize()
+                     + (", each additional" if rng.random() < 0.1 else "") for c in self.codes}
+        self.providers = [f"{rng.choice(_PROVIDER_WORDS)} {rng.choice(('Health', 'Medical Group', 'Hospital', 'Clinic'))}"
+                          + (f", {rng.choice(('Inc.', 'LLC', 'PC'))}" if rng.random() < 0.2 else "") + f" {i:03d}"
+                          for i in range(300)]
+
+
+def _rows(rng: random.Random, pools: _Pools) -> Iterator[Tuple[str, str, str, str, float]]:
+    """(code, description, provider, billing_class, rate) all'infinito."""
+    codes, desc, provs = pools.codes, pools.desc, pools.providers
+    while True:
+        code = rng.choice(codes)
+        yield code, desc[code], rng.choice(provs), rng.choice(_BILLING_CLASSES), round(rng.uniform(5, 25000), 2)
+
+
+def _csv_rate(rng: random.Random, rate: float) -> str:
+    r = rng.random()
+    if r < 0.02:
+        return ""
+    if r < 0.07:
+        return f"${rate:,.2f}"
+    return f"{rate:.2f}"
+
+
+# ---------- writer: (out testuale, byte da scrivere, rng) -> righe scritte ----------
+def _csv_writer(headers: List[str], delimiter: str, extra_cols: int = 0) -> Callable[[TextIO, int, random.Random], int]:
+    def write(out: TextIO, size: int, rng: random.Random) -> int:
+        pools = _Pools(rng)
+        rows = _rows(rng, pools)
+        extra = [f"extra_{i}" for i in range(extra_cols)]
+        buf = io.StringIO()
+        w = csv.writer(buf, delimiter=delimiter, lineterminator="\n")
+        w.writerow(headers + extra)
+        written, n = 0, 0
+        while written < size:
+            for _ in range(BATCH):
+                code, d, prov, bc, rate = next(rows)
+                w.writerow([code, d, prov, bc, _csv_rate(rng, rate)] + [f"v{i}-{n % 97}" for i in range(extra_cols)])
+                n += 1
+            chunk = buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+            out.write(chunk)
+            written += len(chunk)
+        return n
+    return write
+
+
+def _json_objects(make: Callable[[Tuple[str, str, str, str, float]], Dict[str, Any]], head: str, tail: str,
+                  sep: str) -> Callable[[TextIO, int, random.Random], int]:
+    def write(out: TextIO, size: int, rng: random.Random) -> int:
+        rows = _rows(rng, _Pools(rng))
+        out.write(head)
+        written, n = len(head), 0
+        while written < size:
+            chunk = (sep if n else "") + sep.join(json.dumps(make(next(rows))) for _ in range(BATCH))
+            n += BATCH
+            out.write(chunk)
+            written += len(chunk)
+        out.write(tail)
+        return n
+    return write
+
+
+def _cms(out: TextIO, size: int, rng: random.Random) -> int:
+    pools = _Pools(rng)
+    head = json.dumps({
+        "reporting_entity_name": "Synthetic Health Plan", "reporting_entity_type": "health insurance issuer",
+        "last_updated_on": "2025-02-01", "version": "1.3.1",
+        "provider_references": [{"provider_group_id": i, "provider_groups": [
+            {"npi": [1000000000 + i * 7 + k for k in range(3)], "tin": {"type": "ein", "value": f"{i:09d}"}}]}
+            for i in range(1, 201)],
+    })[:-1] + ', "in_network": ['
+    out.write(head)
+    written, n, items = len(head), 0, 0
+    while written < size:
+        parts = []
+        for _ in range(BATCH // 4):
+            code = rng.choice(pools.codes)
+            rates = []
+            for _ in range(rng.randint(1, 3)):
+                prices = [{"negotiated_type": "negotiated", "negotiated_rate": round(rng.uniform(5, 25000), 2),
+                           "expiration_date": "9999-12-31", "service_code": ["11", "22"],
+                           "billing_class": rng.choice(_BILLING_CLASSES)} for _ in range(rng.randint(1, 4))]
+                n += len(prices)
+                rates.append({"provider_references": rng.sample(range(1, 201), 2), "negotiated_prices": prices})
+            parts.append(json.dumps({
+                "negotiation_arrangement": "ffs", "name": pools.desc[code], "billing_code_type": "CPT",
+                "billing_code_type_version": "2025", "billing_code": code, "description": pools.desc[code],
+                "negotiated_rates": rates,
+            }))
+        chunk = ("," if items else "") + ",".join(parts)
+        items += len(parts)
+        out.write(chunk)
+        written += len(chunk)
+    out.write("]}")
+    return n
+
+
+_STD = _csv_writer(["CPT", "Description", "Payer", "Billing Class", "Allowed Amount ($)"], ",")
+WRITERS: Dict[str, Tuple[str, Callable[[TextIO, int, random.Random], int]]] = {
+    "csv_std": (".csv", _STD),
+    "csv_semicolon": (".csv", _csv_writer(["Procedure Code", "Service", "Third-Party", "Network", "Price ($)"], ";")),
+    "csv_tab": (".csv", _csv_writer(["hcpcs", "procedure description", "reporting entity name", "billing class",
+                                     "plan allowed amount"], "\t")),
+    "csv_pipe": (".csv", _csv_writer(["billing_code", "description", "payer", "rate_type", "negotiated_rate"], "|")),
+    "csv_wide": (".csv", _csv_writer(["CPT", "Description", "Payer", "Billing Class", "Allowed Amount ($)"], ",", 38)),
+    "json_flat": (".json", _json_objects(
+        lambda r: {"billing_code": r[0], "description": r[1], "payer": r[2], "billing_class": r[3], "negotiated_rate": r[4]},
+        "[\n", "\n]", ",\n")),
+    "json_data": (".json", _json_objects(
+        lambda r: {"code": r[0], "description": r[1], "provider_name": r[2], "rate_type": r[3], "negotiated_rate": r[4]},
+        '{"meta": {"source": "synthetic"}, "data": [', "]}", ",")),
+    "ndjson": (".ndjson", _json_objects(
+        lambda r: {"cpt_code": r[0], "procedure": r[1], "reporting_entity_name": r[2], "network": r[3],
+                   "allowed_amount": f"{r[4]:.2f}"},
+        "", "\n", "\n")),
+    "cms": (".json", _cms),
+}
+# derivati: (writer di base, compressione)
+COMPRESSED = {"csv_gz": ("csv_std", ".csv.gz"), "cms_gz": ("cms", ".json.gz")}
+ZIP_MEMBERS = {"zip_multi": ("csv_std", "json_flat", "ndjson", "csv_semicolon")}
+KINDS = (*WRITERS, *COMPRESSED, *ZIP_MEMBERS)
+
+
+def parse_size(s: str) -> int:
+    """"1MB", "512KB", "4GB", "1000" -> byte."""
+    s = s.strip().upper()
+    for unit, mult in (("GB", 1024 ** 3), ("MB", 1024 ** 2), ("KB", 1024), ("B", 1)):
+        if s.endswith(unit):
+            return int(float(s[:-len(unit)]) * mult)
+    return int(s)
+
+
+def size_label(size: int) -> str:
+    for unit, mult in (("GB", 1024 ** 3), ("MB", 1024 ** 2), ("KB", 1024)):
+        if size >= mult and size % mult == 0:
+            return f"{size // mult}{unit}"
+    return f"{size}B"
+
+
+def select_kinds(spec: Optional[str]) -> List[str]:
+    """"csv,cms" -> tutti i kind che iniziano così (vuoto = tutti)."""
+    if not spec:
+        return list(KINDS)
+    wanted = [w.strip() for w in spec.split(",") if w.strip()]
+    return [k for k in KINDS if any(k == w or k.startswith(w) for w in wanted)]
+
+
+def _write_text(path: Path, writer: Callable[[TextIO, int, random.Random], int], size: int, seed: int,
+                compress: bool = False) -> int:
+    with open(path, "wb") as f:
+        # mtime=0: stesso seed = stesso .gz
+        raw = gzip.GzipFile(filename="", mode="wb", fileobj=f, mtime=0) if compress else f
+        with io.TextIOWrapper(raw, encoding="utf-8", newline="") as out:  # type: ignore[arg-type]
+            return writer(out, size, random.Random(seed))
+
+
+def generate(kind: str, size: int, out_dir: str, seed: int = 1) -> Dict[str, Any]:
+    """Crea (se manca) il file di questo kind/dimensione e ritorna il suo manifest:
+       {kind, size, path, rows, name} (+ members per gli ZIP: nome e righe di ognuno)."""
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    if kind in WRITERS:
+        ext = WRITERS[kind][0]
+    elif kind in COMPRESSED:
+        ext = COMPRESSED[kind][1]
+    elif kind in ZIP_MEMBERS:
+        ext = ".zip"
+    else:
+        raise ValueError(f"Unknown kind: {kind}")
+    path = out / f"{kind}-{size_label(size)}-s{seed}{ext}"
+    meta_path = Path(str(path) + ".meta.json")
+    try:
+        meta = json.loads(meta_path.read_text())
+        if meta.get("version") == GEN_VERSION and path.exists():
+            return meta
+    except (OSError, ValueError):
+        pass
+
+    # si scrive su un file temporaneo: un'interruzione non lascia file a metà col meta
+    tmp = path.with_name(path.name + ".tmp")
+    if kind in WRITERS:
+        rows = _write_text(tmp, WRITERS[kind][1], size, seed)
+    elif kind in COMPRESSED:
+        rows = _write_text(tmp, WRITERS[COMPRESSED[kind][0]][1], size, seed, compress=True)
+    else:
+        members = ZIP_MEMBERS[kind]
+        rows = 0
+        member_rows: List[Dict[str, Any]] = []
+        with tempfile.TemporaryDirectory(dir=out) as td, \
+                zipfile.ZipFile(tmp, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+            for i, base in enumerate(members):
+                member = Path(td) / f"part{i + 1}-{base}{WRITERS[base][0]}"
+                n = _write_text(member, WRITERS[base][1], size // len(members), seed + i)
+                rows += n
+                member_rows.append({"name": member.name, "rows": n})
+                # data fissa: stesso seed = stesso ZIP
+                info = zipfile.ZipInfo(member.name, date_time=(2025, 2, 1, 0, 0, 0))
+                info.compress_type = zipfile.ZIP_DEFLATED
+                with open(member, "rb") as src, zf.open(info, "w") as dst:
+                    while True:
+                        buf = src.read(1024 * 1024)
+                        if not buf:
+                            break
+                        dst.write(buf)
+                member.unlink()
+    os.replace(tmp, path)
+    meta = {"version": GEN_VERSION, "kind": kind, "size": size, "seed": seed, "name": path.name,
+            "path": str(path), "bytes": path.stat().st_size, "rows": rows}
+    if kind in ZIP_MEMBERS:
+        meta["members"] = member_rows
+    meta_path.write_text(json.dumps(meta))
+    return meta
+
+
+def corpus(out_dir: str, sizes: List[int], kinds: List[str], seed: int = 1) -> List[Dict[str, Any]]:
+    return [generate(k, s, out_dir, seed) for s in sizes for k in kinds]
+
+
+def default_dir() -> str:
+    return os.getenv("COSTVISTA_BENCH_DIR") or str(Path(tempfile.gettempdir()) / "costvista-bench")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description="Genera il corpus MRF sintetico dei benchmark.")
+    ap.add_argument("--out", default=default_dir())
+    ap.add_argument("--sizes", default="1MB,16MB", help="es. 1MB,16MB,1GB")
+    ap.add_argument("--kinds", default="", help=f"prefissi fra: {', '.join(KINDS)}")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args(argv)
+    for meta in corpus(args.out, [parse_size(s) for s in args.sizes.split(",")], select_kinds(args.kinds), args.seed):
+        print(f"{meta['name']:40} {meta['bytes']:>14,} bytes {meta['rows']:>12,} rows")
+
+
+if __name__ == "__main__":
+    main()
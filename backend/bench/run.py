@@ -0,0 +1,331 @@
+"""
+Harness dei benchmark: throughput, latenze e memoria su un corpus sintetico (mrf_gen).
+
+Casi, per ogni file del corpus:
+  fn:parse_csv        parse_csv sul testo già in memoria (solo CSV non compressi)
+  fn:normalize_rows   normalize_rows sulle righe di un JSON piatto già caricate
+  fn:summarize        _summarize su righe già normalizzate (CSV standard, JSON piatto)
+  route:summary       POST /api/summary con l'URL del file (summary, niente righe)
+  route:summary_rows  idem con include_rows=true (file fino a --rows-max)
+  route:upload        POST /api/summary_upload col file in multipart
+
+Le route passano da un client ASGI in-process (httpx.ASGITransport, lifespan
+compreso); gli URL remoti li serve un piccolo server HTTP locale che fa da
+stand-in per i server dei payer. Cache risultati e indice sono spenti, così ogni
+ripetizione fa davvero il parse.
+
+Ogni caso gira in un processo a sé (--no-isolate per restare in questo): così il
+picco di RSS (processo + worker del pool, campionato ogni 20ms) è del caso e
+non di quelli prima. Per caso: righe/s (sulla mediana), p50/p99 delle latenze,
+picco RSS. Il confronto con la baseline (bench/baseline.json) segnala come
+regressione un calo di throughput o un aumento di latenza/memoria oltre
+--tolerance; con regressioni l'uscita è 1.
+"""
+from typing import Any, Callable, Dict, List, Optional
+from pathlib import Path
+import argparse, asyncio, functools, http.server, json, math, os, platform, subprocess, sys, tempfile, threading, time
+
+if __package__ in (None, ""):  # python bench/run.py
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    from bench import mrf_gen  # type: ignore
+else:
+    from . import mrf_gen
+
+BACKEND = Path(__file__).resolve().parent.parent
+BASELINE = Path(__file__).resolve().parent / "baseline.json"
+CASES = ("fn:parse_csv", "fn:normalize_rows", "fn:summarize", "route:summary", "route:summary_rows", "route:upload")
+RSS_SLACK_MB = 16  # sotto questa crescita la memoria non conta come regressione
+
+
+# ---------- server stand-in ----------
+class _Handler(http.server.SimpleHTTPRequestHandler):
+    """File statici senza Last-Modified: niente GET condizionali fra una ripetizione e l'altra."""
+
+    def send_header(self, keyword: str, value: str) -> None:
+        if keyword.lower() != "last-modified":
+            super().send_header(keyword, value)
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+
+def serve(directory: str) -> http.server.ThreadingHTTPServer:
+    """Server HTTP locale (porta libera) in un thread daemon."""
+    srv = http.server.ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(_Handler, directory=directory))
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+
+# ---------- misure ----------
+def _rss_bytes(pid: str = "self") -> int:
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class RssSampler:
+    """Picco di RSS (questo processo + figli del pool) durante il blocco `with`.
+       Senza /proc (non Linux) si ripiega su ru_maxrss del solo processo."""
+
+    def __init__(self, interval: float = 0.02):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+
+    def _sample(self) -> None:
+        import multiprocessing
+        while True:
+            rss = _rss_bytes() + sum(_rss_bytes(str(p.pid)) for p in multiprocessing.active_children())
+            self.peak = max(self.peak, rss)
+            if self._stop.wait(self.interval):
+                return
+
+    def __enter__(self) -> "RssSampler":
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self._stop.set()
+        self._thread.join()
+        if not self.peak:
+            import resource
+            maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            self.peak = maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank (con poche ripetizioni p99 = il caso peggiore)."""
+    s = sorted(values)
+    return s[max(0, math.ceil(q * len(s)) - 1)]
+
+
+# ---------- casi (girano nel processo worker) ----------
+def _expected_rows(meta: Dict[str, Any], all_members: bool) -> int:
+    if "members" in meta and not all_members:
+        return meta["members"][0]["rows"]  # senza all_members si elabora il primo membro
+    return meta["rows"]
+
+
+def _fn_case(name: str, meta: Dict[str, Any]) -> Callable[[], int]:
+    import main
+    text = open(meta["path"], encoding="utf-8").read()
+    if name == "fn:parse_csv":
+        return lambda: len(main.parse_csv(text))
+    if meta["kind"].startswith("json"):
+        raw = json.loads(text)
+        del text
+        if name == "fn:normalize_rows":
+            return lambda: len(main.normalize_rows(raw))
+        rows = main.normalize_rows(raw)
+    else:
+        rows = main.parse_csv(text)
+    return lambda: main._summarize(rows, keep_rows=False)["count"]
+
+
+async def _route_runs(name: str, meta: Dict[str, Any], base_url: str, repeat: int, warmup: int,
+                      max_seconds: float) -> List[float]:
+    import httpx  # type: ignore
+    import main
+    zip_all = meta["path"].endswith(".zip")
+    expected = _expected_rows(meta, zip_all)
+
+    async def once(client: Any) -> None:
+        if name == "route:upload":
+            with open(meta["path"], "rb") as f:
+                r = await client.post("/api/summary_upload", files={"file": (meta["name"], f)},
+                                      data={"include_rows": "false", "all_members": str(zip_all).lower()})
+        else:
+            r = await client.post("/api/summary", json={
+                "url": f"{base_url}/{meta['name']}", "include_rows": name == "route:summary_rows", "all_members": zip_all,
+            })
+        r.raise_for_status()
+        count = r.json()["count"]
+        if count != expected:
+            raise AssertionError(f"{meta['name']}: count {count}, expected {expected}")
+
+    lat: List[float] = []
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            for _ in range(warmup):
+                await once(client)
+            start = time.perf_counter()
+            while len(lat) < repeat and (not lat or time.perf_counter() - start < max_seconds):
+                t = time.perf_counter()
+                await once(client)
+                lat.append(time.perf_counter() - t)
+    return lat
+
+
+def run_case(case: Dict[str, Any]) -> Dict[str, Any]:
+    """Un caso: {name, meta, base_url, repeat, warmup, max_seconds} -> metriche."""
+    os.environ.setdefault("COSTVISTA_CACHE_MAX_BYTES", "0")  # ogni ripetizione fa il parse
+    os.environ.pop("COSTVISTA_INDEX_DIR", None)
+    os.environ.pop("COSTVISTA_CACHE_DIR", None)
+    # job store vuoto: il lifespan non deve riprendere job rimasti da altre esecuzioni
+    os.environ["COSTVISTA_JOBS_DIR"] = tempfile.mkdtemp(prefix="costvista-bench-jobs-")
+    if str(BACKEND) not in sys.path:
+        sys.path.insert(0, str(BACKEND))
+    name, meta = case["name"], case["meta"]
+    with RssSampler() as rss:
+        if name.startswith("fn:"):
+            fn = _fn_case(name, meta)
+            rows = 0
+            for _ in range(case["warmup"]):
+                fn()
+            lat: List[float] = []
+            start = time.perf_counter()
+            while len(lat) < case["repeat"] and (not lat or time.perf_counter() - start < case["max_seconds"]):
+                t = time.perf_counter()
+                rows = fn()
+                lat.append(time.perf_counter() - t)
+        else:
+            lat = asyncio.run(_route_runs(name, meta, case["base_url"], case["repeat"], case["warmup"],
+                                          case["max_seconds"]))
+            rows = _expected_rows(meta, meta["path"].endswith(".zip"))
+    p50 = percentile(lat, 0.5)
+    return {
+        "rows": rows, "runs": len(lat), "rows_per_s": round(rows / p50, 1) if p50 else 0.0,
+        "p50_ms": round(p50 * 1000, 2), "p99_ms": round(percentile(lat, 0.99) * 1000, 2),
+        "peak_rss_mb": round(rss.peak / 1024 ** 2, 1),
+    }
+
+
+# ---------- orchestrazione ----------
+def plan(corpus: List[Dict[str, Any]], only: Optional[List[str]], rows_max: int, fn_max: int) -> List[Dict[str, Any]]:
+    cases = []
+    for meta in corpus:
+        kind, plain = meta["kind"], not meta["path"].endswith((".gz", ".zip"))
+        for name in CASES:
+            if only and not any(name == o or name.startswith(o) for o in only):
+                continue
+            if name.startswith("fn:"):
+                if meta["size"] > fn_max or not plain:
+                    continue
+                if name == "fn:parse_csv" and not kind.startswith("csv"):
+                    continue
+                if name == "fn:normalize_rows" and kind != "json_flat":
+                    continue
+                if name == "fn:summarize" and kind not in ("csv_std", "json_flat"):
+                    continue
+            if name == "route:summary_rows" and meta["size"] > rows_max:
+                continue
+            cases.append({"id": f"{name}:{kind}:{mrf_gen.size_label(meta['size'])}", "name": name, "meta": meta})
+    return cases
+
+
+def _run_isolated(case: Dict[str, Any]) -> Dict[str, Any]:
+    proc = subprocess.run([sys.executable, "-m", "bench.run", "--case", json.dumps(case)], cwd=str(BACKEND),
+                          capture_output=True, text=True)
+    if proc.returncode != 0:
+        lines = (proc.stderr or proc.stdout).strip().splitlines()
+        raise RuntimeError(lines[-1] if lines else f"exit {proc.returncode}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]],
+            tolerance: float) -> Dict[str, List[str]]:
+    """Regressioni per caso rispetto alla baseline (solo i casi presenti in entrambe)."""
+    out: Dict[str, List[str]] = {}
+    for cid, r in results.items():
+        b = baseline.get(cid)
+        if not b or "error" in r:
+            continue
+        bad = []
+        if r["rows_per_s"] < b["rows_per_s"] * (1 - tolerance):
+            bad.append(f"rows/s {r['rows_per_s']:,.0f} < {b['rows_per_s']:,.0f}")
+        for k in ("p50_ms", "p99_ms"):
+            if r[k] > b[k] * (1 + tolerance):
+                bad.append(f"{k} {r[k]:,.1f} > {b[k]:,.1f}")
+        if r["peak_rss_mb"] > b["peak_rss_mb"] * (1 + tolerance) + RSS_SLACK_MB:
+            bad.append(f"peak_rss_mb {r['peak_rss_mb']:,.0f} > {b['peak_rss_mb']:,.0f}")
+        if bad:
+            out[cid] = bad
+    return out
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Benchmark di Costvista su corpus MRF sintetico.")
+    ap.add_argument("--sizes", default="1MB,16MB", help="dimensioni del corpus, es. 1MB,16MB,1GB,4GB")
+    ap.add_argument("--kinds", default="", help=f"prefissi fra: {', '.join(mrf_gen.KINDS)}")
+    ap.add_argument("--cases", default="", help=f"prefissi fra: {', '.join(CASES)}")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--data-dir", default=mrf_gen.default_dir())
+    ap.add_argument("--repeat", type=int, default=5, help="ripetizioni misurate per caso")
+    ap.add_argument("--warmup", type=int, default=1)
+    ap.add_argument("--max-seconds", type=float, default=20.0, help="tetto al tempo di un caso (almeno una ripetizione)")
+    ap.add_argument("--rows-max", default="64MB", help="route:summary_rows solo fino a questa dimensione")
+    ap.add_argument("--fn-max", default="256MB", help="casi fn:* (testo in memoria) solo fino a questa dimensione")
+    ap.add_argument("--baseline", default=str(BASELINE))
+    ap.add_argument("--save-baseline", action="store_true", help="scrive i risultati come nuova baseline")
+    ap.add_argument("--tolerance", type=float, default=0.25)
+    ap.add_argument("--out", default="", help="file JSON con i risultati di questo giro")
+    ap.add_argument("--no-isolate", action="store_true", help="tutti i casi in questo processo")
+    ap.add_argument("--case", help=argparse.SUPPRESS)  # uso interno: un caso nel processo worker
+    args = ap.parse_args(argv)
+
+    if args.case:
+        print(json.dumps(run_case(json.loads(args.case))))
+        return 0
+
+    sizes = [mrf_gen.parse_size(s) for s in args.sizes.split(",") if s.strip()]
+    kinds = mrf_gen.select_kinds(args.kinds)
+    print(f"corpus in {args.data_dir} ...", flush=True)
+    corpus = mrf_gen.corpus(args.data_dir, sizes, kinds, args.seed)
+    cases = plan(corpus, [c.strip() for c in args.cases.split(",") if c.strip()] or None,
+                 mrf_gen.parse_size(args.rows_max), mrf_gen.parse_size(args.fn_max))
+    srv = serve(args.data_dir)
+    base_url = f"http://127.0.0.1:{srv.server_address[1]}"
+
+    try:
+        baseline = json.loads(Path(args.baseline).read_text()).get("cases", {})
+    except (OSError, ValueError):
+        baseline = {}
+    results: Dict[str, Dict[str, Any]] = {}
+    print(f"{'case':52} {'rows':>10} {'rows/s':>12} {'p50 ms':>10} {'p99 ms':>10} {'peak MB':>8}  vs baseline")
+    try:
+        for case in cases:
+            job = {**case, "base_url": base_url, "repeat": max(1, args.repeat), "warmup": args.warmup,
+                   "max_seconds": args.max_seconds}
+            try:
+                r = run_case(job) if args.no_isolate else _run_isolated(job)
+            except Exception as e:  # un caso rotto non ferma gli altri
+                r = {"error": f"{type(e).__name__}: {e}"}
+            results[case["id"]] = r
+            if "error" in r:
+                print(f"{case['id']:52} ERROR {r['error']}", flush=True)
+                continue
+            b = baseline.get(case["id"])
+            delta = f"{(r['rows_per_s'] / b['rows_per_s'] - 1) * 100:+.0f}% rows/s" if b and b.get("rows_per_s") else "-"
+            print(f"{case['id']:52} {r['rows']:>10,} {r['rows_per_s']:>12,.0f} {r['p50_ms']:>10,.1f} "
+                  f"{r['p99_ms']:>10,.1f} {r['peak_rss_mb']:>8,.0f}  {delta}", flush=True)
+    finally:
+        srv.shutdown()
+
+    report = {
+        "meta": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+                 "sizes": args.sizes, "seed": args.seed, "repeat": args.repeat,
+                 "date": time.strftime("%Y-%m-%dT%H:%M:%S%z")},
+        "cases": results,
+    }
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=1))
+    if args.save_baseline:
+        Path(args.baseline).write_text(json.dumps(report, indent=1) + "\n")
+        print(f"baseline salvata in {args.baseline}")
+        return 0
+    regressions = compare(results, baseline, args.tolerance)
+    errors = [cid for cid, r in results.items() if "error" in r]
+    for cid, bad in regressions.items():
+        print(f"REGRESSION {cid}: " + "; ".join(bad))
+    if not baseline:
+        print(f"nessuna baseline in {args.baseline} (--save-baseline per crearla)")
+    return 1 if regressions or errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,21 +1,81 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form  # type: ignore
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Request  # type: ignore
+from fastapi.encoders import jsonable_encoder  # type: ignore
+from fastapi.responses import JSONResponse, Response, StreamingResponse  # type: ignore
 from fastapi.middleware.cors import CORSMiddleware  # type: ignore
 from pydantic import BaseModel  # type: ignore
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Tuple, Iterable, Iterator, AsyncIterator, Awaitable, Callable, TypeVar, Union
 from pathlib import Path
 import csv, io, json, httpx, re  # type: ignore
 from datetime import datetime, timezone
 import re as _re
-import gzip, zipfile
+import codecs, zipfile, itertools, zlib, asyncio, hashlib, os, time, tempfile, shutil, base64
+from contextlib import asynccontextmanager
 from contextvars import ContextVar
+from mrf_json import (
+    sniff, iter_json_rows, iter_ndjson_rows, IndexFileDetected, JsonShapeError, NoRowsFound,
+    Keep, RecordPrefilter, JsonCursor,
+)
+from mrf_io import iter_decode, iter_maybe_gunzip, iter_sync
+import mrf_http, mrf_exec, mrf_gzip, mrf_output, mrf_metrics, mrf_shard, mrf_warmup
+from mrf_cache import ResultCache, file_digest
+from mrf_engine import SummaryBuilder
+from mrf_sketch import ApproxSummaryBuilder, APPROX_K, APPROX_RANK_ERROR
+from mrf_index import CodeIndex
+from mrf_jobs import JobStore, Progress
+from mrf_schema import SchemaProfile, SchemaRegistry, compile_slim_builder
+from mrf_delta import DigestStore, Carry, incremental_counts, incremental_summary, delta_report, series_of
 
 ACCEPTED_INNER_EXTS = (".json", ".csv", ".ndjson", ".jsonl", ".txt", ".gz")
 MAX_DECOMPRESSED_BYTES = 200 * 1024 * 1024  # guardrail anti zip-bomb (~200MB)
 SOURCE_INNER: ContextVar[Optional[str]] = ContextVar("SOURCE_INNER", default=None)
+# identità della sorgente per la cache: url+ETag/Last-Modified o hash del contenuto
+SOURCE_ID: ContextVar[Optional[str]] = ContextVar("SOURCE_ID", default=None)
+SOURCE_VALIDATORS: ContextVar[Dict[str, str]] = ContextVar("SOURCE_VALIDATORS", default={})
+# sorgente che è già un file su disco: (path, inner ZIP) -> il parse può andare in un processo
+SOURCE_FILE: ContextVar[Optional[Tuple[str, Optional[str]]]] = ContextVar("SOURCE_FILE", default=None)
+# avanzamento del job in background che sta girando (None nelle richieste sincrone)
+JOB_PROGRESS: ContextVar[Optional[Progress]] = ContextVar("JOB_PROGRESS", default=None)
+# fan-out sugli index CMS (opt-in con fan_out=true): file in parallelo e tetto ai file
+FANOUT_WORKERS = int(os.getenv("COSTVISTA_FANOUT_WORKERS", "4"))
+FANOUT_MAX_FILES = int(os.getenv("COSTVISTA_FANOUT_MAX_FILES", "50"))
+CHUNK_CHARS = 1024 * 1024  # dimensione dei chunk di testo passati ai parser streaming
+FETCH_CHUNK = 256 * 1024   # byte letti per volta da rete/disco
+
+T = TypeVar("T")
+# chunk di testo, consumati nel thread di parse (la rete arriva dall'event loop via iter_sync)
+TextChunks = Iterator[str]
+
+# cache risultati (LRU in memoria + spill su disco opzionale)
+RESULT_CACHE = ResultCache.from_env()
+# indice persistente code -> righe (SQLite, opzionale): query per pochi codici senza riparsare
+CODE_INDEX = CodeIndex.from_env()
+# sorgenti da portare in cache all'avvio (manifest), readiness su /health/ready
+WARMUP = mrf_warmup.WarmUp.from_env()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # un solo client HTTP (keep-alive/HTTP2) per tutto il processo
+    await mrf_http.start_shared()
+    # job rimasti a metà (riavvio/deploy): ripartono
+    for job_id, request in await asyncio.to_thread(JOBS.unfinished):
+        _schedule_job(job_id, request)
+    # warm-up in background: l'istanza è "ready" quando le sorgenti del manifest sono in cache
+    WARMUP.start(_warm_source)
+    try:
+        yield
+    finally:
+        await WARMUP.stop()
+        await mrf_http.stop_shared()
+        mrf_exec.shutdown()
+        mrf_gzip.shutdown()
 
+app = FastAPI(title="Costvista API", lifespan=lifespan)
 
-
-app = FastAPI(title="Costvista API")
+@app.exception_handler(mrf_exec.JobCancelled)
+async def _job_cancelled(request: Request, exc: mrf_exec.JobCancelled):
+    # il client non c'è più: nessuno legge la risposta (499 come nginx, per i log)
+    return Response(status_code=499)
 
 # ---------------- CORS ----------------
 # Consenti esplicitamente il front in dev e *.vercel.app in preview/prod.
@@ -36,71 +96,276 @@ app.add_middleware(
 # --------------- Health ---------------
 @app.get("/health")
 def health():
+    # liveness: il processo risponde (per il load balancer c'è /health/ready)
     return {"ok": True}
 
+@app.get("/health/ready")
+def ready():
+    """Readiness: 503 finché il warm-up del manifest non è finito (vedi mrf_warmup)."""
+    body = {"ready": WARMUP.ready, "warmup": WARMUP.status()}
+    return JSONResponse(body, status_code=200 if body["ready"] else 503)
+
+# --------------- Metriche (Prometheus) ---------------
+@app.get("/metrics")
+def metrics():
+    if not mrf_metrics.METRICS:
+        raise HTTPException(404, "Metrics are disabled (set COSTVISTA_METRICS=1).")
+    return Response(mrf_metrics.REGISTRY.render(), media_type=mrf_metrics.CONTENT_TYPE)
+
 # ------------- Helpers ---------------
-def _text_from_zip_bytes(data: bytes) -> tuple[str, Optional[str]]:
-    """Ritorna (text, inner_name) dal contenuto ZIP in bytes.
-       Estrae il primo file 'utile'. Se è .gz, lo scompatta."""
+def _zip_member_names(zf: zipfile.ZipFile) -> List[str]:
+    return [
+        n for n in zf.namelist()
+        if not n.endswith("/") and any(n.lower().endswith(ext) for ext in ACCEPTED_INNER_EXTS)
+    ]
+
+def _zip_inner_required(names: List[str], message: str = "This ZIP contains multiple files. Pick one.") -> HTTPException:
+    """409 con i membri utili dello ZIP: il chiamante ne sceglie uno e riprova."""
+    return HTTPException(
+        status_code=409,
+        detail={
+            "error": "zip_inner_required",
+            "message": message,
+            "inner_files": names[:50],  # safety
+        },
+    )
+
+def _open_zip_member(src: Any, name: Optional[str] = None, pick: bool = False) -> Tuple[str, Iterator[bytes]]:
+    """Ritorna (inner_name, chunk decompressi) del primo file 'utile' dello ZIP (o di `name`).
+       Il membro si legge a chunk col guardrail MAX_DECOMPRESSED_BYTES; se è .gz, lo scompatta.
+       `src` può essere anche un mrf_http.RangeReader (ZIP remoto letto a blocchi).
+       pick=True: se `name` non c'è, 409 zip_inner_required con la lista invece del 404."""
     try:
-        with zipfile.ZipFile(io.BytesIO(data)) as zf:
-            # scegli il primo membro rilevante
-            candidates = [
-                n for n in zf.namelist()
-                if not n.endswith("/") and any(n.lower().endswith(ext) for ext in ACCEPTED_INNER_EXTS)
-            ]
-            if not candidates:
-                raise HTTPException(415, "ZIP does not contain a .json/.csv/.ndjson file.")
-            inner = candidates[0]
-            with zf.open(inner, "r") as f:
-                payload = f.read(MAX_DECOMPRESSED_BYTES + 1)
-            if len(payload) > MAX_DECOMPRESSED_BYTES:
-                raise HTTPException(413, "Decompressed ZIP content too large.")
-            # se l'interno è gz, scompatta
-            if inner.lower().endswith(".gz"):
-                try:
-                    payload = gzip.decompress(payload)
-                except Exception:
-                    raise HTTPException(400, "Inner GZ in ZIP is invalid.")
-            return payload.decode("utf-8", errors="replace"), inner
-    except HTTPException:
+        zf = zipfile.ZipFile(src)
+    except mrf_http.RemoteChanged as e:
+        raise HTTPException(409, f"{e} Retry the request.")
+    except httpx.HTTPError:
         raise
     except Exception:
         raise HTTPException(400, "Invalid ZIP file.")
+    # scegli il primo membro rilevante
+    candidates = _zip_member_names(zf)
+    if not candidates:
+        zf.close()
+        raise HTTPException(415, "ZIP does not contain a .json/.csv/.ndjson file.")
+    if name is not None and name not in candidates:
+        zf.close()
+        if pick:
+            raise _zip_inner_required(candidates, f"Inner file not found in ZIP: {name}. Pick one.")
+        raise HTTPException(404, f"Inner file not found in ZIP: {name}")
+    inner = name or candidates[0]
+
+    def _member() -> Iterator[bytes]:
+        total = 0
+        try:
+            with zf, zf.open(inner, "r") as f:
+                while True:
+                    chunk = f.read(FETCH_CHUNK)
+                    if not chunk:
+                        break
+                    total += len(chunk)
+                    if total > MAX_DECOMPRESSED_BYTES:
+                        raise HTTPException(413, "Decompressed ZIP content too large.")
+                    yield chunk
+        except (zipfile.BadZipFile, zlib.error, EOFError):
+            raise HTTPException(400, "Invalid ZIP file.")
+        except mrf_http.RemoteChanged as e:
+            raise HTTPException(409, f"{e} Retry the request.")
 
+    body: Iterable[bytes] = mrf_metrics.wrap(_member(), "unzip")
+    # se l'interno è gz, scompatta
+    if inner.lower().endswith(".gz"):
+        body = _guard_gz(_gunzip(body), "Inner GZ in ZIP is invalid.")
+    return inner, body
 
-async def read_text(url_or_path: str) -> str:
-    """Legge file remoto (http/https) o locale ./public.
-       Supporta .gz e .zip; per .zip ritorna il testo del primo file utile."""
+def _guard_gz(chunks: Iterator[bytes], msg: str) -> Iterator[bytes]:
+    try:
+        yield from chunks
+    except zlib.error:
+        raise HTTPException(400, msg)
+
+class ZipMembers:
+    """Sorgente ZIP in modalità "tutti i membri": il file su disco e i membri utili,
+       da elaborare ognuno per conto suo (vedi _zip_all_entry)."""
+    def __init__(self, path: str, members: List[str]):
+        self.path = path
+        self.members = members
+
+def _zip_members_of(path: str) -> ZipMembers:
+    try:
+        with zipfile.ZipFile(path) as zf:
+            members = _zip_member_names(zf)
+    except zipfile.BadZipFile:
+        raise HTTPException(400, "Invalid ZIP file.")
+    if not members:
+        raise HTTPException(415, "ZIP does not contain a .json/.csv/.ndjson file.")
+    return ZipMembers(path, members)
+
+def _iter_file(fp: Path) -> Iterator[bytes]:
+    with fp.open("rb") as f:
+        while True:
+            chunk = f.read(FETCH_CHUNK)
+            if not chunk:
+                return
+            yield chunk
+
+# --- fasi misurate (mrf_metrics; no-op se la richiesta non ha una Trace) ---
+def _gunzip(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    # gzip multi-member/BGZF: i member si scompattano in parallelo (mrf_gzip)
+    return mrf_metrics.wrap(mrf_gzip.iter_gunzip(chunks), "gunzip")  # type: ignore[return-value]
+
+def _decode(chunks: Iterable[bytes]) -> Iterator[str]:
+    return mrf_metrics.wrap(iter_decode(chunks), "decode")  # type: ignore[return-value]
+
+# --- avanzamento dei job (no-op fuori da un job) ---
+def _stage(name: str) -> None:
+    prog = JOB_PROGRESS.get()
+    if prog is not None:
+        prog.stage = name
+
+def _count_bytes(chunks: Iterator[bytes], total: Optional[int] = None) -> Iterator[bytes]:
+    prog = JOB_PROGRESS.get()
+    if prog is None:
+        return chunks
+    if total is not None:  # somma: il fan-out legge più file per lo stesso job
+        prog.bytes_total = (prog.bytes_total or 0) + total
+
+    def _counted() -> Iterator[bytes]:
+        for c in chunks:
+            prog.bytes_read += len(c)
+            yield c
+    return _counted()
+
+def _acount_bytes(chunks: AsyncIterator[bytes], total: Optional[int] = None) -> AsyncIterator[bytes]:
+    prog = JOB_PROGRESS.get()
+    if prog is None:
+        return chunks
+    if total is not None:  # somma: il fan-out legge più file per lo stesso job
+        prog.bytes_total = (prog.bytes_total or 0) + total
+
+    async def _counted() -> AsyncIterator[bytes]:
+        async for c in chunks:
+            prog.bytes_read += len(c)
+            yield c
+    return _counted()
+
+def _count_rows(rows: Iterator[Dict[str, Any]], prog: Progress) -> Iterator[Dict[str, Any]]:
+    for r in rows:
+        prog.rows_parsed += 1
+        yield r
+
+def _file_text_chunks(path: str, inner: Optional[str] = None, name: Optional[str] = None) -> Iterator[str]:
+    """Chunk di testo di un file su disco: .zip -> membro `inner` (o il primo utile),
+       .gz -> gunzip. `name` decide il tipo quando il path non ha l'estensione (upload)."""
+    kind = (name or path).lower()
+    if kind.endswith(".zip"):
+        _, body = _open_zip_member(path, inner)
+        return _decode(body)
+    raw = _count_bytes(mrf_metrics.wrap(_iter_file(Path(path)), "fetch"), os.path.getsize(path))  # type: ignore[arg-type]
+    if kind.endswith(".gz"):
+        return _decode(_guard_gz(_gunzip(raw), "Invalid GZ file."))
+    return _decode(raw)
+
+
+def _fetch_counter() -> Callable[[int], None]:
+    """Conta i byte scaricati fuori dal nostro contesto (blocchi Range, nell'event loop)."""
+    trace = mrf_metrics.TRACE.get()
+    prog = JOB_PROGRESS.get()
+
+    def _count(n: int) -> None:
+        if trace is not None:
+            trace.add("fetch", n)
+        if prog is not None:
+            prog.bytes_read += n
+    return _count
+
+def _set_remote_id(url: str, validators: Dict[str, str], inner: Optional[str]) -> None:
+    # senza ETag/Last-Modified non sappiamo se il file è cambiato: niente cache
+    if validators:
+        SOURCE_ID.set("url:" + url + "|" + validators.get("etag", "") + "|" + validators.get("last_modified", "")
+                      + ("|inner=" + inner if inner else ""))
+        SOURCE_VALIDATORS.set(validators)
+
+@asynccontextmanager
+async def open_source(url_or_path: str, validators: Optional[Dict[str, str]] = None,
+                      zip_all: bool = False, inner: Optional[str] = None) -> AsyncIterator[Union[TextChunks, ZipMembers, None]]:
+    """Apre un file remoto (http/https) o locale ./public e fornisce chunk di testo
+       man mano che arrivano: download -> gunzip -> decode UTF-8, senza mai tenere il file intero.
+       Supporta .gz e .zip; per .zip usa il membro `inner` o il primo file utile (SOURCE_INNER),
+       oppure con zip_all fornisce ZipMembers (lo ZIP remoto viene scritto in un file temporaneo).
+       Uno ZIP remoto si legge con richieste Range (directory centrale + il solo membro
+       scelto) se il server le supporta, altrimenti si scarica intero come prima.
+       Imposta SOURCE_ID (identità per la cache). Con `validators` la GET è condizionale:
+       se il server risponde 304 e non c'è un body nel mirror, fornisce None."""
     # reset info 'inner' per questa richiesta
     SOURCE_INNER.set(None)
+    SOURCE_ID.set(None)
+    SOURCE_VALIDATORS.set({})
+    SOURCE_FILE.set(None)
+    pick = inner is not None  # membro chiesto esplicitamente: se non c'è, 409 con la lista
 
     # ---- remoto ----
     if url_or_path.lower().startswith(("http://", "https://")):
-        async with httpx.AsyncClient(timeout=120) as client:
-            r = await client.get(url_or_path)
-            r.raise_for_status()
+        async with mrf_http.http_pool() as pool:
             url_l = url_or_path.lower()
-            content_enc = (r.headers.get("Content-Encoding") or "").lower()
-            content_type = (r.headers.get("Content-Type") or "").lower()
-
-            # URL o header indicano ZIP
-            if url_l.endswith(".zip") or "zip" in content_type:
-                text, inner = _text_from_zip_bytes(r.content)
-                SOURCE_INNER.set(inner)
-                return text
-
-            # URL .gz esplicito -> prova a gunzip, altrimenti usa r.text
-            if url_l.endswith(".gz"):
-                try:
-                    raw = gzip.decompress(r.content)
-                    return raw.decode("utf-8", errors="replace")
-                except Exception:
-                    return r.text
-
-            # altrimenti usa r.text (HTTPX di solito ha già gestito Content-Encoding)
-            return r.text
-
+            # ZIP con un membro solo da leggere: niente download dell'archivio (se c'è nel
+            # mirror invece si passa dal GET condizionale, che lo serve dal disco)
+            if url_l.endswith(".zip") and not zip_all and not await asyncio.to_thread(pool.validators, url_or_path):
+                src = await pool.open_range(url_or_path, validators)
+                if src is not None:
+                    try:
+                        _set_remote_id(url_or_path, src.validators, inner)
+                        if src.not_modified:
+                            yield None
+                            return
+                        src.on_fetch = _fetch_counter()
+                        src.on_fetch(len(src.tail))
+                        reader = src.reader(asyncio.get_running_loop())
+                        member, body = await asyncio.to_thread(_open_zip_member, reader, inner, pick)
+                        SOURCE_INNER.set(member)
+                        yield _decode(body)
+                    finally:
+                        src.close()
+                    return
+            async with pool.fetch(url_or_path, validators) as r:
+                _set_remote_id(url_or_path, r.validators, inner)
+                if not r.has_body:
+                    yield None
+                    return
+                content_type = (r.headers.get("Content-Type") or "").lower()
+                # Content-Length è la dimensione sul filo: vale solo senza Content-Encoding
+                length = r.headers.get("Content-Length")
+                total = int(length) if length and length.isdigit() and not r.headers.get("Content-Encoding") else None
+
+                # URL o header indicano ZIP: la central directory è in fondo, serve il body
+                if url_l.endswith(".zip") or ("zip" in content_type and "gzip" not in content_type):
+                    if zip_all:
+                        fd, tmp = tempfile.mkstemp(suffix=".zip")
+                        try:
+                            with os.fdopen(fd, "wb") as f:
+                                async for chunk in _acount_bytes(mrf_metrics.awrap(r.aiter_bytes(), "fetch"), total):
+                                    f.write(chunk)
+                            yield _zip_members_of(tmp)
+                        finally:
+                            os.unlink(tmp)
+                        return
+                    data = b"".join([c async for c in _acount_bytes(mrf_metrics.awrap(r.aiter_bytes(), "fetch"), total)])
+                    member, body = _open_zip_member(io.BytesIO(data), inner, pick)
+                    SOURCE_INNER.set(member)
+                    yield _decode(body)
+                    return
+
+                # sul loop restano solo i byte dal socket: gunzip (parallelo per i gzip
+                # multi-member, mrf_gzip) e decode girano nel thread di parse, che tira i
+                # chunk con iter_sync (l'attesa non è di nessuna fase).
+                # HTTPX decodifica già Content-Encoding; per .gz esplicito gunzip solo se
+                # il body inizia davvero col magic gzip
+                abody = _acount_bytes(mrf_metrics.awrap(r.aiter_bytes(), "fetch"), total)
+                body: Iterable[bytes] = mrf_metrics.wrap(iter_sync(abody, asyncio.get_running_loop()), None)
+                if url_l.endswith(".gz"):
+                    body = _guard_gz(iter_maybe_gunzip(body, _gunzip), "Invalid GZ file.")
+                yield _decode(body)
+        return
 
     # ---- locale (./public) ----
     rel = url_or_path.lstrip("/")
@@ -109,23 +374,43 @@ async def read_text(url_or_path: str) -> str:
     if not fp.exists():
         raise HTTPException(404, f"Local file not found: {fp}")
 
+    SOURCE_ID.set("sha256:" + await asyncio.to_thread(file_digest, fp) + ("|inner=" + inner if inner else ""))
     p = rel.lower()
     if p.endswith(".zip"):
-        text, inner = _text_from_zip_bytes(fp.read_bytes())
-        SOURCE_INNER.set(inner)
-        return text
-    if p.endswith(".gz"):
-        return gzip.decompress(fp.read_bytes()).decode("utf-8", errors="replace")
-    return fp.read_text(encoding="utf-8")
+        if zip_all:
+            yield _zip_members_of(str(fp))
+            return
+        member, body = _open_zip_member(fp, inner, pick)
+        SOURCE_INNER.set(member)
+        SOURCE_FILE.set((str(fp), member))
+        yield _decode(body)
+        return
+    SOURCE_FILE.set((str(fp), None))
+    yield _file_text_chunks(str(fp))
+
+
+async def _consume(chunks: TextChunks, fn: Callable[[Iterator[str]], T],
+                   token: Optional[mrf_exec.CancelToken] = None) -> T:
+    """Esegue fn (parser sincrono) nel pool di parse, alimentandolo con i chunk man mano
+       che arrivano (per le sorgenti remote gunzip e decode girano qui, l'event loop
+       scarica soltanto). Con `token` il parse si ferma al chunk successivo quando la
+       richiesta viene cancellata."""
+    return await mrf_exec.run_thread(fn, mrf_exec.checked(chunks, token), token=token)
 
 
 
 # --- CMS index detection (Cigna/BCBS/etc.) -----------------------------------
-from typing import Iterable
+
+class IndexDetected(HTTPException):
+    """Il 409 index_detected di sempre, ma con tutti gli URL (per il fan-out)."""
+    def __init__(self, urls: List[str], **kw: Any):
+        super().__init__(**kw)
+        self.urls = urls
 
 def _raise_index_suggestions(urls: List[str]):
     # 409 per "conflict/mismatch" fra ciò che ci si aspettava (tariffe) e ciò che è arrivato (index)
-    raise HTTPException(
+    raise IndexDetected(
+        urls,
         status_code=409,
         detail={
             "error": "index_detected",
@@ -134,43 +419,11 @@ def _raise_index_suggestions(urls: List[str]):
         },
     )
 
-def _extract_in_network_urls(obj: Any) -> List[str]:
-    """
-    Se 'obj' è un Table of Contents (index) CMS, estrae gli URL dei file in_network.
-    Restituisce [] se non è un index.
-    """
-    urls: List[str] = []
-
-    def _push_from(seq: Iterable[Dict[str, Any]]):
-        for item in seq:
-            if not isinstance(item, dict):
-                continue
-            loc = item.get("location") or item.get("url") or item.get("link")
-            if isinstance(loc, str) and loc.strip():
-                urls.append(loc.strip())
-
-    if isinstance(obj, dict):
-        # Struttura piatta: { in_network_files: [...] }
-        if isinstance(obj.get("in_network_files"), list):
-            _push_from(obj["in_network_files"])
-
-        # Struttura annidata: { reporting_structure: [{ in_network_files: [...]}, ...] }
-        if isinstance(obj.get("reporting_structure"), list):
-            for rs in obj["reporting_structure"]:
-                if isinstance(rs, dict) and isinstance(rs.get("in_network_files"), list):
-                    _push_from(rs["in_network_files"])
-
-        # Alcuni index hanno "files": [{type: "in_network", location: "..."}]
-        if isinstance(obj.get("files"), list):
-            in_net = [f for f in obj["files"] if isinstance(f, dict) and str(f.get("type","")).lower().startswith("in")]
-            _push_from(in_net)
-
-    return list(dict.fromkeys(urls))  # dedup, preserva ordine
-
-
 _number_re = re.compile(r"[^\d\.\-]")  # tieni solo 0-9 . -
 
 def _coerce_float(val) -> float:
+    if type(val) is str and val.isascii() and val.replace(".", "", 1).isdigit():
+        return float(val)  # caso comune ("123.45"): niente strip/regex
     try:
         if val is None:
             return 0.0
@@ -267,15 +520,21 @@ def normalize_rows(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """Normalizza tutte le righe allo schema: code, description, provider_name, rate_type, negotiated_rate (+ resto)."""
     if not rows:
         return rows
-    headers = list(rows[0].keys())
-    mapping = _build_mapping(headers)
-    normed = [_apply_mapping_to_row(r, mapping) for r in rows]
-    for r in normed:
-        r["negotiated_rate"] = _coerce_float(r.get("negotiated_rate"))
-        for k in ("code", "description", "provider_name", "rate_type"):
-            if k in r:
-                r[k] = str(r.get(k) or "").strip()
-    return normed
+    return list(iter_normalized(dict(r) for r in rows))
+
+def iter_normalized(rows: Iterable[Dict[str, Any]], convert: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None) -> Iterator[Dict[str, Any]]:
+    """Come normalize_rows ma in streaming e IN PLACE (le righe appena parsate sono
+       nostre): il profilo di schema si sceglie con le chiavi della prima riga
+       (o `convert` già scelto, es. dalla prima riga del file per una sua fetta)."""
+    it = iter(rows)
+    first = next(it, None)
+    if first is None:
+        return
+    if convert is None:
+        convert = SCHEMAS.converter(list(first.keys()))
+    yield convert(first)
+    for row in it:
+        yield convert(row)
 
 # Hook AI opzionale (disattivo di default)
 USE_LLM_SCHEMA = False
@@ -285,180 +544,953 @@ def _ai_suggest_mapping(headers_unknown: List[str]) -> Dict[str, str]:
     # Qui potrai chiamare il tuo LLM e restituire, ad es.: {"Allowed Amount ($)": "negotiated_rate"}
     return {}
 
+# profili per firma di header: mapping calcolato una volta (anche su disco) + convertitore compilato
+SCHEMAS = SchemaRegistry.from_env(_build_mapping, _coerce_float, CANON_FIELDS)
+
 # ---------------- CSV parsing ----------------
+def _text_chunks(text: str, size: int = CHUNK_CHARS) -> Iterator[str]:
+    """Spezza un testo già in memoria in chunk per i parser streaming."""
+    for i in range(0, len(text), size):
+        yield text[i:i + size]
+
+def _iter_lines(chunks: Iterable[str]) -> Iterator[str]:
+    """Righe (con il loro '\\n') da una sequenza di chunk, come iterare uno StringIO."""
+    pending = ""
+    for chunk in chunks:
+        pending += chunk
+        if "\n" not in chunk:
+            continue
+        lines = pending.split("\n")
+        pending = lines.pop()
+        for ln in lines:
+            yield ln + "\n"
+    if pending:
+        yield pending
+
 def parse_csv(text: str) -> List[Dict[str, Any]]:
     """CSV robust parser con sniff + fallback e normalizzazione header a batch."""
+    return list(iter_csv(_text_chunks(text)))
+
+def _csv_quote(fmt: Dict[str, Any]) -> Optional[str]:
+    """Il quotechar del dialetto (sniffato o esplicito); None con QUOTE_NONE: nessun
+       carattere apre un campo quotato."""
+    d = csv.reader((), **fmt).dialect
+    return None if d.quoting == csv.QUOTE_NONE or not d.quotechar else d.quotechar
+
+def _keep_records(lines: Iterable[str], keep: Keep, open_quote: bool = False,
+                  quote: Optional[str] = '"') -> Iterator[str]:
+    """Raggruppa le righe fisiche in record CSV (virgolette bilanciate, quindi anche
+       campi quotati con a capo) e passa solo i record il cui testo supera `keep`.
+       open_quote: il primo record è già iniziato (nelle righe di sniff) e passa intero.
+       quote: il quotechar del dialetto (vedi _csv_quote)."""
+    rec: List[str] = []
+    quotes = 1 if open_quote else 0
+    force = open_quote
+    for ln in lines:
+        rec.append(ln)
+        if quote is not None:
+            quotes += ln.count(quote)
+        if quotes % 2:
+            continue
+        if force or keep(rec[0] if len(rec) == 1 else "".join(rec)):
+            yield from rec
+        rec, quotes, force = [], 0, False
+    yield from rec  # record troncato a fine file: decide il csv.reader
+
+SLIM_BLOCK = 4096  # righe per blocco nel lettore CSV a proiezione
+
+def _csv_blocks(lines: Iterable[str], fmt: Dict[str, Any], width: int) -> Iterator[List[List[str]]]:
+    """Record CSV a blocchi di ~SLIM_BLOCK righe, come liste con (almeno) i primi
+       `width` campi; i record vuoti si saltano come fa DictReader. Un blocco senza
+       virgolette (quasi sempre) si spezza con str.split fermandosi all'ultimo campo
+       che serve; altrimenti le righe con virgolette (anche record su più righe
+       fisiche) passano dal csv.reader."""
+    it = iter(lines)
+    d = csv.reader((), **fmt).dialect
+    if d.escapechar or d.skipinitialspace:
+        reader = csv.reader(it, **fmt)
+        while True:
+            block = list(itertools.islice(reader, SLIM_BLOCK))
+            if not block:
+                return
+            yield [r for r in block if r]
+    delim, quote = d.delimiter, d.quotechar or '"'
+    rec: List[str] = []  # record con virgolette ancora aperto (continua nel blocco dopo)
+    quotes = 0
+    while True:
+        chunk = list(itertools.islice(it, SLIM_BLOCK))
+        if not chunk:
+            break
+        text = "".join(chunk)
+        if (not rec and quote not in text and "\0" not in text
+                and ("\r" not in text or text.count("\r") == sum(map(str.endswith, chunk, itertools.repeat("\r\n"))))):
+            # \r solo come \r\n a fine riga: rstrip toglie esattamente il terminatore
+            yield [r.split(delim, width) for r in map(str.rstrip, chunk, itertools.repeat("\r\n")) if r]
+            continue
+        out: List[List[str]] = []
+        for ln in chunk:
+            if not rec:
+                s = ln[:-1] if ln.endswith("\n") else ln
+                if s.endswith("\r"):
+                    s = s[:-1]
+                if quote not in s and "\r" not in s and "\0" not in s:
+                    if s:
+                        out.append(s.split(delim, width))
+                    continue
+            rec.append(ln)
+            quotes += ln.count(quote)
+            if quotes % 2 == 0:
+                out.extend(r for r in csv.reader(rec, **fmt) if r)
+                rec, quotes = [], 0
+        yield out
+    if rec:
+        yield [r for r in csv.reader(rec, **fmt) if r]
+
+def _coerce_rates(vals: List[Any]) -> List[float]:
+    """_coerce_float su un blocco di valori: il caso comune ("123.45") senza chiamate."""
+    return [float(v) if type(v) is str and v.isascii() and v.replace(".", "", 1).isdigit() else _coerce_float(v)
+            for v in vals]
+
+def _slim_csv_rows(blocks: Iterable[List[List[str]]], cols: List[Tuple[str, Optional[int], str]],
+                   width: int) -> Iterator[Dict[str, Any]]:
+    """Righe con le sole colonne di `cols` (SchemaProfile.projection), costruite a
+       blocchi (_csv_blocks) col costruttore compilato per la proiezione.
+       I record più corti di `width` campi si completano con "" (come restval)."""
+    build = compile_slim_builder(cols, _coerce_rates)
+    for block in blocks:
+        if block and min(map(len, block)) < width:
+            block = [r if len(r) >= width else r + [""] * (width - len(r)) for r in block]
+        yield from build(block)
+
+def iter_csv(chunks: Iterable[str], keep: Optional[Keep] = None, slim: bool = False) -> Iterator[Dict[str, Any]]:
+    """Come parse_csv ma in streaming: sniff sui primi 4KB, poi riga per riga.
+       Con `keep` i record scartati non arrivano nemmeno al csv.reader.
+       slim=True (le righe non vanno restituite): solo le colonne che servono a
+       summary e filtri, lette per indice senza costruire la riga intera."""
+    lines = _iter_lines(chunks)
+    head, fmt = _csv_head(lines)
+    if keep is not None:
+        quote = _csv_quote(fmt)
+        odd = quote is not None and sum(ln.count(quote) for ln in head) % 2 == 1
+        lines = _keep_records(lines, keep, open_quote=odd, quote=quote)
+    src = itertools.chain(head, lines)
+
+    # ---- profilo di schema UNA VOLTA per i fieldnames ----
+    fieldnames = next(csv.reader(src, **fmt), None)  # legge solo il record di intestazione
+    if fieldnames is None:
+        return
+    yield from _csv_rows(src, fmt, SCHEMAS.profile(fieldnames), slim)
+
+def _csv_head(lines: Iterator[str]) -> Tuple[List[str], Dict[str, Any]]:
+    """(prime righe, ~4KB senza BOM; formato per csv.reader) sniffato su quelle righe."""
+    head: List[str] = []
+    size = 0
+    for ln in lines:
+        head.append(ln)
+        size += len(ln)
+        if size >= 4096:
+            break
     # rimuovi BOM
-    raw = text.lstrip("\ufeff")
-    src = io.StringIO(raw)
+    if head:
+        head[0] = head[0].lstrip("\ufeff")
 
     # prova a sniffare il dialetto; fallback su delimitatori comuni
-    sample = raw[:4096]
-    reader: csv.DictReader
+    sample = "".join(head)[:4096]
+    fmt: Dict[str, Any] = {}
     try:
-        dialect = csv.Sniffer().sniff(sample, delimiters=[",", ";", "\t", "|"])
-        reader = csv.DictReader(src, dialect=dialect, restkey="_extra", restval="")
+        fmt["dialect"] = csv.Sniffer().sniff(sample, delimiters=[",", ";", "\t", "|"])
     except Exception:
-        reader = None  # type: ignore
         for delim in [";", "\t", "|", ","]:
-            src.seek(0)
-            tmp = csv.DictReader(src, delimiter=delim, restkey="_extra", restval="")
-            if tmp.fieldnames and len([h for h in tmp.fieldnames if h is not None]) > 1:
-                reader = tmp  # type: ignore
+            header = next(csv.reader(iter(head), delimiter=delim), None)
+            if header and len(header) > 1:
+                fmt["delimiter"] = delim
+                break
+        # altrimenti estremo fallback: dialetto di default
+    return head, fmt
+
+def _csv_rows(src: Iterable[str], fmt: Dict[str, Any], profile: SchemaProfile, slim: bool = False) -> Iterator[Dict[str, Any]]:
+    """Righe normalizzate dai record CSV dopo l'intestazione (già letta: profile.headers)."""
+    fieldnames = profile.headers
+    if slim:
+        cols = profile.projection(UPLOAD_CODE_KEYS)
+        width = max((i for _, i, _ in cols if i is not None), default=-1) + 1
+        yield from _slim_csv_rows(_csv_blocks(src, fmt, width), cols, width)
+        return
+    convert = profile.converter(fixed=True)
+    n = len(fieldnames)
+    for row in csv.reader(src, **fmt):
+        if not row:
+            continue
+        # come csv.DictReader(restkey="_extra", restval=""), senza il suo overhead per riga
+        d = dict(zip(fieldnames, row))
+        if len(row) > n:
+            d["_extra"] = row[n:]
+        elif len(row) < n:
+            for key in fieldnames[len(row):]:
+                d[key] = ""
+        # mapping + coerzioni "soft" in un passaggio, sulla riga stessa
+        yield convert(d)
+
+# --------------- Pipeline righe (streaming) ---------------
+def _iter_source_rows(chunks: Iterable[str], shape_msg: str, keep: Optional[Keep] = None,
+                      slim: bool = False) -> Iterator[Dict[str, Any]]:
+    """
+    Righe normalizzate da testo a chunk: JSON (pull-parser, anche CMS in-network
+    annidato), NDJSON o CSV (normalizzato già da iter_csv, una volta sola).
+    Gli errori di forma diventano HTTPException come prima.
+    `keep` (RecordPrefilter) scarta già nel parser i record senza i codici richiesti.
+    slim=True: le righe servono solo a summary/filtri (i CSV leggono solo quelle colonne).
+    """
+    with mrf_metrics.span("sniff"):
+        fmt, cur = sniff(chunks)
+    mrf_metrics.set_format(fmt)
+    prog = JOB_PROGRESS.get()
+    try:
+        if fmt == "ndjson":
+            rows = _normalized(iter_ndjson_rows(cur, keep))
+        elif fmt == "json":
+            rows = _normalized(iter_json_rows(cur, keep))
+        else:
+            # nei CSV la normalizzazione è dentro il parser (convertitore compilato)
+            rows = mrf_metrics.wrap_rows(iter_csv(cur.remaining(), keep, slim), "parse")
+        yield from (rows if prog is None else _count_rows(rows, prog))
+    except IndexFileDetected as e:
+        _raise_index_suggestions(e.urls)  # 409 + suggestions (URL)
+    except NoRowsFound:
+        raise HTTPException(400, shape_msg)
+    except (JsonShapeError, json.JSONDecodeError) as e:
+        raise HTTPException(400, f"Invalid JSON: {e}")
+
+def _normalized(rows: Iterable[Dict[str, Any]],
+                convert: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None) -> Iterable[Dict[str, Any]]:
+    if not mrf_metrics.active():
+        return iter_normalized(rows, convert)
+    return mrf_metrics.wrap_rows(iter_normalized(mrf_metrics.wrap_rows(rows, "parse"), convert), "normalize")
+
+def _filter_codes(rows: Iterable[Dict[str, Any]], codes: List[str], keys: Tuple[str, ...] = ("code",)) -> Iterator[Dict[str, Any]]:
+    """Tiene solo le righe il cui codice (in una delle chiavi) è fra quelli richiesti."""
+    if not codes:
+        yield from rows
+        return
+    code_set = set(map(str, codes))
+    for r in rows:
+        for k in keys:
+            if k in r and str(r.get(k)) in code_set:
+                yield r
                 break
-        if reader is None:  # estremo fallback
-            src.seek(0)
-            reader = csv.DictReader(src, restkey="_extra", restval="")
-
-    # ---- costruisci il mapping UNA VOLTA usando i fieldnames ----
-    fieldnames = [h for h in (getattr(reader, "fieldnames", None) or [])]
-    mapping = _build_mapping(fieldnames)
-
-    rows: List[Dict[str, Any]] = []
-    for row in reader:
-        row.pop(None, None)  # safety
-        # applica mapping a livello di riga
-        row = _apply_mapping_to_row(row, mapping)
-
-        # coerzioni "soft" (non rompono se mancanti)
-        row["negotiated_rate"] = _coerce_float(row.get("negotiated_rate"))
-        for k in ("code", "description", "provider_name", "rate_type"):
-            if k in row:
-                row[k] = str(row.get(k) or "").strip()
-
-        rows.append(row)
-
-    return rows
 
 # --------------- Stat helpers ---------------
-def _median(nums: List[float]) -> float:
-    if not nums: return 0.0
-    s = sorted(nums); n = len(s); m = n // 2
-    return float(s[m]) if n % 2 else (s[m-1] + s[m]) / 2.0
-
-def _percentile(nums: List[float], p: float) -> float:
-    if not nums: return 0.0
-    s = sorted(nums)
-    if len(s) == 1: return float(s[0])
-    k = (len(s) - 1) * (p / 100.0)
-    f = int(k); c = min(f + 1, len(s) - 1)
-    if f == c: return float(s[int(k)])
-    return float(s[f] + (s[c] - s[f]) * (k - f))
-
-def _summarize(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
-    by_code: Dict[str, List[Dict[str, Any]]] = {}
-    for r in rows:
-        code = str(r.get("code", "")).strip()
-        if not code: continue
-        by_code.setdefault(code, []).append(r)
-
-    out = []
-    for code, items in by_code.items():
-        vals = [float(i.get("negotiated_rate") or 0) for i in items]
-        if not vals: continue
-        desc = next((str(i.get("description") or "").strip() for i in items if str(i.get("description") or "")), "")
-        top3 = sorted(
-            [{"provider_name": str(i.get("provider_name") or ""), "negotiated_rate": float(i.get("negotiated_rate") or 0)} for i in items],
-            key=lambda x: x["negotiated_rate"]
-        )[:3]
-        out.append({
-            "code": code, "description": desc, "count": len(vals),
-            "min": float(min(vals)), "median": _median(vals),
-            "p25": _percentile(vals, 25), "p75": _percentile(vals, 75),
-            "max": float(max(vals)), "top3": top3
-        })
-    out.sort(key=lambda s: s["code"])
-    return {"summary": out, "rows": rows, "count": len(rows)}
-
-# Estrai tutti i candidati utili da uno ZIP
-def _zip_candidates(data: bytes) -> list[zipfile.ZipInfo]:
-    with zipfile.ZipFile(io.BytesIO(data)) as zf:
-        infos = [m for m in zf.infolist()
-                 if not m.is_dir() and any(m.filename.lower().endswith(ext) for ext in ACCEPTED_INNER_EXTS)]
-    return infos
-
-def _read_inner_from_zip(data: bytes, inner_name: str) -> bytes:
-    with zipfile.ZipFile(io.BytesIO(data)) as zf:
-        try:
-            with zf.open(inner_name, "r") as f:
-                payload = f.read(MAX_DECOMPRESSED_BYTES + 1)
-        except KeyError:
-            raise HTTPException(404, f"Inner file not found in ZIP: {inner_name}")
-    if len(payload) > MAX_DECOMPRESSED_BYTES:
-        raise HTTPException(413, "Decompressed ZIP content too large.")
-    if inner_name.lower().endswith(".gz"):
-        try:
-            payload = gzip.decompress(payload)
-        except Exception:
-            raise HTTPException(400, "Inner GZ in ZIP is invalid.")
-    return payload
+def _summarize(rows: Iterable[Dict[str, Any]], keep_rows: bool = True, approx: bool = False) -> Dict[str, Any]:
+    """Statistiche per codice. Consuma anche un generatore; le righe si tengono solo se keep_rows.
+       Le tariffe finiscono in colonne (mrf_engine) con un solo sort per tutti i gruppi;
+       con approx=True si usano sketch KLL + top-k a memoria costante per codice (mrf_sketch)."""
+    return _finish_summary(_summary_part(rows, keep_rows, approx))
+
+def _summary_part(rows: Iterable[Dict[str, Any]], keep_rows: bool = True, approx: bool = False) -> Dict[str, Any]:
+    """Come _summarize ma si ferma prima del summary: {builder, rows?, count}.
+       Le parti si combinano con _merge_parts (es. membri ZIP elaborati in processi diversi)."""
+    builder = ApproxSummaryBuilder() if approx else SummaryBuilder()
+    kept: List[Dict[str, Any]] = []
+    total = 0
+    def _count(it: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        nonlocal total
+        for r in it:
+            total += 1
+            if keep_rows:
+                kept.append(r)
+            yield r
+
+    with mrf_metrics.span("summarize"):
+        builder.add_rows(_count(rows))
+    mrf_metrics.add("summarize", n_in=total)
+    part: Dict[str, Any] = {"builder": builder, "count": total}
+    if keep_rows:
+        part["rows"] = kept
+    return part
+
+def _merge_parts(parts: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Unisce parti (nell'ordine dato) come se le righe fossero un'unica sequenza."""
+    base = parts[0]
+    for p in parts[1:]:
+        base["builder"].merge(p["builder"])
+        base["count"] += p["count"]
+        if "rows" in base:
+            base["rows"].extend(p["rows"])
+        if "loose" in base:
+            for k, v in p["loose"].items():
+                base["loose"][k] = base["loose"].get(k, 0) + v
+            base["alt_codes_match"] = base["alt_codes_match"] and p["alt_codes_match"]
+    return base
+
+def _finish_summary(part: Dict[str, Any], carry: Optional[Carry] = None) -> Dict[str, Any]:
+    """Summary della parte; con `carry` (refresh incrementale, mrf_delta) si ricalcolano
+       solo i codici cambiati dal mese prima e si aggiungono i "digests"."""
+    extra: Dict[str, Any] = {}
+    with mrf_metrics.span("summarize"):
+        if carry is None:
+            out = part["builder"].summary(top_k=3)
+        else:
+            out, extra["digests"] = incremental_summary(part["builder"], carry, top_k=3)
+    mrf_metrics.add("summarize", len(out))
+    if "rows" not in part:
+        return {"summary": out, "count": part["count"], **extra}
+    return {"summary": out, "rows": part["rows"], "count": part["count"], **extra}
 
 # --------------- Schemi ---------------
 class ParseReq(BaseModel):
     url: str
     codes: List[str] = []
+    inner: Optional[str] = None  # ZIP: membro da leggere (default il primo utile; se non c'è 409 con la lista)
+    format: Optional[str] = None  # "json" (default) | "ndjson" | "columnar" (anche via Accept)
+    limit: Optional[int] = None  # righe per pagina: la risposta porta meta.page.next_cursor
+    cursor: Optional[str] = None  # pagina successiva (dal next_cursor precedente)
+    timings: bool = False  # meta.timings: tempi, byte/righe (e memoria) per fase
 
 class SummaryReq(BaseModel):
     url: str
     codes: List[str] = []
+    inner: Optional[str] = None  # ZIP: membro da leggere (default il primo utile; se non c'è 409 con la lista)
     include_rows: bool = True
+    approx: bool = False  # quantili approssimati (sketch) a memoria costante per codice
+    all_members: bool = False  # ZIP: tutti i membri (in parallelo, summary unico) invece del primo
+    fan_out: bool = False  # se url è un index CMS: elabora i file in_network in parallelo invece del 409
+    max_files: Optional[int] = None  # tetto ai file del fan-out (default COSTVISTA_FANOUT_MAX_FILES)
+    format: Optional[str] = None  # "json" (default) | "ndjson" | "columnar" (anche via Accept)
+    limit: Optional[int] = None  # righe per pagina: la risposta porta meta.page.next_cursor
+    cursor: Optional[str] = None  # pagina successiva (dal next_cursor precedente)
+    timings: bool = False  # meta.timings: tempi, byte/righe (e memoria) per fase
+    incremental: bool = False  # refresh mensile: risommarizza solo i codici cambiati dal mese prima (+ delta)
+    series: Optional[str] = None  # serie per l'incrementale (default: url senza la data)
+    month: Optional[str] = None  # "YYYY-MM" per l'incrementale, se l'url non ha la data
+
+# --------------- Cache risultati ---------------
+def _build_entry(rows: Iterable[Dict[str, Any]], keep_rows: bool, approx: bool = False,
+                 carry: Optional[Carry] = None) -> Dict[str, Any]:
+    """Risultato completo (tutti i codici) da mettere in cache. Oltre a summary/count
+       tiene le righe senza codice e se i codici "alternativi" degli upload coincidono
+       con `code`, così qualunque filtro `codes` si risolve senza riparsare."""
+    return _entry_from_part(_entry_part(rows, keep_rows, approx), carry)
+
+def _entry_from_part(part: Dict[str, Any], carry: Optional[Carry] = None) -> Dict[str, Any]:
+    entry = _finish_summary(part, carry)
+    entry["loose"] = part["loose"]
+    entry["alt_codes_match"] = part["alt_codes_match"]
+    return entry
+
+def _entry_part(rows: Iterable[Dict[str, Any]], keep_rows: bool, approx: bool = False) -> Dict[str, Any]:
+    """Parte mergeable di un'entry (vedi _summary_part) con i contatori di _build_entry."""
+    loose: Dict[str, int] = {}
+    alt = {"match": True}
+
+    def _track(it: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        for r in it:
+            code = r.get("code")
+            if not str(code if code is not None else "").strip():
+                k = str(code)
+                loose[k] = loose.get(k, 0) + 1
+            if alt["match"]:
+                for k in UPLOAD_CODE_KEYS[1:]:
+                    if k in r and str(r.get(k)) != str(code):
+                        alt["match"] = False
+                        break
+            yield r
+
+    part = _summary_part(_track(rows), keep_rows=keep_rows, approx=approx)
+    part["loose"] = loose
+    part["alt_codes_match"] = alt["match"]
+    return part
+
+def _answer(entry: Dict[str, Any], codes: List[str], include_rows: bool,
+            keys: Tuple[str, ...] = ("code",), approx: bool = False) -> Optional[Dict[str, Any]]:
+    """Risposta {summary, rows?, count} per un filtro `codes` a partire da un'entry in cache.
+       None se l'entry non basta (es. servono le righe ma non le abbiamo tenute)."""
+    if "codes" in entry:
+        # entry da pushdown: già filtrata, vale solo per gli stessi codici
+        if entry["codes"] != _code_set_key(codes):
+            return None
+        if include_rows:
+            return {"summary": entry["summary"], "rows": entry["rows"], "count": entry["count"]} if "rows" in entry else None
+        return {"summary": entry["summary"], "count": entry["count"]}
+    if include_rows:
+        if "rows" not in entry:
+            return None
+        if not codes:
+            return {"summary": entry["summary"], "rows": entry["rows"], "count": entry["count"]}
+        return _summarize(_filter_codes(entry["rows"], codes, keys), keep_rows=True, approx=approx)
+    if not codes:
+        return {"summary": entry["summary"], "count": entry["count"]}
+    if keys != ("code",) and not entry["alt_codes_match"]:
+        if "rows" in entry:
+            return _summarize(_filter_codes(entry["rows"], codes, keys), keep_rows=False, approx=approx)
+        return None
+    # le statistiche sono per codice: basta selezionare le voci richieste
+    code_set = set(map(str, codes))
+    summary = [s for s in entry["summary"] if s["code"] in code_set]
+    count = sum(s["count"] for s in summary) + sum(entry["loose"].get(c, 0) for c in code_set)
+    return {"summary": summary, "count": count}
+
+def _code_set_key(codes: List[str]) -> List[str]:
+    return sorted(set(map(str, codes)))
+
+def _pushdown_entry(chunks: Iterable[str], shape_msg: str, codes: List[str], keep_rows: bool,
+                    approx: bool = False, keys: Tuple[str, ...] = ("code",)) -> Dict[str, Any]:
+    """Parse con il filtro `codes` spinto nei parser: i record senza quei codici non
+       vengono costruiti né normalizzati. L'entry risponde solo per questi codici."""
+    keep = RecordPrefilter.build(codes)
+    rows = _filter_codes(_iter_source_rows(chunks, shape_msg, keep, slim=not keep_rows), codes, keys)
+    entry = _build_entry(rows, keep_rows, approx)
+    entry["codes"] = _code_set_key(codes)
+    entry["pushdown"] = {"skipped_records": keep.skipped if keep else 0}
+    return entry
+
+def _parse_entry(chunks: Iterable[str], shape_msg: str, keep_rows: bool, approx: bool = False,
+                 codes: Optional[List[str]] = None, keys: Tuple[str, ...] = ("code",),
+                 ingest: Optional[Tuple[str, Optional[str], Optional[str], Optional[str]]] = None,
+                 carry: Optional[Carry] = None) -> Dict[str, Any]:
+    """Parse completo -> entry; con `codes` parse filtrato (pushdown). `ingest` =
+       (source, month, sid, inner): intanto scrive anche l'indice su disco, se manca.
+       `carry`: voci del mese prima per il summary incrementale (vedi _finish_summary)."""
+    if codes:
+        return _pushdown_entry(chunks, shape_msg, codes, keep_rows, approx, keys)
+    # l'indice su disco salva le righe intere: con l'ingest niente righe slim
+    ingesting = ingest is not None and _needs_ingest(*ingest, keys)
+    rows: Iterable[Dict[str, Any]] = _iter_source_rows(chunks, shape_msg, slim=not (keep_rows or ingesting))
+    if ingesting:
+        rows = CODE_INDEX.ingest(rows, *ingest, keys)  # type: ignore[union-attr]
+    return _build_entry(rows, keep_rows, approx, carry)
+
+def _file_entry_job(path: str, inner: Optional[str], name: Optional[str], cancel: Optional[str],
+                    traced: bool, *args: Any) -> Tuple[bool, Any, Any]:
+    """Worker (gira in un processo del pool): file su disco -> (True, entry, timings). Gli
+       HTTPException non attraversano bene il pickle: tornano come (False, errore, timings).
+       Con `traced` misura le fasi in una Trace sua (timings = Trace.export(), se no None)."""
+    with mrf_metrics.collect(traced) as trace:
+        try:
+            ok, out = True, _parse_entry(mrf_exec.checked(_file_text_chunks(path, inner, name), cancel), *args)
+        except IndexDetected as e:
+            ok, out = False, (e.status_code, e.detail, e.urls)
+        except HTTPException as e:
+            ok, out = False, (e.status_code, e.detail, None)
+        return ok, out, (trace.export() if trace is not None else None)
+
+async def _run_parse(chunks: TextChunks, shape_msg: str, keep_rows: bool, approx: bool = False,
+                     codes: Optional[List[str]] = None, keys: Tuple[str, ...] = ("code",),
+                     ingest: Optional[Tuple[str, Optional[str], Optional[str], Optional[str]]] = None,
+                     local: Optional[Tuple[str, Optional[str], Optional[str]]] = None,
+                     carry: Optional[Carry] = None) -> Dict[str, Any]:
+    """_parse_entry fuori dall'event loop, dentro uno dei posti di mrf_exec.job_slot().
+       Se la sorgente è un file su disco abbastanza grande (`local` = (path, inner, name))
+       va in un processo (o, se molto grande, a fette in più processi: _sharded_entry),
+       altrimenti nel pool di thread consumando `chunks`.
+       Se la richiesta viene cancellata (client disconnesso) il parse si ferma."""
+    token = mrf_exec.CancelToken()
+    args = (shape_msg, keep_rows, approx, codes, keys, ingest, carry)
+    try:
+        async with mrf_exec.job_slot():
+            size = os.path.getsize(local[0]) if local is not None else 0
+            if local is not None and mrf_exec.use_processes(size):
+                n = mrf_shard.shard_count(size, mrf_exec.PROCESS_WORKERS)
+                plan = await asyncio.to_thread(_shard_plan, local, ingest, keys) if n > 1 else None
+                if plan is not None:
+                    out = await _sharded_entry(local[0], plan, n, shape_msg, keep_rows, approx, codes, keys,
+                                               carry, token)
+                    _file_progress(size, out)
+                    return out
+                ok, out, timings = await mrf_exec.run_process(
+                    _file_entry_job, *local, token.marker(), mrf_metrics.active(), *args, token=token
+                )
+                mrf_metrics.merge(timings)
+                _file_progress(size, out if ok else None)
+                if ok:
+                    return out
+                status, detail, urls = out
+                if urls is not None:
+                    raise IndexDetected(urls, status_code=status, detail=detail)
+                raise HTTPException(status, detail)
+            return await _consume(chunks, lambda c: _parse_entry(c, *args), token)
+    finally:
+        token.close()
+
+def _file_progress(size: int, entry: Optional[Dict[str, Any]]) -> None:
+    prog = JOB_PROGRESS.get()
+    if prog is not None:
+        # i worker non vedono il nostro Progress: i totali a fine parse
+        prog.bytes_read = prog.bytes_total = size
+        if entry is not None:
+            prog.rows_parsed = entry["count"]
+
+def _zip_member_part(zip_path: str, member: str, shape_msg: str, keep_rows: bool, approx: bool,
+                     codes: Optional[List[str]], keys: Tuple[str, ...],
+                     cancel: Union[mrf_exec.CancelToken, str, None] = None, traced: bool = False) -> Dict[str, Any]:
+    """Worker (gira in un processo del pool): un membro ZIP -> parte mergeable.
+       Decompressione col guardrail per-membro, parse e (con `codes`) pushdown.
+       Gli HTTPException non attraversano bene il pickle: tornano come "error".
+       Con `traced` le fasi misurate tornano in part["timings"] (vedi _file_entry_job)."""
+    t0 = time.perf_counter()
+    with mrf_metrics.collect(traced) as trace:
+        try:
+            _, body = _open_zip_member(zip_path, member)
+            keep = RecordPrefilter.build(codes) if codes else None
+            text = mrf_exec.checked(_decode(body), cancel)
+            rows: Iterable[Dict[str, Any]] = _iter_source_rows(text, shape_msg, keep, slim=not keep_rows)
+            if codes:
+                rows = _filter_codes(rows, codes, keys)
+            part = _entry_part(rows, keep_rows, approx)
+            part["skipped"] = keep.skipped if keep else 0
+        except HTTPException as e:
+            part = {"error": (e.status_code, e.detail)}
+        part["timings"] = trace.export() if trace is not None else None
+    part["member"] = member
+    part["elapsed_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    return part
+
+async def _zip_all_entry(zm: ZipMembers, shape_msg: str, keep_rows: bool, approx: bool = False,
+                         codes: Optional[List[str]] = None, keys: Tuple[str, ...] = ("code",),
+                         carry: Optional[Carry] = None) -> Dict[str, Any]:
+    """Tutti i membri utili dello ZIP, ognuno decompresso e parsato in un processo a sé;
+       le parti si uniscono nell'ordine dello ZIP (= stesso risultato di un unico file
+       con i membri concatenati). Il primo membro in errore fa fallire la richiesta."""
+    token = mrf_exec.CancelToken()
+    try:
+        async with mrf_exec.job_slot():
+            if len(zm.members) == 1 or not mrf_exec.use_processes():
+                args = (shape_msg, keep_rows, approx, codes, keys, token)
+                parts = [await mrf_exec.run_thread(_zip_member_part, zm.path, m, *args, token=token)
+                         for m in zm.members]
+            else:
+                args = (shape_msg, keep_rows, approx, codes, keys, token.marker(), mrf_metrics.active())
+                parts = list(await asyncio.gather(*(
+                    mrf_exec.run_process(_zip_member_part, zm.path, m, *args, token=token) for m in zm.members
+                )))
+    finally:
+        token.close()
+    for p in parts:
+        mrf_metrics.merge(p.pop("timings"))
+    for p in parts:
+        if "error" in p:
+            status, detail = p["error"]
+            raise HTTPException(status, detail)
+    members = [{"name": p["member"], "count": p["count"], "elapsed_ms": p["elapsed_ms"]} for p in parts]
+    skipped = sum(p["skipped"] for p in parts)
+    entry = _entry_from_part(_merge_parts(parts), carry)
+    entry["zip_members"] = members
+    if codes:
+        entry["codes"] = _code_set_key(codes)
+        entry["pushdown"] = {"skipped_records": skipped}
+    return entry
+
+# --------------- File grandi a fette (mrf_shard) ---------------
+# (formato, parametri del csv.reader, header, mapping): decisi UNA volta dall'inizio del
+# file e passati a ogni worker, così tutte le fette usano lo stesso profilo di schema
+ShardSpec = Tuple[str, Optional[Dict[str, Any]], List[str], Dict[str, str]]
+SHARD_HEAD_BYTES = 1024 * 1024  # l'intestazione CSV (o la prima riga NDJSON) deve stare qui
+
+def _csv_params(fmt: Dict[str, Any]) -> Dict[str, Any]:
+    """Il formato di _csv_head come parametri espliciti (il dialetto sniffato non si pickla)."""
+    d = csv.reader((), **fmt).dialect
+    return {k: getattr(d, k) for k in ("delimiter", "quotechar", "escapechar", "doublequote",
+                                       "skipinitialspace", "lineterminator", "quoting", "strict")}
+
+def _shard_plan(local: Tuple[str, Optional[str], Optional[str]], ingest: Optional[Tuple[str, Optional[str], Optional[str], Optional[str]]],
+                keys: Tuple[str, ...] = ("code",)) -> Optional[Tuple[ShardSpec, int, Optional[bytes]]]:
+    """(spec, offset di inizio dei dati, quote da contare) se il file si può parsare a
+       fette: CSV o NDJSON non compresso, fuori da uno ZIP, senza escapechar e senza un
+       ingest dell'indice da fare (vuole le righe in ordine, da un solo scrittore).
+       None: si parsa tutto di fila come prima."""
+    path, inner, name = local
+    if inner is not None or (name or path).lower().endswith((".gz", ".zip")):
+        return None
+    if ingest is not None and _needs_ingest(*ingest, keys):
+        return None
+    with open(path, "rb") as f:
+        data = f.read(SHARD_HEAD_BYTES)
+    bom = len(codecs.BOM_UTF8) if data.startswith(codecs.BOM_UTF8) else 0
+    text = data.decode("utf-8", errors="replace")
+    try:
+        fmt, _ = sniff(_text_chunks(text))
+        if fmt == "ndjson":
+            nl = data.find(b"\n", bom)
+            first = json.loads(data[bom:nl])
+            prof = SCHEMAS.profile(list(first.keys()))
+            return ("ndjson", None, prof.headers, prof.mapping), bom, None
+        if fmt != "csv":
+            return None
+        lines = _iter_lines(_text_chunks(text))
+        head, cfmt = _csv_head(lines)
+        params = _csv_params(cfmt)
+        if params["escapechar"] or not params["doublequote"]:
+            return None
+        quote = None if params["quoting"] == csv.QUOTE_NONE or not params["quotechar"] else params["quotechar"].encode()
+        body = mrf_shard.record_end(data, bom, quote)
+        fieldnames = next(csv.reader(itertools.chain(head, lines), **cfmt), None)
+    except (ValueError, csv.Error):
+        return None
+    if body < 0 or not fieldnames or (quote is not None and len(quote) != 1):
+        return None
+    prof = SCHEMAS.profile(fieldnames)
+    return ("csv", params, prof.headers, prof.mapping), body, quote
+
+def _shard_part(path: str, lo: Tuple[int, Optional[bool], int], hi: Optional[Tuple[int, bool]], spec: ShardSpec,
+                quote: Optional[bytes], shape_msg: str, keep_rows: bool, approx: bool, codes: Optional[List[str]],
+                keys: Tuple[str, ...], cancel: Union[mrf_exec.CancelToken, str, None] = None,
+                traced: bool = False) -> Dict[str, Any]:
+    """Worker (gira in un processo del pool): una fetta del file -> parte mergeable (come
+       _zip_member_part). `lo` = (taglio, dispari, righe prima del taglio), `hi` = (taglio,
+       dispari) del taglio dopo (None: fino in fondo); i tagli si allineano all'inizio
+       di record con mrf_shard.align (dispari None: già allineato, inizio dei dati)."""
+    t0 = time.perf_counter()
+    size = os.path.getsize(path)
+    start, odd, lineno = lo
+    with mrf_metrics.collect(traced) as trace:
+        try:
+            if odd is not None:
+                start, skipped = mrf_shard.align(path, start, odd, quote, size)
+                lineno += skipped
+            end = size if hi is None else mrf_shard.align(path, hi[0], hi[1], quote, size)[0]
+            kind, params, headers, mapping = spec
+            profile = SCHEMAS.adopt(headers, mapping)
+            keep = RecordPrefilter.build(codes) if codes else None
+            raw = mrf_metrics.wrap(mrf_shard.read(path, start, end, FETCH_CHUNK), "fetch")
+            text = mrf_exec.checked(_decode(raw), cancel)  # type: ignore[arg-type]
+            rows: Iterable[Dict[str, Any]]
+            if kind == "csv":
+                lines = _iter_lines(text)
+                if keep is not None:
+                    lines = _keep_records(lines, keep, quote=_csv_quote(params or {}))
+                rows = mrf_metrics.wrap_rows(_csv_rows(lines, params or {}, profile, slim=not keep_rows), "parse")
+            else:
+                rows = _normalized(iter_ndjson_rows(JsonCursor(text), keep, lineno), profile.converter())
+            if codes:
+                rows = _filter_codes(rows, codes, keys)
+            part = _entry_part(rows, keep_rows, approx)
+            part["skipped"] = keep.skipped if keep else 0
+        except (JsonShapeError, json.JSONDecodeError) as e:
+            part = {"error": (400, f"Invalid JSON: {e}")}
+        except HTTPException as e:
+            part = {"error": (e.status_code, e.detail)}
+        part["timings"] = trace.export() if trace is not None else None
+    part["range"] = [start, end] if "error" not in part else [start, None]
+    part["elapsed_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    return part
+
+async def _sharded_entry(path: str, plan: Tuple[ShardSpec, int, Optional[bytes]], n: int, shape_msg: str,
+                         keep_rows: bool, approx: bool = False, codes: Optional[List[str]] = None,
+                         keys: Tuple[str, ...] = ("code",), carry: Optional[Carry] = None,
+                         token: Optional[mrf_exec.CancelToken] = None) -> Dict[str, Any]:
+    """Parse di un file grande in `n` fette parallele (vedi mrf_shard): prima si contano
+       virgolette e righe per fetta, poi ogni worker allinea e parsa la sua. Le parti si
+       uniscono nell'ordine del file: stesso risultato del parse di fila."""
+    spec, body, quote = plan
+    mrf_metrics.set_format(spec[0])
+    bounds = mrf_shard.cuts(body, os.path.getsize(path), n)
+    counts = await asyncio.gather(*(
+        mrf_exec.run_process(mrf_shard.scan, path, a, b, quote, token=token) for a, b in zip(bounds, bounds[1:])
+    ))
+    cuts: List[Tuple[int, bool, int]] = []
+    quotes = lines = 0
+    for a, (q, nl) in zip(bounds, counts):
+        cuts.append((a, quotes % 2 == 1, lines))
+        quotes += q
+        lines += nl
+    los: List[Tuple[int, Optional[bool], int]] = [(body, None, 0), *cuts[1:]]
+    his: List[Optional[Tuple[int, bool]]] = [(a, odd) for a, odd, _ in cuts[1:]]
+    his.append(None)
+    args = (spec, quote, shape_msg, keep_rows, approx, codes, keys, token.marker() if token else None,
+            mrf_metrics.active())
+    parts = list(await asyncio.gather(*(
+        mrf_exec.run_process(_shard_part, path, lo, hi, *args, token=token) for lo, hi in zip(los, his)
+    )))
+    for p in parts:
+        mrf_metrics.merge(p.pop("timings"))
+    for p in parts:
+        if "error" in p:
+            status, detail = p["error"]
+            raise HTTPException(status, detail)
+    shards = [{"range": p["range"], "count": p["count"], "elapsed_ms": p["elapsed_ms"]} for p in parts]
+    skipped = sum(p["skipped"] for p in parts)
+    entry = _entry_from_part(_merge_parts(parts), carry)
+    entry["shards"] = shards
+    if codes:
+        entry["codes"] = _code_set_key(codes)
+        entry["pushdown"] = {"skipped_records": skipped}
+    return entry
+
+def _cache_meta(hit: bool, tier: Optional[str], stored: Optional[bool] = None) -> Dict[str, Any]:
+    meta = {"hit": hit, "tier": tier, "stats": RESULT_CACHE.snapshot()}
+    if stored is not None:
+        meta["stored"] = stored  # miss: l'entry appena calcolata è rimasta in cache?
+    return meta
+
+def _approx_meta(approx: bool) -> Optional[Dict[str, Any]]:
+    if not approx:
+        return None
+    # quantili da sketch KLL: esatti sotto k tariffe per codice, altrimenti errore di rango ~1.65%
+    return {"method": "kll", "k": APPROX_K, "rank_error": APPROX_RANK_ERROR,
+            "exact": ["count", "min", "max", "top3", "description"]}
+
+def _index_entry(source: str, month: Optional[str], sid: str, codes: List[str], approx: bool,
+                 keys: Tuple[str, ...] = ("code",)) -> Optional[Tuple[Dict[str, Any], Dict[str, Any]]]:
+    """(entry, info) con le sole righe dei `codes` lette dall'indice su disco; None se la
+       sorgente (stesso contenuto) non è indicizzata. L'entry è parziale: non va in cache."""
+    if CODE_INDEX is None or not codes:
+        return None
+    info = CODE_INDEX.lookup(source, month, sid, keys)
+    if info is None:
+        return None
+    rows = CODE_INDEX.query(info["id"], codes)
+    entry = _build_entry(_filter_codes(rows, codes, keys), True, approx)
+    entry["source_inner"] = info["inner"]
+    return entry, {"rows_read": len(rows), "rows_indexed": info["rows"]}
+
+def _needs_ingest(source: str, month: Optional[str], sid: Optional[str], inner: Optional[str],
+                  keys: Tuple[str, ...] = ("code",)) -> bool:
+    """Un parse completo di questa sorgente deve anche scrivere l'indice (manca per questo contenuto)?"""
+    return CODE_INDEX is not None and bool(sid) and CODE_INDEX.lookup(source, month, sid, keys) is None
+
+# richieste concorrenti per la stessa sorgente: un solo fetch+parse condiviso
+INFLIGHT = mrf_exec.SingleFlight()
+
+async def _source_entry(url: str, keep_rows: bool, shape_msg: str, approx: bool = False,
+                        codes: Optional[List[str]] = None, zip_all: bool = False,
+                        carry: Optional[Carry] = None,
+                        inner: Optional[str] = None) -> Tuple[Dict[str, Any], Optional[str], Dict[str, Any]]:
+    """Come _load_source_entry, ma le richieste concorrenti per la stessa sorgente
+       aspettano un solo fetch+parse (mrf_exec.SingleFlight). Ci si aggancia a un lavoro
+       in corso se la sua entry basta: ha le righe se servono, le impronte se servono,
+       ed è dell'intero file oppure filtrata (pushdown/indice) per gli stessi codici.
+       Ognuno poi applica all'entry condivisa il suo filtro `codes` e `include_rows`;
+       se un chiamante se ne va il lavoro continua per gli altri."""
+    # stessa scelta di _load_source_entry: con `codes` l'entry può valere solo per quei codici
+    partial = bool(codes) and carry is None
+    # del carry conta solo se c'è: summary e impronte non dipendono dal mese precedente,
+    # i contatori e il delta li fa ogni chiamante col suo (_incremental_meta)
+    spec = (keep_rows, carry is not None, _code_set_key(codes or []) if partial else None)
+
+    def _covers(other: Tuple[bool, bool, Optional[List[str]]]) -> bool:
+        return (other[0] or not keep_rows) and (other[1] or carry is None) and other[2] in (None, spec[2])
+
+    async def _load() -> Tuple[Dict[str, Any], Optional[str], Dict[str, Any], Optional[str]]:
+        entry, member, cache = await _load_source_entry(url, keep_rows, shape_msg, approx, codes, zip_all, carry,
+                                                        inner)
+        return entry, member, cache, SOURCE_ID.get()  # il task ha i suoi ContextVar
+
+    key = (url, approx, zip_all, None if zip_all else inner)
+    (entry, member, cache, sid), shared = await INFLIGHT.run(key, _load, spec, _covers)
+    SOURCE_ID.set(sid)
+    if shared:
+        cache = {**cache, "coalesced": True}
+    return entry, member, cache
+
+async def _load_source_entry(url: str, keep_rows: bool, shape_msg: str, approx: bool = False,
+                             codes: Optional[List[str]] = None, zip_all: bool = False,
+                             carry: Optional[Carry] = None,
+                             inner: Optional[str] = None) -> Tuple[Dict[str, Any], Optional[str], Dict[str, Any]]:
+    """(entry, source_inner, cache_meta) per una sorgente url/path: dalla cache se la
+       sorgente non è cambiata (GET condizionale), poi dall'indice su disco se servono
+       solo alcuni `codes`, altrimenti parse + put. Con `codes` e senza indice il parse
+       è filtrato (pushdown) e l'entry vale solo per quei codici. Con zip_all uno ZIP
+       viene elaborato per intero (tutti i membri, in parallelo). Con `carry` (refresh
+       incrementale) l'entry è sempre dell'intero file e ha anche le impronte per codice.
+       `inner`: membro dello ZIP da leggere (default il primo utile; vedi open_source)."""
+    validators = RESULT_CACHE.validators_for(url)
+    month = _infer_index_month(url)
+    # l'indice su disco è per sorgente "singola": con zip_all non si usa
+    use_index = CODE_INDEX is not None and not zip_all and carry is None
+    pushdown = bool(codes) and not use_index and carry is None
+    require = tuple(k for k, on in (("rows", keep_rows), ("digests", carry is not None)) if on)
+    while True:
+        _stage("fetching")
+        async with open_source(url, validators, zip_all=zip_all, inner=None if zip_all else inner) as chunks:
+            base_sid = SOURCE_ID.get()
+            if base_sid and zip_all:
+                base_sid += "|zip=all"
+            sid = base_sid + "|approx" if base_sid and approx else base_sid
+            if sid:
+                entry, tier = RESULT_CACHE.get(sid, require=require)
+                if entry is not None:
+                    return entry, entry.get("source_inner"), _cache_meta(True, tier)
+                indexed = None
+                if use_index:
+                    indexed = await asyncio.to_thread(_index_entry, url, month, base_sid, codes or [], approx)
+                if indexed is not None:
+                    entry, info = indexed
+                    return entry, entry.get("source_inner"), {**_cache_meta(True, "index"), "index": info}
+                if pushdown:
+                    sid += "|codes=" + ",".join(_code_set_key(codes or []))
+                    entry, tier = RESULT_CACHE.get(sid, require=require)
+                    if entry is not None:
+                        return entry, entry.get("source_inner"), _cache_meta(True, tier)
+            if chunks is None:
+                # 304 ma l'entry non c'è più (o non ha le righe): riscarica senza validator
+                validators = {}
+                continue
+            member = SOURCE_INNER.get()
+            _stage("parsing")
+            if isinstance(chunks, ZipMembers):
+                entry = await _zip_all_entry(chunks, shape_msg, keep_rows, approx, codes if pushdown else None,
+                                             carry=carry)
+            else:
+                local = SOURCE_FILE.get()
+                entry = await _run_parse(
+                    chunks, shape_msg, keep_rows, approx, codes if pushdown else None,
+                    ingest=None if pushdown else (url, month, base_sid, member),
+                    local=(local[0], local[1], None) if local else None, carry=carry,
+                )
+            entry["source_inner"] = member
+            stored = False
+            if sid:
+                stored = await asyncio.to_thread(RESULT_CACHE.put, sid, entry, url, SOURCE_VALIDATORS.get())
+            return entry, member, _cache_meta(False, None, stored)
 
 # --------------- Routes ---------------
+def _response_format(request: Request, fmt: Optional[str]) -> str:
+    try:
+        return mrf_output.negotiate(fmt, request.headers.get("accept", ""))
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+async def _respond(request: Request, work: Awaitable[Any], fmt: str = "json", timings: bool = False) -> Any:
+    """Esegue il corpo di una route cancellandolo se il client si disconnette, poi
+       serializza la risposta fuori dall'event loop: JSON (jsonable_encoder + dumps:
+       con molte righe costa) e columnar in un thread, NDJSON in streaming.
+       Con `timings` (o con /metrics attivo) le fasi si misurano (mrf_metrics):
+       meta.timings non può contenere la serializzazione, che va nell'header
+       Server-Timing e negli istogrammi."""
+    route = request.url.path
+    trace = mrf_metrics.start(timings)
+    try:
+        res = await mrf_exec.cancel_on_disconnect(request.is_disconnected, work)
+    except BaseException:
+        if trace is not None:
+            trace.finish(route)
+        raise
+    if isinstance(res, Response):
+        if trace is not None:
+            trace.finish(route)
+        return res
+    if trace is not None and timings:
+        res.setdefault("meta", {})["timings"] = trace.report()
+    if fmt == "ndjson":
+        # iteratore sync: Starlette lo consuma nel threadpool, chunk per chunk
+        chunks = mrf_output.ndjson_chunks(res)
+        if trace is not None:
+            chunks = _traced_stream(trace, chunks, route)
+        return StreamingResponse(chunks, media_type=mrf_output.MEDIA_TYPES[fmt])
+
+    def _serialize() -> Response:
+        with mrf_metrics.span("serialize"):
+            if fmt == "columnar":
+                resp = Response(mrf_output.columnar_body(res), media_type=mrf_output.MEDIA_TYPES[fmt])
+            else:
+                resp = JSONResponse(jsonable_encoder(res))
+        mrf_metrics.add("serialize", len(resp.body))
+        return resp
+    try:
+        resp = await asyncio.to_thread(_serialize)
+    finally:
+        if trace is not None:
+            trace.finish(route)
+    if trace is not None and timings:
+        resp.headers["Server-Timing"] = trace.server_timing()
+    return resp
+
+def _traced_stream(trace: mrf_metrics.Trace, chunks: Iterator[bytes], route: str) -> Iterator[bytes]:
+    """Stream NDJSON misurato: gli istogrammi si aggiornano quando lo stream finisce."""
+    try:
+        yield from trace.wrap(chunks, "serialize")
+    finally:
+        trace.finish(route)
+
+def _page_tag(identity: Optional[str], codes: List[str], approx: bool = False) -> Optional[str]:
+    """Lega un cursore al contenuto (sid della sorgente) e al filtro che l'hanno prodotto.
+       None se il contenuto non ha un'identità (remoto senza ETag/Last-Modified)."""
+    if not identity:
+        return None
+    return hashlib.sha256(json.dumps([identity, _code_set_key(codes), approx]).encode()).hexdigest()[:16]
+
+def _page_identity(cache: Dict[str, Any]) -> Optional[str]:
+    """Identità per i cursori: il sid della sorgente, solo se l'entry sta in cache (o
+       nell'indice) sotto quel sid. Altrimenti ogni pagina rifarebbe fetch + parse."""
+    sid = SOURCE_ID.get()
+    return sid if sid and (cache.get("hit") or cache.get("stored")) else None
+
+def _paginate(res: Dict[str, Any], limit: Optional[int], cursor: Optional[str], tag: Optional[str]) -> None:
+    """Se richiesto (limit/cursor) riduce res["rows"] a una pagina e mette in
+       meta.page il next_cursor (None all'ultima pagina). Il cursore è opaco: offset,
+       limit e il tag del risultato; se la sorgente è cambiata nel frattempo -> 410.
+       tag None (risultato non legato al contenuto o non in cache): una pagina sola va
+       bene, un next_cursor no -> 400."""
+    if "rows" not in res or (limit is None and not cursor):
+        return
+    if limit is not None and limit < 1:
+        raise HTTPException(400, "limit must be >= 1.")
+    offset = 0
+    if cursor:
+        try:
+            c = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+            offset, ctag = int(c["o"]), str(c["t"])
+            if limit is None and c.get("l") is not None:
+                limit = int(c["l"])
+        except Exception:
+            raise HTTPException(400, "Invalid cursor.")
+        if ctag != tag:
+            raise HTTPException(410, {
+                "error": "cursor_expired",
+                "message": "The source or the filter changed since this cursor was issued. Start again without cursor.",
+            })
+    rows = res["rows"]
+    end = len(rows) if limit is None else min(len(rows), offset + limit)
+    nxt = None
+    if end < len(rows):
+        if tag is None:
+            raise HTTPException(400, {
+                "error": "pagination_unavailable",
+                "message": "This result can't be paged: the source has no ETag/Last-Modified or the result "
+                           "is too large to cache. Request it without limit (or use a background job).",
+            })
+        nxt = base64.urlsafe_b64encode(json.dumps({"o": end, "l": limit, "t": tag}).encode()).decode().rstrip("=")
+    res["rows"] = rows[offset:end]
+    res.setdefault("meta", {})["page"] = {"offset": offset, "limit": limit, "total_rows": len(rows), "next_cursor": nxt}
+
 @app.post("/api/parse")
-async def parse(req: ParseReq):
-    text = await read_text(req.url)
-    inner = SOURCE_INNER.get()
+async def parse(req: ParseReq, request: Request):
+    fmt = _response_format(request, req.format)
+    return await _respond(request, _parse(req), fmt, req.timings)
+
+async def _parse(req: ParseReq) -> Dict[str, Any]:
+    # --- parsing streaming + index-detection, normalizzazione (o cache) + filtro ---
+    entry, inner, cache = await _source_entry(
+        req.url, True, "Expected an array of objects or { data: [...] }.", codes=req.codes, inner=req.inner
+    )
+    rows = await asyncio.to_thread(lambda: list(_filter_codes(entry["rows"], req.codes)))
 
-    # --- parsing generalista + index-detection ---
-    try:
-        obj = json.loads(text)
-        suggestions = _extract_in_network_urls(obj)
-        if suggestions:
-            _raise_index_suggestions(suggestions)
-        rows = _find_first_array_of_objects(obj) or []
-        if not rows:
-            raise HTTPException(400, "Expected an array of objects or { data: [...] }.")
-    except json.JSONDecodeError:
-        rows = _find_first_array_of_objects(text) or []
-        if not rows:
-            rows = parse_csv(text)
-
-    # Normalizzazione + filtro
-    rows = normalize_rows(rows)
-    if req.codes and rows and isinstance(rows[0], dict):
-        code_set = set(map(str, req.codes))
-        rows = [r for r in rows if str(r.get("code")) in code_set]
-
-    return {"count": len(rows), "rows": rows, "meta": {"source": req.url, "source_inner": inner}}
+    meta = {"source": req.url, "source_inner": inner, "cache": cache}
+    if "pushdown" in entry:
+        meta["pushdown"] = entry["pushdown"]
+    res = {"count": len(rows), "rows": rows, "meta": meta}
+    _paginate(res, req.limit, req.cursor, _page_tag(_page_identity(cache), req.codes))
+    return res
 
 @app.post("/api/summary")
-async def summary(req: SummaryReq):
-    text = await read_text(req.url)
-    inner = SOURCE_INNER.get()
+async def summary(req: SummaryReq, request: Request):
+    fmt = _response_format(request, req.format)
+    return await _respond(request, _summary(req), fmt, req.timings)
 
-    # --- parsing generalista + index-detection ---
+async def _summary(req: SummaryReq) -> Dict[str, Any]:
+    inc = await _incremental_base(req) if req.incremental else None
+    # --- parsing streaming + index-detection (o cache): le righe arrivano a _summarize una alla volta ---
     try:
-        obj = json.loads(text)
-        suggestions = _extract_in_network_urls(obj)
-        if suggestions:
-            _raise_index_suggestions(suggestions)
-        rows = _find_first_array_of_objects(obj) or []
-        if not rows:
-            raise HTTPException(400, "Expected an array of objects or { data: [...] }.")
-    except json.JSONDecodeError:
-        rows = _find_first_array_of_objects(text) or []
-        if not rows:
-            rows = parse_csv(text)
-
-    rows = normalize_rows(rows)
-
-    if req.codes and rows and isinstance(rows[0], dict):
-        code_set = set(map(str, req.codes))
-        rows = [r for r in rows if str(r.get("code")) in code_set]
-
-    res = _summarize(rows)
-    if not req.include_rows:
-        res.pop("rows", None)
+        entry, inner, cache = await _source_entry(
+            req.url, req.include_rows, "Expected an array of objects or { data: [...] }.", approx=req.approx,
+            codes=req.codes, zip_all=req.all_members, carry=inc[3] if inc else None, inner=req.inner,
+        )
+    except IndexDetected as e:
+        if not req.fan_out:
+            raise
+        return await _fan_out_summary(req, e.urls)
+    _stage("summarizing")
+    res = await asyncio.to_thread(_answer, entry, req.codes, req.include_rows, approx=req.approx)
+    assert res is not None
 
     res["meta"] = {
         "source": req.url,
@@ -466,201 +1498,394 @@ async def summary(req: SummaryReq):
         "fetched_at": datetime.now(timezone.utc).isoformat(),
         "index_month_hint": _infer_index_month(req.url) or _infer_index_month(inner or ""),
         "include_rows": req.include_rows,
+        "cache": cache,
     }
+    if req.approx:
+        res["meta"]["approx"] = _approx_meta(True)
+    if "pushdown" in entry:
+        res["meta"]["pushdown"] = entry["pushdown"]
+    if "zip_members" in entry:
+        res["meta"]["zip_members"] = entry["zip_members"]
+    if "shards" in entry:
+        res["meta"]["shards"] = entry["shards"]
+    if inc is not None:
+        res["meta"]["incremental"] = await asyncio.to_thread(_incremental_meta, inc, entry, req.codes)
+    _paginate(res, req.limit, req.cursor, _page_tag(_page_identity(cache), req.codes, req.approx))
     return res
 
-#     # ---- META (DENTRO la funzione) ----
-#     meta = {
-#     "source": req.url,
-#     "source_inner": inner,  # <-- nuovo
-#     "fetched_at": datetime.now(timezone.utc).isoformat(),
-#     "index_month_hint": _infer_index_month(req.url) or _infer_index_month(inner or ""),
-#     "include_rows": req.include_rows,
-# }
-#     res["meta"] = meta
-#     return res
-
-
-# -------- Upload (50MB) --------
-MAX_SIZE_BYTES = 50 * 1024 * 1024
-
-def _find_first_array_of_objects(obj: Any) -> Optional[List[Dict[str, Any]]]:
-    if isinstance(obj, list) and (len(obj) == 0 or isinstance(obj[0], dict)):
-        return obj
-    if isinstance(obj, dict):
-        if isinstance(obj.get("data"), list) and (len(obj["data"]) == 0 or isinstance(obj["data"][0], dict)):
-            return obj["data"]
-        for _, v in obj.items():
-            if isinstance(v, list) and (len(v) == 0 or isinstance(v[0], dict)):
-                return v
-    if isinstance(obj, str):
-        lines = [ln.strip() for ln in obj.splitlines() if ln.strip()]
-        try:
-            rows = [json.loads(ln) for ln in lines]
-            if rows and isinstance(rows[0], dict):
-                return rows
-        except Exception:
-            pass
-    return None
+# -------- Refresh mensile incrementale (impronte per codice, mrf_delta) --------
+DELTAS = DigestStore.from_env()
+_MONTH_RE = _re.compile(r"^\d{4}-\d{2}$")
+
+async def _warm_source(src: Dict[str, Any]) -> Dict[str, Any]:
+    """Voce del manifest di warm-up: un giro di /api/summary, l'entry resta in cache."""
+    res = await _summary(SummaryReq(**src))
+    cache = res.get("meta", {}).get("cache") or {}
+    return {"count": res.get("count"), "cache_hit": cache.get("hit")}
+
+async def _incremental_base(req: SummaryReq) -> Tuple[str, str, Optional[str], Carry]:
+    """(serie, mese, mese precedente, voci del mese precedente) per un summary incrementale."""
+    if req.approx:
+        raise HTTPException(400, "incremental is not available with approx.")
+    month = req.month or _infer_index_month(req.url)
+    if not month or not _MONTH_RE.match(month):
+        raise HTTPException(400, "incremental needs the month: a YYYY-MM-DD date in the URL or month=YYYY-MM.")
+    series = req.series or series_of(req.url)
+    prev = await asyncio.to_thread(DELTAS.previous, series, month)
+    return series, month, prev[0] if prev else None, prev[1] if prev else {}
+
+def _incremental_meta(inc: Tuple[str, str, Optional[str], Carry], entry: Dict[str, Any],
+                      codes: List[str]) -> Dict[str, Any]:
+    """Salva la fotografia di questo mese (se non c'è già) e prepara meta.incremental.
+       I contatori si rifanno qui, col mese precedente di questa richiesta: l'entry può
+       essere in cache (o condivisa) da un refresh fatto con un altro `carry`."""
+    series, month, prev_month, carry = inc
+    sid = SOURCE_ID.get() or ""
+    if not sid or not DELTAS.has(series, month, sid):
+        DELTAS.save(series, month, sid, entry["digests"], entry["summary"])
+    return {
+        "series": series,
+        "month": month,
+        "previous_month": prev_month,
+        **incremental_counts(carry, entry["digests"]),
+        "delta": delta_report(carry, entry["digests"], entry["summary"], codes) if prev_month else None,
+    }
 
-def _text_from_upload(filename: str, data: bytes) -> tuple[str, Optional[str]]:
+async def _fan_out_summary(req: SummaryReq, urls: List[str]) -> Dict[str, Any]:
     """
-    Ritorna (text, inner_name).
-    - Se filename .gz -> gunzip.
-    - Se filename .zip -> estrae il primo file 'utile' (json/csv/ndjson/jsonl/txt o .gz),
-      con guardrail su dimensione decompressa. Se l'inner è .gz, lo scompatta.
-    - Altrimenti decodifica UTF-8.
+    Index CMS -> tutti i file in_network in parallelo (al più FANOUT_WORKERS alla volta,
+    più il limite per host del pool HTTP), ognuno in streaming e con la sua cache.
+    Le righe (già filtrate per `codes`) si concatenano nell'ordine dell'index e il
+    summary si ricalcola sul totale: stessi numeri che con un unico file.
     """
-    name = (filename or "").lower()
+    limit = max(1, min(req.max_files or FANOUT_MAX_FILES, FANOUT_MAX_FILES))
+    sem = asyncio.Semaphore(max(1, FANOUT_WORKERS))
+    _stage("fan_out")
+    files: List[Dict[str, Any]] = [{"url": u, "status": "pending"} for u in urls]
+    for f in files[limit:]:
+        f["status"] = "skipped"
+    idents: Dict[int, Optional[str]] = {}  # per i cursori: identità (vedi _page_identity) di ogni file ok
+
+    async def _one(i: int, f: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+        async with sem:
+            f["status"] = "running"
+            t0 = time.perf_counter()
+            try:
+                entry, inner, cache = await _source_entry(
+                    f["url"], True, "Expected an array of objects or { data: [...] }.", codes=req.codes,
+                )
+                rows = await asyncio.to_thread(lambda: list(_filter_codes(entry["rows"], req.codes)))
+                f.update(status="ok", source_inner=inner, count=len(rows), cache=cache["tier"])
+                idents[i] = _page_identity(cache)
+                return rows
+            except HTTPException as e:
+                f.update(status="error", status_code=e.status_code, error=e.detail)
+            except httpx.HTTPStatusError as e:
+                f.update(status="error", status_code=e.response.status_code,
+                         error=f"Upstream HTTP {e.response.status_code}")
+            except (httpx.HTTPError, OSError) as e:
+                f.update(status="error", error=f"{type(e).__name__}: {e}")
+            finally:
+                f["elapsed_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+            return None
+
+    parts = await asyncio.gather(*(_one(i, f) for i, f in enumerate(files[:limit])))
+    ok = [p for p in parts if p is not None]
+    fan_meta = {
+        "workers": max(1, FANOUT_WORKERS),
+        "files_total": len(urls),
+        "files_ok": len(ok),
+        "files_failed": sum(1 for f in files if f["status"] == "error"),
+        "files_skipped": len(urls) - limit if len(urls) > limit else 0,
+        "files": files,
+    }
+    if not ok:
+        raise HTTPException(502, {"error": "fan_out_failed", "message": "None of the in-network files could be processed.",
+                                  "fan_out": fan_meta})
+
+    _stage("summarizing")
+    async with mrf_exec.job_slot():
+        res = await mrf_exec.run_thread(
+            _summarize, itertools.chain.from_iterable(ok), req.include_rows, req.approx
+        )
+    res["meta"] = {
+        "source": req.url,
+        "source_inner": None,
+        "fetched_at": datetime.now(timezone.utc).isoformat(),
+        "index_month_hint": _infer_index_month(req.url),
+        "include_rows": req.include_rows,
+        "fan_out": fan_meta,
+    }
+    if req.approx:
+        res["meta"]["approx"] = _approx_meta(True)
+    # pagine solo se ogni file è in cache sotto il suo contenuto; l'elenco (con i falliti)
+    # fa parte dell'identità, così un file che cambia o torna a funzionare -> 410
+    ident = None
+    if all(idents.get(i) for i, p in enumerate(parts) if p is not None):
+        ident = "fan_out:" + json.dumps([idents.get(i) for i in range(len(parts))])
+    _paginate(res, req.limit, req.cursor, _page_tag(ident, req.codes, req.approx))
+    return res
 
-    # .gz "esterno"
-    if name.endswith(".gz"):
+# -------- Job in background (file multi-GB: niente timeout di proxy) --------
+JOBS = JobStore.from_env()
+JOB_WORKERS = int(os.getenv("COSTVISTA_JOB_WORKERS", "2"))
+JOB_MAX_WAIT = 60.0  # tetto al long-poll di GET /api/jobs/{id}?wait=
+_JOB_TASKS: Dict[str, "asyncio.Task[None]"] = {}
+_JOB_SLOTS: Optional[Tuple[asyncio.AbstractEventLoop, asyncio.Semaphore]] = None
+
+def _job_slots() -> asyncio.Semaphore:
+    global _JOB_SLOTS
+    loop = asyncio.get_running_loop()
+    if _JOB_SLOTS is None or _JOB_SLOTS[0] is not loop:
+        _JOB_SLOTS = (loop, asyncio.Semaphore(max(1, JOB_WORKERS)))
+    return _JOB_SLOTS[1]
+
+def _schedule_job(job_id: str, request: Dict[str, Any]) -> None:
+    if job_id in _JOB_TASKS:
+        return
+    JOBS.track(job_id)
+    task = asyncio.get_running_loop().create_task(_run_job(job_id, request))
+    _JOB_TASKS[job_id] = task
+    task.add_done_callback(lambda _t: _JOB_TASKS.pop(job_id, None))
+
+async def _run_job(job_id: str, request: Dict[str, Any]) -> None:
+    """Esegue un job come /api/summary, aggiornando il suo Progress. Se il processo
+       si ferma a metà (task cancellato) il job resta "running" e riparte al riavvio."""
+    async with _job_slots():
+        JOB_PROGRESS.set(await asyncio.to_thread(JOBS.start, job_id))
+        result: Optional[Dict[str, Any]] = None
+        error: Optional[Dict[str, Any]] = None
         try:
-            raw = gzip.decompress(data)
-        except Exception:
-            raise HTTPException(400, "Invalid GZ file.")
-        return raw.decode("utf-8", errors="replace"), None
+            res = await _summary(SummaryReq(**request))
+            _stage("saving")
+            result = await asyncio.to_thread(jsonable_encoder, res)
+        except HTTPException as e:
+            error = {"status_code": e.status_code, "detail": e.detail}
+        except httpx.HTTPStatusError as e:
+            error = {"status_code": e.response.status_code, "detail": f"Upstream HTTP {e.response.status_code}"}
+        except (httpx.HTTPError, OSError, ValueError) as e:
+            error = {"status_code": 502 if isinstance(e, httpx.HTTPError) else 500, "detail": f"{type(e).__name__}: {e}"}
+        except Exception as e:
+            # qualsiasi altro errore (pool rotto, job annullato, bug): il job finisce in
+            # "error", non resta "running" per sempre. CancelledError no: si riparte al riavvio
+            error = {"status_code": 500, "detail": f"Internal error: {type(e).__name__}: {e}"}
+        await asyncio.to_thread(JOBS.finish, job_id, result, error)
+        JOBS.wake(job_id)
+
+@app.post("/api/jobs", status_code=202)
+async def create_job(req: SummaryReq):
+    # formato/paginazione valgono per le risposte sincrone: il job salva il risultato intero
+    request = req.model_dump(exclude={"format", "limit", "cursor"})
+    job_id, created = await asyncio.to_thread(JOBS.submit, request)
+    job = await asyncio.to_thread(JOBS.get, job_id, False)
+    assert job is not None
+    if job["status"] in ("queued", "running") and job_id not in _JOB_TASKS:
+        # nuovo, oppure rimasto senza worker in questo processo (es. lifespan non eseguito)
+        _schedule_job(job_id, job["request"])
+    job["deduplicated"] = not created
+    return job
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0):
+    """Stato del job; con `wait` (secondi, max 60) aspetta che finisca prima di rispondere."""
+    await JOBS.wait(job_id, min(max(wait, 0.0), JOB_MAX_WAIT))
+    job = await asyncio.to_thread(JOBS.get, job_id)
+    if job is None:
+        raise HTTPException(404, "Job not found.")
+    return await asyncio.to_thread(lambda: JSONResponse(jsonable_encoder(job)))
+
+# -------- Upload (spool su disco, parse in streaming) --------
+# Starlette tiene l'upload in un SpooledTemporaryFile (su disco oltre 1MB) e da lì lo
+# leggiamo a chunk: la memoria non cresce con il file, il limite può essere alto.
+MAX_SIZE_BYTES = int(os.getenv("COSTVISTA_UPLOAD_MAX_BYTES", str(2 * 1024 ** 3)))
+# negli upload il codice può stare in colonne non mappate
+UPLOAD_CODE_KEYS = ("code", "cpt", "drg", "billing_code", "hcpcs", "cpt_code")
 
-    # .zip "esterno"
-    if name.endswith(".zip"):
-        try:
-            with zipfile.ZipFile(io.BytesIO(data)) as zf:
-                # prendi il primo membro "utile"
-                candidates = [
-                    n for n in zf.namelist()
-                    if not n.endswith("/") and any(n.lower().endswith(ext) for ext in ACCEPTED_INNER_EXTS)
-                ]
-                if not candidates:
-                    raise HTTPException(415, "ZIP does not contain a .json/.csv/.ndjson file.")
-                inner = candidates[0]
-                with zf.open(inner, "r") as f:
-                    payload = f.read(MAX_DECOMPRESSED_BYTES + 1)
-                if len(payload) > MAX_DECOMPRESSED_BYTES:
-                    raise HTTPException(413, "Decompressed ZIP content too large.")
-                # Se l'interno è a sua volta .gz, scompatta
-                if inner.lower().endswith(".gz"):
-                    try:
-                        payload = gzip.decompress(payload)
-                    except Exception:
-                        raise HTTPException(400, "Inner GZ in ZIP is invalid.")
-                return payload.decode("utf-8", errors="replace"), inner
-        except HTTPException:
-            raise
-        except Exception:
-            raise HTTPException(400, "Invalid ZIP file.")
+@app.post("/api/summary_upload")
+async def summary_upload(
+    request: Request,
+    file: UploadFile = File(...),
+    codes: List[str] = Form(default=[]),
+    include_rows: bool = Form(default=True),
+    inner_name: Optional[str] = Form(default=None),   # <-- NOVITÀ
+    approx: bool = Form(default=False),
+    all_members: bool = Form(default=False),  # ZIP: tutti i membri invece di chiedere quale
+    format: Optional[str] = Form(default=None),  # "json" | "ndjson" | "columnar" (anche via Accept)
+    limit: Optional[int] = Form(default=None),  # paginazione delle righe (vedi _paginate)
+    cursor: Optional[str] = Form(default=None),
+    timings: bool = Form(default=False),  # meta.timings (vedi SummaryReq)
+):
+    fmt = _response_format(request, format)
+    return await _respond(
+        request, _summary_upload_page(file, codes, include_rows, inner_name, approx, all_members, limit, cursor), fmt,
+        timings,
+    )
 
-    # fallback: file testo "normale"
-    return data.decode("utf-8", errors="replace"), None
+async def _summary_upload_page(file: UploadFile, codes: List[str], include_rows: bool, inner_name: Optional[str],
+                               approx: bool, all_members: bool, limit: Optional[int],
+                               cursor: Optional[str]) -> Dict[str, Any]:
+    res = await _summary_upload(file, codes, include_rows, inner_name, approx, all_members)
+    _paginate(res, limit, cursor, _page_tag(_page_identity(res["meta"]["cache"]), codes, approx))
+    return res
 
-def _text_from_upload_with_choice(filename: str, data: bytes, inner_name: Optional[str]) -> Tuple[str, Optional[str], Optional[list[str]]]:
+async def _summary_upload(file: UploadFile, codes: List[str], include_rows: bool, inner_name: Optional[str],
+                          approx: bool, all_members: bool) -> Dict[str, Any]:
+    # -- un passaggio a chunk sul file spoolato: dimensione + hash, niente join in memoria --
+    digest, size = await asyncio.to_thread(_hash_upload, file.file)
+
+    filename = getattr(file, "filename", "") or ""
+    zip_all = all_members and filename.lower().endswith(".zip")
+
+    # cache: stesso contenuto (+ stessa scelta inner) -> niente decode/parse
+    base_sid = "upload:" + digest + "|" + ("*" if zip_all else (inner_name or ""))
+    SOURCE_ID.set(base_sid)
+    sid = base_sid + ("|approx" if approx else "")
+    entry, tier = RESULT_CACHE.get(sid)
+    res = await asyncio.to_thread(_answer, entry, codes, include_rows, UPLOAD_CODE_KEYS, approx) if entry is not None else None
+    if res is not None:
+        return _upload_response(res, file, entry.get("source_inner"), include_rows, _cache_meta(True, tier), approx, entry)
+    # con `codes` (e senza indice) si fa un parse filtrato: in cache sotto una chiave per quei codici
+    pushdown = bool(codes) and (CODE_INDEX is None or zip_all)
+    if pushdown:
+        sid += "|codes=" + ",".join(_code_set_key(codes))
+        entry, tier = RESULT_CACHE.get(sid)
+        res = await asyncio.to_thread(_answer, entry, codes, include_rows, UPLOAD_CODE_KEYS, approx) if entry is not None else None
+        if res is not None:
+            return _upload_response(res, file, entry.get("source_inner"), include_rows, _cache_meta(True, tier),
+                                    approx, entry)
+
+    # indice su disco: stesso contenuto già ingerito -> solo le righe dei codici richiesti
+    month = _infer_index_month(filename)
+    indexed = None
+    if not zip_all:
+        indexed = await asyncio.to_thread(_index_entry, "upload:" + filename, month, base_sid, codes, approx, UPLOAD_CODE_KEYS)
+    if indexed is not None:
+        entry, info = indexed
+        res = await asyncio.to_thread(_answer, entry, codes, include_rows, UPLOAD_CODE_KEYS, approx)
+        assert res is not None
+        return _upload_response(res, file, entry.get("source_inner"), include_rows,
+                                {**_cache_meta(True, "index"), "index": info}, approx)
+
+    shape_msg = "Expected an array, { data: [...] }, any object with a first array of objects, or NDJSON."
+    if zip_all:
+        # tutti i membri, ognuno in un processo: lo ZIP va su disco così i worker lo riaprono da soli
+        entry = await _zip_upload_all(file.file, shape_msg, include_rows, approx, codes if pushdown else None)
+        stored = await asyncio.to_thread(RESULT_CACHE.put, sid, entry)
+        res = await asyncio.to_thread(_answer, entry, codes, include_rows, UPLOAD_CODE_KEYS, approx)
+        assert res is not None
+        return _upload_response(res, file, None, include_rows, _cache_meta(False, None, stored), approx, entry)
+
+    # ► nuovo: chunk di testo dal file spoolato tenendo conto di inner_name e molteplici candidati ZIP
+    text_chunks, chosen_inner, inner_list = await asyncio.to_thread(_upload_chunks, filename, file.file, inner_name)
+
+    # se ci sono più candidati e non hanno scelto -> ritorna 409 + lista
+    if inner_list is not None:
+        raise _zip_inner_required(inner_list)
+
+    # --- parsing streaming + index-detection come prima (risultato completo in cache) ---
+    assert text_chunks is not None
+    args = (text_chunks, shape_msg, include_rows, approx, codes if pushdown else None, UPLOAD_CODE_KEYS,
+            None if pushdown else ("upload:" + filename, month, base_sid, chosen_inner))
+    if mrf_exec.use_processes(size):
+        # upload grande: in un processo, che riapre il file da un path
+        async with _spooled_copy(file.file, Path(filename).suffix) as tmp:
+            entry = await _run_parse(*args, local=(tmp, chosen_inner, filename))
+    else:
+        entry = await _run_parse(*args)
+    entry["source_inner"] = chosen_inner
+    stored = await asyncio.to_thread(RESULT_CACHE.put, sid, entry)
+    res = await asyncio.to_thread(_answer, entry, codes, include_rows, UPLOAD_CODE_KEYS, approx)
+    assert res is not None
+    return _upload_response(res, file, chosen_inner, include_rows, _cache_meta(False, None, stored), approx, entry)
+
+def _hash_upload(f: Any) -> Tuple[str, int]:
+    """(sha256, dimensione) del file caricato, leggendolo a chunk; 413 oltre MAX_SIZE_BYTES."""
+    f.seek(0)
+    h = hashlib.sha256()
+    total = 0
+    with mrf_metrics.span("hash"):
+        for block in iter(lambda: f.read(FETCH_CHUNK), b""):
+            total += len(block)
+            if total > MAX_SIZE_BYTES:
+                raise HTTPException(413, f"File too large (limit {MAX_SIZE_BYTES // (1024 * 1024)}MB).")
+            h.update(block)
+    mrf_metrics.add("hash", total)
+    f.seek(0)
+    return h.hexdigest(), total
+
+def _iter_fileobj(f: Any) -> Iterator[bytes]:
+    f.seek(0)
+    for block in iter(lambda: f.read(FETCH_CHUNK), b""):
+        yield block
+
+def _upload_bytes(f: Any) -> Iterator[bytes]:
+    return mrf_metrics.wrap(_iter_fileobj(f), "fetch")  # type: ignore[return-value]
+
+def _upload_chunks(filename: str, f: Any, inner_name: Optional[str]) -> Tuple[Optional[Iterator[str]], Optional[str], Optional[List[str]]]:
     """
-    Ritorna (text, chosen_inner, inner_list_if_multiple)
-    - Se .zip e inner_name è fornito -> apre quello
-    - Se .zip e più candidati ma inner_name mancante -> non legge nulla e ritorna la lista
-    - Altri formati come prima
+    Testo dell'upload senza mai averlo intero: ritorna (chunk di testo, chosen_inner,
+    inner_list_if_multiple) leggendo dal file spoolato.
+    Gli errori di gunzip/ZIP arrivano durante il consumo dei chunk (stessi 400/413).
     """
     name = (filename or "").lower()
 
     # .gz esterno
     if name.endswith(".gz"):
-        try:
-            raw = gzip.decompress(data)
-        except Exception:
-            raise HTTPException(400, "Invalid GZ file.")
-        return raw.decode("utf-8", errors="replace"), None, None
+        return _decode(_guard_gz(_gunzip(_upload_bytes(f)), "Invalid GZ file.")), None, None
 
-    # .zip esterno
+    # .zip esterno: lo ZIP si legge dal file (seek sulla central directory), non dai bytes
     if name.endswith(".zip"):
+        f.seek(0)
         try:
-            candidates = _zip_candidates(data)
-            if not candidates:
-                raise HTTPException(415, "ZIP does not contain a .json/.csv/.ndjson file.")
-            # se inner_name non c'è e ci sono molte opzioni -> chiedi scelta
-            if inner_name is None and len(candidates) > 1:
-                return "", None, [c.filename for c in candidates]
-            # se inner_name mancante ma 1 candidato, usa quello
-            chosen = inner_name or candidates[0].filename
-            payload = _read_inner_from_zip(data, chosen)
-            return payload.decode("utf-8", errors="replace"), chosen, None
-        except HTTPException:
-            raise
+            with zipfile.ZipFile(f) as zf:
+                candidates = _zip_member_names(zf)
         except Exception:
             raise HTTPException(400, "Invalid ZIP file.")
+        if not candidates:
+            raise HTTPException(415, "ZIP does not contain a .json/.csv/.ndjson file.")
+        # se inner_name non c'è e ci sono molte opzioni -> chiedi scelta
+        if inner_name is None and len(candidates) > 1:
+            return None, None, candidates
+        chosen, body = _open_zip_member(f, inner_name or candidates[0])
+        return _decode(body), chosen, None
 
     # flat text
-    return data.decode("utf-8", errors="replace"), None, None
-
+    return _decode(_upload_bytes(f)), None, None
 
-@app.post("/api/summary_upload")
-async def summary_upload(
-    file: UploadFile = File(...),
-    codes: List[str] = Form(default=[]),
-    include_rows: bool = Form(default=True),
-    inner_name: Optional[str] = Form(default=None),   # <-- NOVITÀ
-):
-    # -- lettura a chunk come prima --
-    total = 0
-    chunks: List[bytes] = []
-    while True:
-        chunk = await file.read(1024 * 1024)
-        if not chunk:
-            break
-        total += len(chunk)
-        if total > MAX_SIZE_BYTES:
-            raise HTTPException(413, "File too large (limit 50MB). For larger files use streaming mode.")
-        chunks.append(chunk)
-    data = b"".join(chunks)
-
-    # ► nuovo: normalizza testo tenendo conto di inner_name e molteplici candidati ZIP
-    text, chosen_inner, inner_list = _text_from_upload_with_choice(getattr(file, "filename", ""), data, inner_name)
-
-    # se ci sono più candidati e non hanno scelto -> ritorna 409 + lista
-    if inner_list is not None:
-        raise HTTPException(
-            status_code=409,
-            detail={
-                "error": "zip_inner_required",
-                "message": "This ZIP contains multiple files. Pick one.",
-                "inner_files": inner_list[:50],  # safety
-            },
-        )
-
-    # --- parsing generalista + index-detection come prima ---
-    rows: List[Dict[str, Any]] = []
+@asynccontextmanager
+async def _spooled_copy(src: Any, suffix: str) -> AsyncIterator[str]:
+    """I worker riaprono il file da un path: copia a chunk dello spool in un file vero."""
+    fd, tmp = tempfile.mkstemp(suffix=suffix)
     try:
-        obj = json.loads(text)
-        suggestions = _extract_in_network_urls(obj)
-        if suggestions:
-            _raise_index_suggestions(suggestions)  # 409 + suggestions (URL)
-    except json.JSONDecodeError:
-        rows = _find_first_array_of_objects(text) or []
-        if not rows:
-            rows = parse_csv(text)
-    else:
-        rows = _find_first_array_of_objects(obj) or []
-        if not rows:
-            raise HTTPException(400, "Expected an array, { data: [...] }, any object with a first array of objects, or NDJSON.")
-
-    rows = normalize_rows(rows)
-
-    if codes and rows and isinstance(rows[0], dict):
-        code_set = set(map(str, codes))
-        def _match(r: Dict[str, Any]) -> bool:
-            for k in ("code", "cpt", "drg", "billing_code", "hcpcs", "cpt_code"):
-                if k in r and str(r.get(k)) in code_set:
-                    return True
-            return False
-        rows = [r for r in rows if _match(r)]
-
-    res = _summarize(rows)
-    if not include_rows:
-        res.pop("rows", None)
-
+        with os.fdopen(fd, "wb") as f:
+            src.seek(0)
+            await asyncio.to_thread(shutil.copyfileobj, src, f, FETCH_CHUNK)
+        yield tmp
+    finally:
+        os.unlink(tmp)
+
+async def _zip_upload_all(src: Any, shape_msg: str, include_rows: bool, approx: bool,
+                          codes: Optional[List[str]]) -> Dict[str, Any]:
+    async with _spooled_copy(src, ".zip") as tmp:
+        zm = _zip_members_of(tmp)
+        entry = await _zip_all_entry(zm, shape_msg, include_rows, approx, codes, UPLOAD_CODE_KEYS)
+    entry["source_inner"] = None
+    return entry
+
+def _upload_response(res: Dict[str, Any], file: UploadFile, chosen_inner: Optional[str],
+                     include_rows: bool, cache: Dict[str, Any], approx: bool = False,
+                     entry: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     res["meta"] = {
         "source": getattr(file, "filename", "upload"),
         "source_inner": chosen_inner,  # <-- se ZIP
         "fetched_at": datetime.now(timezone.utc).isoformat(),
         "index_month_hint": _infer_index_month(getattr(file, "filename", "")) or _infer_index_month(chosen_inner or ""),
         "include_rows": include_rows,
+        "cache": cache,
     }
+    if approx:
+        res["meta"]["approx"] = _approx_meta(True)
+    for k in ("pushdown", "zip_members", "shards"):
+        if entry is not None and k in entry:
+            res["meta"][k] = entry[k]
     return res
\ No newline at end of file
@@ -0,0 +1,197 @@
+"""
+Cache dei risultati (righe normalizzate / aggregati per codice) indicizzata per
+identità della sorgente: URL + ETag/Last-Modified per i file remoti, hash del
+contenuto per upload e file locali.
+
+Due livelli:
+- memoria: LRU limitata in byte (stima);
+- disco (opzionale): le entry espulse dalla memoria finiscono in pickle su disco,
+  con un tetto di dimensione e LRU per mtime.
+
+Configurazione via env:
+  COSTVISTA_CACHE_MAX_BYTES (256MB)   COSTVISTA_CACHE_DIR (disattivo)
+  COSTVISTA_CACHE_DISK_MAX_BYTES (2GB)
+"""
+from typing import Any, Dict, Optional, Tuple, Union
+from collections import OrderedDict
+from pathlib import Path
+import hashlib, json, os, pickle, threading
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, "") or default)
+    except ValueError:
+        return default
+
+
+def estimate_size(entry: Dict[str, Any]) -> int:
+    """Stima (grezza ma economica) della memoria occupata da un'entry: JSON di un
+    campione di righe/summary x numero di elementi x overhead degli oggetti Python."""
+    size = 0
+    for key in ("summary", "rows"):
+        items = entry.get(key) or []
+        if not items:
+            continue
+        sample = items[:50]
+        per_item = len(json.dumps(sample, default=str)) / len(sample)
+        size += int(per_item * len(items) * 3)
+    return size + 1024
+
+
+class ResultCache:
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, disk_dir: Optional[str] = None,
+                 disk_max_bytes: int = 2 * 1024 ** 3):
+        self.max_bytes = max_bytes
+        self.disk = Path(disk_dir) if disk_dir else None
+        self.disk_max_bytes = disk_max_bytes
+        self._mem: "OrderedDict[str, Tuple[Dict[str, Any], int]]" = OrderedDict()
+        self._mem_bytes = 0
+        self._validators: Dict[str, Dict[str, str]] = {}  # url -> validator dell'ultima entry
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "memory_hits": 0, "disk_hits": 0,
+                      "evictions": 0, "spills": 0}
+        if self.disk:
+            self.disk.mkdir(parents=True, exist_ok=True)
+
+    @classmethod
+    def from_env(cls) -> "ResultCache":
+        return cls(
+            max_bytes=_env_int("COSTVISTA_CACHE_MAX_BYTES", 256 * 1024 * 1024),
+            disk_dir=os.getenv("COSTVISTA_CACHE_DIR") or None,
+            disk_max_bytes=_env_int("COSTVISTA_CACHE_DISK_MAX_BYTES", 2 * 1024 ** 3),
+        )
+
+    # ---------- lookup ----------
+    def get(self, key: str, require: Union[str, Tuple[str, ...], None] = None) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """(entry, tier) con tier "memory" | "disk"; (None, None) se assente
+        o se manca la chiave (o una delle chiavi) `require` (es. "rows"): conta come miss."""
+        need = (require,) if isinstance(require, str) else (require or ())
+        with self._lock:
+            hit = self._mem.get(key)
+            if hit is not None and any(k not in hit[0] for k in need):
+                self.stats["misses"] += 1
+                return None, None
+            if hit is not None:
+                self._mem.move_to_end(key)
+                self.stats["hits"] += 1
+                self.stats["memory_hits"] += 1
+                return hit[0], "memory"
+        entry = self._disk_get(key)
+        if entry is not None and any(k not in entry for k in need):
+            entry = None
+        with self._lock:
+            if entry is None:
+                self.stats["misses"] += 1
+                return None, None
+            self.stats["hits"] += 1
+            self.stats["disk_hits"] += 1
+        self._mem_put(key, entry)  # promuovi in memoria
+        return entry, "disk"
+
+    def put(self, key: str, entry: Dict[str, Any], url: Optional[str] = None,
+            validators: Optional[Dict[str, str]] = None) -> bool:
+        """Mette l'entry in cache; False se non ci è rimasta (troppo grande per la
+        memoria e niente disco, o tolta subito dal prune)."""
+        if url and validators:
+            with self._lock:
+                self._validators[url] = dict(validators)
+        self._mem_put(key, entry)
+        return self.has(key)
+
+    def has(self, key: str) -> bool:
+        """L'entry c'è (memoria o disco)? Non conta come hit/miss."""
+        with self._lock:
+            if key in self._mem:
+                return True
+        return bool(self.disk) and self._disk_path(key).exists()
+
+    def validators_for(self, url: str) -> Dict[str, str]:
+        """Validator (etag/last_modified) con cui abbiamo in cache l'ultima versione di url."""
+        with self._lock:
+            return dict(self._validators.get(url) or {})
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.stats, "entries": len(self._mem), "bytes": self._mem_bytes}
+
+    # ---------- memoria ----------
+    def _mem_put(self, key: str, entry: Dict[str, Any]) -> None:
+        size = estimate_size(entry)
+        spill = []
+        with self._lock:
+            old = self._mem.pop(key, None)
+            if old is not None:
+                self._mem_bytes -= old[1]
+            if size > self.max_bytes:
+                spill.append((key, entry))
+            else:
+                self._mem[key] = (entry, size)
+                self._mem_bytes += size
+                while self._mem_bytes > self.max_bytes and self._mem:
+                    k, (e, s) = self._mem.popitem(last=False)
+                    self._mem_bytes -= s
+                    self.stats["evictions"] += 1
+                    spill.append((k, e))
+        for k, e in spill:
+            self._disk_put(k, e)
+
+    # ---------- disco ----------
+    def _disk_path(self, key: str) -> Path:
+        assert self.disk is not None
+        return self.disk / (hashlib.sha256(key.encode("utf-8")).hexdigest()[:40] + ".pkl")
+
+    def _disk_get(self, key: str) -> Optional[Dict[str, Any]]:
+        if not self.disk:
+            return None
+        fp = self._disk_path(key)
+        try:
+            with fp.open("rb") as f:
+                stored_key, entry = pickle.load(f)
+        except (OSError, EOFError, pickle.PickleError, ValueError):
+            return None
+        if stored_key != key:
+            return None
+        os.utime(fp)  # LRU
+        return entry
+
+    def _disk_put(self, key: str, entry: Dict[str, Any]) -> None:
+        if not self.disk:
+            return
+        fp = self._disk_path(key)
+        tmp = fp.with_suffix(".tmp")
+        with tmp.open("wb") as f:
+            pickle.dump((key, entry), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, fp)
+        with self._lock:
+            self.stats["spills"] += 1
+        self._disk_prune()
+
+    def _disk_prune(self) -> None:
+        assert self.disk is not None
+        files = sorted(self.disk.glob("*.pkl"), key=lambda p: p.stat().st_mtime)
+        total = sum(p.stat().st_size for p in files)
+        for p in files:
+            if total <= self.disk_max_bytes:
+                break
+            total -= p.stat().st_size
+            p.unlink(missing_ok=True)
+
+
+_DIGEST_MEMO: Dict[str, Tuple[int, int, str]] = {}
+
+
+def file_digest(fp: Path) -> str:
+    """sha256 del contenuto di un file locale, memoizzato su (size, mtime)."""
+    st = fp.stat()
+    key = str(fp)
+    memo = _DIGEST_MEMO.get(key)
+    if memo and memo[0] == st.st_size and memo[1] == st.st_mtime_ns:
+        return memo[2]
+    h = hashlib.sha256()
+    with fp.open("rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    digest = h.hexdigest()
+    _DIGEST_MEMO[key] = (st.st_size, st.st_mtime_ns, digest)
+    return digest
@@ -0,0 +1,191 @@
+"""
+Refresh mensile incrementale: impronte per codice del mese precedente.
+
+I payer ripubblicano gli MRF ogni mese e di solito cambia poco. Per ogni serie (la
+sorgente senza la data: .../2025-02-01_uhc.json -> .../{date}_uhc.json) si tengono,
+mese per mese, l'impronta di ogni codice (SummaryBuilder.digests: descrizione e
+sequenza di tariffe/provider) e la sua voce di summary. Il mese dopo il file va
+comunque letto per intero (solo così si sa cosa è cambiato), ma si risommarizzano
+solo i codici con l'impronta diversa: le altre voci si riportano tali e quali
+(identiche byte per byte a quelle che si ricalcolerebbero). In più il report delta:
+codici aggiunti, tolti e cambiati, con di quanto.
+
+Persistenza SQLite, una "fotografia" per (serie, mese); si tengono gli ultimi
+COSTVISTA_DELTA_KEEP_MONTHS mesi per serie.
+
+Configurazione via env (default fra parentesi):
+  COSTVISTA_DELTA_DIR (<tmp>/costvista-delta)   COSTVISTA_DELTA_KEEP_MONTHS (24)
+"""
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from datetime import datetime, timezone
+from contextlib import closing
+from pathlib import Path
+import json, os, re, sqlite3, tempfile, threading
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY,
+    series TEXT NOT NULL,
+    month TEXT NOT NULL,
+    sid TEXT NOT NULL,
+    code_count INTEGER NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS snapshots_by_month ON snapshots (series, month);
+CREATE TABLE IF NOT EXISTS codes (
+    snap INTEGER NOT NULL,
+    code TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    entry TEXT NOT NULL,
+    PRIMARY KEY (snap, code)
+) WITHOUT ROWID;
+"""
+
+# codice -> (impronta, voce di summary) del mese precedente
+Carry = Dict[str, Tuple[str, Dict[str, Any]]]
+
+_DATE_RE = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, "") or default)
+    except ValueError:
+        return default
+
+
+def series_of(source: str) -> str:
+    """La sorgente senza la data di pubblicazione: stessa serie da un mese all'altro."""
+    return _DATE_RE.sub("{date}", source)
+
+
+def incremental_summary(builder: Any, carry: Carry, top_k: int = 3) -> Tuple[List[Dict[str, Any]], Dict[str, str]]:
+    """(summary, impronte per codice): solo i codici con l'impronta diversa da `carry`
+       passano dal sort/quantili del builder, gli altri si riportano. Le voci riportate
+       sono quelle che si ricalcolerebbero, quindi il risultato non dipende da `carry`
+       (e si può condividere fra richieste con mesi precedenti diversi)."""
+    digests = builder.digests()
+    out: List[Dict[str, Any]] = []
+    changed: List[int] = []
+    for cid, (code, d) in enumerate(zip(builder.code_names, digests)):
+        prev = carry.get(code)
+        if prev is not None and prev[0] == d:
+            out.append(prev[1])
+        else:
+            changed.append(cid)
+    out += builder.summary(top_k=top_k, only=changed)
+    out.sort(key=lambda s: s["code"])
+    return out, dict(zip(builder.code_names, digests))
+
+
+def incremental_counts(carry: Carry, digests: Dict[str, str]) -> Dict[str, int]:
+    """Codici da risommarizzare e codici riportati rispetto a `carry` (per richiesta:
+       l'entry in cache può venire da un refresh con un altro mese precedente)."""
+    carried = sum(1 for code, d in digests.items() if code in carry and carry[code][0] == d)
+    return {"resummarized": len(digests) - carried, "carried_forward": carried}
+
+
+def _pair(prev: Dict[str, Any], cur: Dict[str, Any], k: str) -> List[Any]:
+    return [prev.get(k), cur.get(k)]
+
+
+def delta_report(carry: Carry, digests: Dict[str, str], summary: Iterable[Dict[str, Any]],
+                 codes: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+    """Differenze col mese precedente (eventualmente solo per `codes`): aggiunti e
+       tolti, e per i cambiati count/min/median/max [prima, dopo] + variazione % della mediana."""
+    wanted = set(map(str, codes)) if codes else None
+    cur = {s["code"]: s for s in summary if wanted is None or s["code"] in wanted}
+    prev_codes = [c for c in carry if wanted is None or c in wanted]
+    changed: List[Dict[str, Any]] = []
+    unchanged = 0
+    for code, s in cur.items():
+        prev = carry.get(code)
+        if prev is None:
+            continue
+        if prev[0] == digests.get(code):
+            unchanged += 1
+            continue
+        p = prev[1]
+        pm, cm = p.get("median") or 0.0, s.get("median") or 0.0
+        changed.append({
+            "code": code,
+            "count": _pair(p, s, "count"),
+            "min": _pair(p, s, "min"),
+            "median": _pair(p, s, "median"),
+            "max": _pair(p, s, "max"),
+            "median_change_pct": round((cm - pm) / pm * 100.0, 2) if pm else None,
+        })
+    return {
+        "added": sorted(c for c in cur if c not in carry),
+        "removed": sorted(c for c in prev_codes if c not in cur),
+        "changed": sorted(changed, key=lambda c: c["code"]),
+        "unchanged": unchanged,
+    }
+
+
+class DigestStore:
+    def __init__(self, path: str, keep_months: int = 24):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.keep_months = keep_months
+        self._write_lock = threading.Lock()
+        with closing(self._connect()) as db:
+            db.executescript(_SCHEMA)
+
+    @classmethod
+    def from_env(cls) -> "DigestStore":
+        d = os.getenv("COSTVISTA_DELTA_DIR") or str(Path(tempfile.gettempdir()) / "costvista-delta")
+        return cls(str(Path(d) / "digests.sqlite"), keep_months=_env_int("COSTVISTA_DELTA_KEEP_MONTHS", 24))
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(str(self.path), timeout=30)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    # ---------- lettura ----------
+    def previous(self, series: str, month: str) -> Optional[Tuple[str, Carry]]:
+        """(mese, impronte + voci) della fotografia più recente PRIMA di `month`; None se non c'è."""
+        with closing(self._connect()) as db:
+            row = db.execute(
+                "SELECT id, month FROM snapshots WHERE series = ? AND month < ? ORDER BY month DESC LIMIT 1",
+                (series, month),
+            ).fetchone()
+            if row is None:
+                return None
+            carry = {code: (digest, json.loads(entry)) for code, digest, entry in
+                     db.execute("SELECT code, digest, entry FROM codes WHERE snap = ?", (row[0],))}
+        return row[1], carry
+
+    def has(self, series: str, month: str, sid: str) -> bool:
+        with closing(self._connect()) as db:
+            return db.execute("SELECT 1 FROM snapshots WHERE series = ? AND month = ? AND sid = ?",
+                              (series, month, sid)).fetchone() is not None
+
+    # ---------- scrittura ----------
+    def save(self, series: str, month: str, sid: str, digests: Dict[str, str],
+             summary: Iterable[Dict[str, Any]]) -> None:
+        """Fotografia di (series, month): sostituisce quella di prima per lo stesso mese."""
+        rows = [(s["code"], digests[s["code"]], json.dumps(s)) for s in summary if s["code"] in digests]
+        with self._write_lock, closing(self._connect()) as db:
+            old = [i for (i,) in db.execute("SELECT id FROM snapshots WHERE series = ? AND month = ?", (series, month))]
+            self._drop(db, old)
+            snap = db.execute(
+                "INSERT INTO snapshots (series, month, sid, code_count, created_at) VALUES (?, ?, ?, ?, ?)",
+                (series, month, sid, len(rows), datetime.now(timezone.utc).isoformat()),
+            ).lastrowid
+            db.executemany("INSERT INTO codes (snap, code, digest, entry) VALUES (?, ?, ?, ?)",
+                           [(snap, *r) for r in rows])
+            # solo gli ultimi keep_months mesi della serie
+            stale = [i for (i,) in db.execute(
+                "SELECT id FROM snapshots WHERE series = ? ORDER BY month DESC LIMIT -1 OFFSET ?",
+                (series, max(1, self.keep_months)),
+            )]
+            self._drop(db, stale)
+            db.commit()
+
+    @staticmethod
+    def _drop(db: sqlite3.Connection, ids: List[int]) -> None:
+        for i in ids:
+            db.execute("DELETE FROM codes WHERE snap = ?", (i,))
+            db.execute("DELETE FROM snapshots WHERE id = ?", (i,))
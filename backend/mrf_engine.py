@@ -0,0 +1,231 @@
+"""
+Motore colonnare per le statistiche per codice (sostituisce i gruppi di dict).
+
+Le righe vengono "appiattite" in colonne contigue:
+  code_id  (int64, codice dizionario-codificato)
+  rate     (float64)
+  prov_id  (int64, provider dizionario-codificato)
+Poi UN solo ordinamento (code_id, rate) – stabile, quindi a parità di tariffa vale
+l'ordine di arrivo come nel vecchio sorted() – e per ogni gruppo contiguo si leggono
+count/min/p25/median/p75/max e i top-k provider con aritmetica sugli indici.
+
+Usa NumPy se installato; altrimenti un fallback puro Python (array + sort con key C).
+Mediana e percentili con median_sorted/percentile_sorted (qui sotto, usate anche
+da mrf_sketch quando lo sketch è esatto): stesse formule di sempre, l'output JSON
+non cambia di un byte.
+"""
+from typing import Any, Dict, Iterable, List, Optional
+from array import array
+from bisect import bisect_right
+import hashlib, struct
+
+try:  # NumPy è opzionale
+    import numpy as np  # type: ignore
+except ImportError:  # pragma: no cover
+    np = None
+
+
+class SummaryBuilder:
+    """Accumula righe normalizzate in colonne e produce la lista `summary`."""
+
+    def __init__(self):
+        self.code_ids: Dict[str, int] = {}
+        self.code_names: List[str] = []
+        self.first_desc: List[Optional[str]] = []  # prima descrizione non vuota per codice
+        self.prov_ids: Dict[str, int] = {}
+        self.prov_names: List[str] = []
+        self.code_col = array("q")
+        self.rate_col = array("d")
+        self.prov_col = array("q")
+
+    def add(self, r: Dict[str, Any]) -> None:
+        self.add_rows((r,))
+
+    def add_rows(self, rows: Iterable[Dict[str, Any]]) -> None:
+        # lookup in variabili locali: è l'hot loop di ogni summary
+        code_ids, code_names, first_desc = self.code_ids, self.code_names, self.first_desc
+        prov_ids, prov_names = self.prov_ids, self.prov_names
+        code_app, rate_app, prov_app = self.code_col.append, self.rate_col.append, self.prov_col.append
+        for r in rows:
+            code = str(r.get("code", "")).strip()
+            if not code:
+                continue
+            cid = code_ids.get(code)
+            if cid is None:
+                cid = code_ids[code] = len(code_names)
+                code_names.append(code)
+                first_desc.append(None)
+            if first_desc[cid] is None:
+                d = str(r.get("description") or "")
+                if d:
+                    first_desc[cid] = d.strip()
+            prov = str(r.get("provider_name") or "")
+            pid = prov_ids.get(prov)
+            if pid is None:
+                pid = prov_ids[prov] = len(prov_names)
+                prov_names.append(prov)
+            code_app(cid)
+            rate_app(float(r.get("negotiated_rate") or 0))
+            prov_app(pid)
+
+    def merge(self, other: "SummaryBuilder") -> None:
+        """Accoda le colonne di `other` (es. un altro membro ZIP elaborato in un altro
+        processo) come se le sue righe arrivassero dopo le nostre."""
+        cmap = array("q")
+        for cid, code in enumerate(other.code_names):
+            mine = self.code_ids.get(code)
+            if mine is None:
+                mine = self.code_ids[code] = len(self.code_names)
+                self.code_names.append(code)
+                self.first_desc.append(other.first_desc[cid])
+            elif self.first_desc[mine] is None:
+                self.first_desc[mine] = other.first_desc[cid]
+            cmap.append(mine)
+        pmap = array("q")
+        for prov in other.prov_names:
+            pid = self.prov_ids.get(prov)
+            if pid is None:
+                pid = self.prov_ids[prov] = len(self.prov_names)
+                self.prov_names.append(prov)
+            pmap.append(pid)
+        if np is not None and len(other.rate_col):
+            self.code_col.frombytes(np.frombuffer(cmap, dtype=np.int64)[np.frombuffer(other.code_col, dtype=np.int64)].tobytes())
+            self.prov_col.frombytes(np.frombuffer(pmap, dtype=np.int64)[np.frombuffer(other.prov_col, dtype=np.int64)].tobytes())
+        else:
+            self.code_col.extend(cmap[c] for c in other.code_col)
+            self.prov_col.extend(pmap[p] for p in other.prov_col)
+        self.rate_col.extend(other.rate_col)
+
+    def __len__(self) -> int:
+        return len(self.rate_col)
+
+    # ---------- output ----------
+    def summary(self, top_k: int = 3, only: Optional[Iterable[int]] = None) -> List[Dict[str, Any]]:
+        """Voci per codice ordinate per codice; con `only` (code id) solo quei codici
+           (le altre righe non entrano nemmeno nel sort)."""
+        if not len(self.rate_col):
+            return []
+        keep = None if only is None else sorted(set(only))
+        if keep is not None and not keep:
+            return []
+        if np is not None:
+            groups = self._groups_numpy(top_k, keep)
+        else:
+            groups = self._groups_python(top_k, keep)
+        out = []
+        for cid, count, mn, p25, med, p75, mx, top in groups:
+            out.append({
+                "code": self.code_names[cid], "description": self.first_desc[cid] or "", "count": count,
+                "min": mn, "median": med, "p25": p25, "p75": p75, "max": mx,
+                "top3": [{"provider_name": self.prov_names[p], "negotiated_rate": v} for p, v in top],
+            })
+        out.sort(key=lambda s: s["code"])
+        return out
+
+    def _groups_numpy(self, top_k: int, keep: Optional[List[int]] = None):
+        codes = np.frombuffer(self.code_col, dtype=np.int64)
+        rates = np.frombuffer(self.rate_col, dtype=np.float64)
+        provs = np.frombuffer(self.prov_col, dtype=np.int64)
+        if keep is not None:
+            mask = np.isin(codes, np.array(keep, dtype=np.int64))
+            codes, rates, provs = codes[mask], rates[mask], provs[mask]
+        order = np.lexsort((rates, codes))  # stabile
+        sc, sr, sp = codes[order], rates[order], provs[order]
+        n = len(sc)
+        starts = np.flatnonzero(np.concatenate(([True], sc[1:] != sc[:-1])))
+        ends = np.append(starts[1:], n)
+        cnt = ends - starts
+
+        m = cnt // 2
+        odd = (cnt % 2) == 1
+        med = np.where(odd, sr[starts + m], (sr[starts + np.maximum(m - 1, 0)] + sr[starts + m]) / 2.0)
+
+        def pct(p: float):
+            k = (cnt - 1) * (p / 100.0)
+            f = k.astype(np.int64)
+            c = np.minimum(f + 1, cnt - 1)
+            lo, hi = sr[starts + f], sr[starts + c]
+            return np.where(f == c, lo, lo + (hi - lo) * (k - f))
+
+        cols = (
+            sc[starts].tolist(), cnt.tolist(), sr[starts].tolist(), pct(25).tolist(),
+            med.tolist(), pct(75).tolist(), sr[ends - 1].tolist(),
+        )
+        # top-k: le prime k posizioni di ogni gruppo (già ordinate per tariffa)
+        tops = []
+        for j in range(top_k):
+            pos = np.minimum(starts + j, n - 1)
+            tops.append(((j < cnt).tolist(), sp[pos].tolist(), sr[pos].tolist()))
+        for g, (cid, count, mn, p25, md, p75, mx) in enumerate(zip(*cols)):
+            top = [(p[g], v[g]) for ok, p, v in tops if ok[g]]
+            yield cid, count, mn, p25, md, p75, mx, top
+
+    def _groups_python(self, top_k: int, keep: Optional[List[int]] = None):
+        rates, codes, provs = self.rate_col, self.code_col, self.prov_col
+        if keep is None:
+            order = list(range(len(rates)))
+        else:
+            wanted = set(keep)
+            order = [i for i, c in enumerate(codes) if c in wanted]
+        # due sort stabili con key in C = sort per (code, rate) mantenendo l'ordine d'arrivo
+        order.sort(key=rates.__getitem__)
+        order.sort(key=codes.__getitem__)
+        sc = [codes[i] for i in order]
+        n = len(order)
+        s = 0
+        while s < n:
+            cid = sc[s]
+            e = bisect_right(sc, cid, s)
+            vals = [rates[i] for i in order[s:e]]
+            top = [(provs[i], rates[i]) for i in order[s:min(e, s + top_k)]]
+            yield (cid, len(vals), vals[0], percentile_sorted(vals, 25), median_sorted(vals),
+                   percentile_sorted(vals, 75), vals[-1], top)
+            s = e
+
+    def digests(self) -> List[str]:
+        """Impronta per codice (indice = code id) di tutto ciò da cui dipende la sua voce
+           di summary: descrizione e sequenza (tariffa, provider) in ordine d'arrivo
+           (a parità di tariffa l'ordine decide il top3). Stessa impronta => stessa voce,
+           byte per byte, anche fra builder diversi (i provider entrano per nome)."""
+        hs = []
+        for d in self.first_desc:
+            b = (d or "").encode("utf-8")
+            hs.append(hashlib.blake2b(len(b).to_bytes(4, "little") + b, digest_size=16))
+        if len(self.rate_col):
+            prov_h = [hashlib.blake2b(p.encode("utf-8"), digest_size=8).digest() for p in self.prov_names]
+            if np is not None:
+                self._digest_numpy(hs, prov_h)
+            else:
+                pack = struct.Struct("<d").pack
+                for c, r, p in zip(self.code_col, self.rate_col, self.prov_col):
+                    hs[c].update(pack(r) + prov_h[p])
+        return [h.hexdigest() for h in hs]
+
+    def _digest_numpy(self, hs: List[Any], prov_h: List[bytes]) -> None:
+        # stessi byte del fallback: per riga 8 byte di tariffa (LE) + 8 di hash del provider
+        codes = np.frombuffer(self.code_col, dtype=np.int64)
+        # con meno di 65536 codici (il caso normale) il sort stabile su uint16 è un radix sort
+        keys = codes.astype(np.uint16) if len(self.code_names) <= 0xFFFF else codes
+        order = np.argsort(keys, kind="stable")
+        rec = np.empty(len(order), dtype=[("r", "<f8"), ("p", "V8")])
+        rec["r"] = np.frombuffer(self.rate_col, dtype=np.float64)[order]
+        rec["p"] = np.frombuffer(b"".join(prov_h), dtype="V8")[np.frombuffer(self.prov_col, dtype=np.int64)[order]]
+        buf = memoryview(rec.tobytes())
+        sc = codes[order]
+        starts = np.flatnonzero(np.concatenate(([True], sc[1:] != sc[:-1])))
+        ends = np.append(starts[1:], len(sc))
+        for cid, s, e in zip(sc[starts].tolist(), starts.tolist(), ends.tolist()):
+            hs[cid].update(buf[s * 16:e * 16])
+
+
+def median_sorted(s: List[float]) -> float:
+    n = len(s); m = n // 2
+    return float(s[m]) if n % 2 else (s[m-1] + s[m]) / 2.0
+
+
+def percentile_sorted(s: List[float], p: float) -> float:
+    if len(s) == 1: return float(s[0])
+    k = (len(s) - 1) * (p / 100.0)
+    f = int(k); c = min(f + 1, len(s) - 1)
+    if f == c: return float(s[int(k)])
+    return float(s[f] + (s[c] - s[f]) * (k - f))
@@ -0,0 +1,268 @@
+"""
+Esecuzione del lavoro pesante (parse, normalize, summary) fuori dall'event loop.
+
+- processi ("spawn") per le sorgenti già su disco (file locali, upload, membri ZIP):
+  il parse non divide il GIL con l'event loop, che resta libero per /health e per
+  le richieste piccole;
+- un pool di thread dedicato per il resto (stream di rete, gunzip/inflate che
+  rilasciano il GIL), separato dal default executor che usiamo per cache e indice;
+- al più MAX_JOBS lavori pesanti alla volta, gli altri aspettano in coda; i cache
+  hit non passano di qui;
+- cancellazione: se il client se ne va, il lavoro si ferma al chunk successivo
+  (thread: Event; processi: file marcatore che il worker controlla);
+- single-flight: richieste uguali in volo aspettano lo stesso lavoro (SingleFlight),
+  che si ferma solo quando se ne sono andati tutti quelli che lo aspettano.
+
+Configurazione via env (default fra parentesi):
+  COSTVISTA_PROCESS_WORKERS (un processo per core)   COSTVISTA_PARSE_THREADS (4)
+  COSTVISTA_MAX_JOBS (processi + thread)             COSTVISTA_PROCESS_MIN_BYTES (8MB)
+"""
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, Iterator, List, Optional, Tuple, TypeVar, Union
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+import asyncio, contextvars, functools, multiprocessing, os, tempfile, threading, uuid
+
+T = TypeVar("T")
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, "") or default)
+    except ValueError:
+        return default
+
+
+PROCESS_WORKERS = _env_int("COSTVISTA_PROCESS_WORKERS", 0) or os.cpu_count() or 1
+PARSE_THREADS = _env_int("COSTVISTA_PARSE_THREADS", 4)
+MAX_JOBS = _env_int("COSTVISTA_MAX_JOBS", PROCESS_WORKERS + PARSE_THREADS)
+# sotto questa dimensione spawn + pickle costano più del parse: si resta nel thread
+PROCESS_MIN_BYTES = _env_int("COSTVISTA_PROCESS_MIN_BYTES", 8 * 1024 * 1024)
+
+
+class JobCancelled(Exception):
+    """Il client si è disconnesso: il lavoro si interrompe al chunk successivo."""
+
+
+class CancelToken:
+    """Segnale di stop per un lavoro. Nei thread basta l'Event; per i processi
+       `marker()` dà un path che il worker controlla (vedi `checked`)."""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._marker: Optional[str] = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def marker(self) -> str:
+        if self._marker is None:
+            self._marker = os.path.join(tempfile.gettempdir(), f"costvista-cancel-{uuid.uuid4().hex}")
+            if self.cancelled:
+                open(self._marker, "w").close()
+        return self._marker
+
+    def cancel(self) -> None:
+        self._event.set()
+        if self._marker is not None:
+            try:
+                open(self._marker, "w").close()
+            except OSError:
+                pass
+
+    def close(self) -> None:
+        if self._marker is not None:
+            try:
+                os.unlink(self._marker)
+            except FileNotFoundError:
+                pass
+
+
+def checked(items: Iterable[T], token: Union[CancelToken, str, None]) -> Iterator[T]:
+    """Passa gli elementi controllando prima di ognuno se il lavoro è stato annullato
+       (token nel processo stesso, oppure path del marcatore da un altro processo)."""
+    if token is None:
+        yield from items
+        return
+    if isinstance(token, str):
+        stop: Callable[[], bool] = functools.partial(os.path.exists, token)
+    else:
+        stop = lambda: token.cancelled  # noqa: E731
+    for item in items:
+        if stop():
+            raise JobCancelled()
+        yield item
+
+
+# ---------- pool ----------
+_PROCESS_POOL: Optional[ProcessPoolExecutor] = None
+_THREAD_POOL: Optional[ThreadPoolExecutor] = None
+_SLOTS: Optional[Tuple[asyncio.AbstractEventLoop, asyncio.Semaphore]] = None
+
+
+def use_processes(size: Optional[int] = None) -> bool:
+    """Vale la pena andare in un processo? (almeno 2 worker e file abbastanza grande)"""
+    return PROCESS_WORKERS > 1 and (size is None or size >= PROCESS_MIN_BYTES)
+
+
+def process_pool() -> ProcessPoolExecutor:
+    """Pool di processi creato al primo uso. "spawn": i worker non ereditano thread
+       e socket dell'event loop."""
+    global _PROCESS_POOL
+    if _PROCESS_POOL is None:
+        _PROCESS_POOL = ProcessPoolExecutor(max_workers=PROCESS_WORKERS,
+                                            mp_context=multiprocessing.get_context("spawn"))
+    return _PROCESS_POOL
+
+
+def thread_pool() -> ThreadPoolExecutor:
+    global _THREAD_POOL
+    if _THREAD_POOL is None:
+        _THREAD_POOL = ThreadPoolExecutor(max_workers=max(1, PARSE_THREADS), thread_name_prefix="costvista-parse")
+    return _THREAD_POOL
+
+
+def shutdown() -> None:
+    global _PROCESS_POOL, _THREAD_POOL
+    if _PROCESS_POOL is not None:
+        pool, _PROCESS_POOL = _PROCESS_POOL, None
+        pool.shutdown(wait=False, cancel_futures=True)
+    if _THREAD_POOL is not None:
+        tpool, _THREAD_POOL = _THREAD_POOL, None
+        tpool.shutdown(wait=False, cancel_futures=True)
+
+
+def _slots() -> asyncio.Semaphore:
+    global _SLOTS
+    loop = asyncio.get_running_loop()
+    if _SLOTS is None or _SLOTS[0] is not loop:
+        _SLOTS = (loop, asyncio.Semaphore(max(1, MAX_JOBS)))
+    return _SLOTS[1]
+
+
+@asynccontextmanager
+async def job_slot():
+    """Uno dei MAX_JOBS posti per il lavoro pesante (attesa in coda se sono tutti presi)."""
+    async with _slots():
+        yield
+
+
+async def run_thread(fn: Callable[..., T], *args: Any, token: Optional[CancelToken] = None) -> T:
+    """fn(*args) nel pool di parse (con i ContextVar del chiamante, come to_thread).
+       Se il chiamante viene cancellato, il token ferma il thread al chunk successivo."""
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    try:
+        return await loop.run_in_executor(thread_pool(), functools.partial(ctx.run, fn, *args))
+    except asyncio.CancelledError:
+        if token is not None:
+            token.cancel()
+        raise
+
+
+async def run_process(fn: Callable[..., T], *args: Any, token: Optional[CancelToken] = None) -> T:
+    """fn(*args) in un processo del pool (fn e argomenti devono essere picklabili).
+       Se il pool si rompe (worker morto: OOM, kill) lo si ricrea al prossimo giro e
+       questo lavoro finisce in un thread."""
+    global _PROCESS_POOL
+    loop = asyncio.get_running_loop()
+    pool = process_pool()
+    try:
+        fut = pool.submit(fn, *args)
+    except BrokenProcessPool:
+        fut = None
+    if fut is not None:
+        try:
+            return await asyncio.wrap_future(fut, loop=loop)
+        except asyncio.CancelledError:
+            fut.cancel()  # se non è ancora partito non parte più
+            if token is not None:
+                token.cancel()
+            raise
+        except BrokenProcessPool:
+            pass
+    if _PROCESS_POOL is pool:
+        _PROCESS_POOL = None
+    return await run_thread(fn, *args, token=token)
+
+
+async def cancel_on_disconnect(is_disconnected: Callable[[], Awaitable[bool]], aw: Awaitable[T],
+                               poll: float = 0.5) -> T:
+    """Esegue `aw` controllando ogni `poll` secondi se il client c'è ancora; se si è
+       disconnesso cancella il lavoro (che ferma thread e processi via CancelToken)
+       e solleva JobCancelled."""
+    task = asyncio.ensure_future(aw)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll)
+            if done:
+                return task.result()
+            if await is_disconnected():
+                break
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    task.cancel()
+    try:
+        await task
+    except (asyncio.CancelledError, Exception):
+        pass
+    raise JobCancelled()
+
+
+# ---------- single-flight ----------
+class _Flight:
+    __slots__ = ("task", "spec", "waiters")
+
+    def __init__(self, task: "asyncio.Task[Any]", spec: Any):
+        self.task = task
+        self.spec = spec
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Un solo lavoro per chiave alla volta: chi arriva mentre ce n'è uno in corso che
+       gli va bene (stessa `key` e `covers(spec)`) ne aspetta il risultato invece di
+       rifarlo. Il lavoro gira in un task suo (con i ContextVar di chi l'ha avviato):
+       se un chiamante viene cancellato gli altri continuano ad aspettare; il task si
+       cancella solo quando non lo aspetta più nessuno."""
+
+    def __init__(self):
+        self._flights: Dict[Tuple[int, Hashable], List[_Flight]] = {}
+        self.stats = {"started": 0, "joined": 0}
+
+    def in_flight(self) -> int:
+        return sum(len(v) for v in self._flights.values())
+
+    async def run(self, key: Hashable, factory: Callable[[], Awaitable[T]], spec: Any = None,
+                  covers: Optional[Callable[[Any], bool]] = None) -> Tuple[T, bool]:
+        """(risultato, condiviso): condiviso=True se ci si è agganciati al lavoro di un altro."""
+        loop = asyncio.get_running_loop()
+        slot = (id(loop), key)
+        for fl in self._flights.get(slot, ()):
+            if covers is None or covers(fl.spec):
+                self.stats["joined"] += 1
+                return await self._wait(fl), True
+        fl = _Flight(loop.create_task(factory()), spec)
+        self._flights.setdefault(slot, []).append(fl)
+        fl.task.add_done_callback(lambda _t: self._forget(slot, fl))
+        self.stats["started"] += 1
+        return await self._wait(fl), False
+
+    def _forget(self, slot: Tuple[int, Hashable], fl: _Flight) -> None:
+        flights = self._flights.get(slot)
+        if flights is not None and fl in flights:
+            flights.remove(fl)
+            if not flights:
+                del self._flights[slot]
+
+    @staticmethod
+    async def _wait(fl: _Flight) -> Any:
+        fl.waiters += 1
+        try:
+            return await asyncio.shield(fl.task)
+        finally:
+            fl.waiters -= 1
+            if fl.waiters == 0 and not fl.task.done():
+                fl.task.cancel()  # non lo aspetta più nessuno: si ferma (CancelToken nei worker)
@@ -0,0 +1,213 @@
+"""
+Gunzip in parallelo per i .gz grandi fatti di tanti member: gzip concatenati (gli
+export dei payer spesso sono così) e BGZF (blocchi gzip da <= 64KB, con la
+dimensione del blocco scritta nell'header).
+
+Ogni member si scompatta da solo, quindi lo stream compresso si taglia su inizi di
+member in fette di ~COSTVISTA_GUNZIP_SHARD_BYTES e le fette si scompattano in un
+pool di thread (zlib rilascia il GIL); l'output esce in ordine, a chunk, come da
+mrf_io.iter_gunzip. I tagli:
+  - BGZF: esatti, si salta di blocco in blocco con BSIZE;
+  - altrimenti: il primo header gzip plausibile dopo la dimensione della fetta.
+    Può essere un falso positivo dentro i dati compressi, quindi ogni fetta si
+    verifica: i suoi member devono finire esattamente dove inizia la successiva (e
+    zlib controlla il CRC di ognuno). Se una fetta non torna (o ha un errore vero)
+    da lì in poi si scompatta di fila, che dà lo stesso output e gli stessi errori.
+Un gzip normale (un member solo) non ha tagli: dopo COSTVISTA_GUNZIP_SHARD_BYTES x
+SEARCH_SHARDS byte senza un header si passa all'inflate seriale a streaming.
+
+Memoria: al più (thread + 1) fette in volo, ognuna col suo output scompattato, che
+non supera COSTVISTA_GUNZIP_SHARD_MAX_OUT: una fetta che scompatta di più (member
+molto comprimibili, zip bomb) si scarta e da lì si va di fila, a chunk come iter_gunzip.
+
+Configurazione via env (default fra parentesi):
+  COSTVISTA_GUNZIP_THREADS (core, max 4; 1 = sempre seriale)   COSTVISTA_GUNZIP_SHARD_BYTES (2MB)
+  COSTVISTA_GUNZIP_SHARD_MAX_OUT (32MB, output massimo di una fetta)
+"""
+from typing import Deque, Generator, Iterable, Iterator, List, Optional, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections import deque
+import os, struct, zlib
+
+from mrf_io import GZIP_MAGIC, GzipInflater, iter_gunzip as iter_gunzip_serial
+
+INPUT_STEP = 256 * 1024  # byte compressi dati a zlib per volta (unused_data resta piccolo)
+SEARCH_SHARDS = 4        # fette di byte senza header dopo le quali si rinuncia al parallelo
+_HEADER = 10
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, "") or default)
+    except ValueError:
+        return default
+
+
+THREADS = _env_int("COSTVISTA_GUNZIP_THREADS", min(4, os.cpu_count() or 1))
+SHARD_BYTES = max(64 * 1024, _env_int("COSTVISTA_GUNZIP_SHARD_BYTES", 2 * 1024 * 1024))
+SHARD_MAX_OUT = max(1, _env_int("COSTVISTA_GUNZIP_SHARD_MAX_OUT", 32 * 1024 * 1024))
+
+_POOL: Optional[ThreadPoolExecutor] = None
+
+
+def _pool() -> ThreadPoolExecutor:
+    global _POOL
+    if _POOL is None:
+        _POOL = ThreadPoolExecutor(max_workers=max(1, THREADS), thread_name_prefix="costvista-gunzip")
+    return _POOL
+
+
+def shutdown() -> None:
+    global _POOL
+    if _POOL is not None:
+        pool, _POOL = _POOL, None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+# ---------- header ----------
+def _plausible(buf: bytearray, p: int) -> bool:
+    """Header gzip credibile a p: magic, deflate, flag riservati a zero, XFL e OS sensati."""
+    return (buf[p + 2] == 8 and buf[p + 3] & 0xE0 == 0
+            and buf[p + 8] in (0, 2, 4) and (buf[p + 9] <= 13 or buf[p + 9] == 255))
+
+
+def bgzf_size(buf: bytearray, p: int) -> Optional[int]:
+    """Dimensione del blocco BGZF che inizia a p (campo extra "BC"); None se non è BGZF
+       o se l'header non è ancora tutto in buf."""
+    if len(buf) < p + 18 or buf[p:p + 2] != GZIP_MAGIC or not buf[p + 3] & 0x04:
+        return None
+    xlen = struct.unpack_from("<H", buf, p + 10)[0]
+    i, end = p + 12, min(p + 12 + xlen, len(buf))
+    while i + 4 <= end:
+        si1, si2, slen = buf[i], buf[i + 1], struct.unpack_from("<H", buf, i + 2)[0]
+        if si1 == 66 and si2 == 67 and slen == 2 and i + 6 <= end:
+            return struct.unpack_from("<H", buf, i + 4)[0] + 1
+        i += 4 + slen
+    return None
+
+
+def _find_cut(buf: bytearray, bgzf: bool, lo: int) -> Tuple[Optional[int], int]:
+    """(taglio, da dove riprendere la ricerca): il primo inizio di member >= SHARD_BYTES.
+       taglio None: serve altro input (o non c'è)."""
+    if bgzf:
+        p = 0
+        while p < SHARD_BYTES:
+            size = bgzf_size(buf, p)
+            if size is None:
+                return None, lo
+            p += size
+        return (p, lo) if p <= len(buf) else (None, lo)
+    p = buf.find(GZIP_MAGIC, lo)
+    while p >= 0:
+        if p + _HEADER > len(buf):
+            return None, p  # header a metà: si riguarda col prossimo chunk
+        if _plausible(buf, p):
+            return p, p
+        p = buf.find(GZIP_MAGIC, p + 1)
+    return None, max(lo, len(buf) - 1)
+
+
+# ---------- worker ----------
+def _inflate(data: bytes, last: bool, max_out: Optional[int] = None) -> Optional[List[bytes]]:
+    """Scompatta i member di una fetta. None se la fetta non torna (taglio sbagliato,
+       member tronco, dati corrotti) o se scompatta più di `max_out` byte (default
+       SHARD_MAX_OUT): il chiamante riparte da qui in seriale."""
+    view = memoryview(data)
+    out: List[bytes] = []
+    pos, end = 0, len(data)
+    budget = SHARD_MAX_OUT if max_out is None else max_out
+    try:
+        while pos < end:
+            if view[pos:pos + 2] != GZIP_MAGIC:
+                if last and pos:
+                    break  # padding/zeri in coda: come GzipInflater, si ignorano
+                return None
+            d = zlib.decompressobj(wbits=31)
+            while True:
+                step = view[pos:pos + INPUT_STEP]
+                if not step:
+                    return None
+                piece = d.decompress(step, budget + 1)  # un byte oltre il budget basta a saperlo
+                budget -= len(piece)
+                if budget < 0:
+                    return None
+                if piece:
+                    out.append(piece)
+                if d.eof:
+                    pos += len(step) - len(d.unused_data)
+                    break
+                pos += len(step) - len(d.unconsumed_tail)
+    except zlib.error:
+        return None
+    return out
+
+
+def _serial(datas: Iterable[bytes], rest: Iterable[bytes]) -> Iterator[bytes]:
+    inf = GzipInflater()
+    for data in datas:
+        yield from inf.feed(data)
+    for chunk in rest:
+        yield from inf.feed(chunk)
+    tail = inf.flush()
+    if tail:
+        yield tail
+
+
+def _drain(pending: "Deque[Tuple[Future[Optional[List[bytes]]], bytes]]", keep: int = 0) -> Generator[bytes, None, List[bytes]]:
+    """Output delle fette in volo, in ordine: quelle già pronte, e aspettando finché ne
+       restano più di `keep`. Ritorna i dati compressi dalla prima fetta che non torna
+       in poi ([] se sono andate tutte)."""
+    while pending and (len(pending) > keep or pending[0][0].done()):
+        out = pending[0][0].result()
+        if out is None:
+            rest = [data for _, data in pending]
+            for fut, _ in pending:
+                fut.cancel()
+            pending.clear()
+            return rest
+        pending.popleft()
+        yield from out
+    return []
+
+
+def iter_gunzip(chunks: Iterable[bytes], threads: Optional[int] = None) -> Iterator[bytes]:
+    """Come mrf_io.iter_gunzip (stesso output, stessi zlib.error), ma i member si
+       scompattano in parallelo quando lo stream ne ha tanti."""
+    n = THREADS if threads is None else threads
+    if n < 2:
+        yield from iter_gunzip_serial(chunks)
+        return
+    it = iter(chunks)
+    buf = bytearray()  # compresso non ancora affidato al pool: inizia sempre su un member
+    pending: Deque[Tuple["Future[Optional[List[bytes]]]", bytes]] = deque()
+    bgzf: Optional[bool] = None
+    lo = SHARD_BYTES
+    try:
+        for chunk in it:
+            buf += chunk
+            if bgzf is None and len(buf) >= 18:
+                bgzf = bgzf_size(buf, 0) is not None
+            while len(buf) >= SHARD_BYTES:
+                cut, lo = _find_cut(buf, bool(bgzf), lo)
+                if cut is None:
+                    break
+                data = bytes(buf[:cut])
+                del buf[:cut]
+                lo = SHARD_BYTES
+                pending.append((_pool().submit(_inflate, data, False), data))
+            if len(buf) >= SHARD_BYTES * SEARCH_SHARDS:
+                break  # member enorme o gzip con un member solo: il resto di fila
+            failed = yield from _drain(pending, keep=n)
+            if failed:
+                yield from _serial(failed + [bytes(buf)], it)
+                return
+        else:
+            if buf:
+                data = bytes(buf)
+                buf.clear()
+                pending.append((_pool().submit(_inflate, data, True), data))
+        failed = yield from _drain(pending)
+        yield from _serial(failed + [bytes(buf)], it)
+    finally:
+        for fut, _ in pending:
+            fut.cancel()
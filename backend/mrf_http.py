@@ -0,0 +1,447 @@
+"""
+Client HTTP condiviso per scaricare gli MRF.
+
+- un solo httpx.AsyncClient per processo (keep-alive, HTTP/2 se `h2` è installato),
+  creato nel lifespan dell'app;
+- limiti di pool e un tetto di richieste concorrenti per host;
+- richieste condizionali (If-None-Match / If-Modified-Since): se è configurata una
+  cartella di mirror, il body scaricato viene salvato lì insieme ai validator e un
+  304 viene servito dal disco, senza riscaricare il file;
+- accesso casuale via richieste Range (RangeSource): per uno ZIP remoto si leggono
+  solo la directory centrale e i byte compressi del membro scelto, a blocchi.
+
+Configurazione via env (default fra parentesi):
+  COSTVISTA_HTTP_TIMEOUT (120)            COSTVISTA_HTTP_MAX_CONNECTIONS (100)
+  COSTVISTA_HTTP_MAX_KEEPALIVE (20)       COSTVISTA_HTTP_KEEPALIVE_EXPIRY (30)
+  COSTVISTA_HTTP_PER_HOST (8)             COSTVISTA_HTTP2 (1)
+  COSTVISTA_HTTP_MIRROR_DIR (disattivo)   COSTVISTA_HTTP_MIRROR_MAX_BYTES (2GB)
+  COSTVISTA_HTTP_RANGE_BLOCK (4MB)        COSTVISTA_HTTP_RANGE_CACHE_BLOCKS (8)
+"""
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Tuple
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from pathlib import Path
+from urllib.parse import urlsplit
+import asyncio, hashlib, json, os, re, tempfile, time
+import httpx  # type: ignore
+
+try:  # HTTP/2 è opzionale: serve il pacchetto h2 (httpx[http2])
+    import h2  # type: ignore  # noqa: F401
+    _HAS_H2 = True
+except ImportError:
+    _HAS_H2 = False
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, "") or default)
+    except ValueError:
+        return default
+
+
+RANGE_BLOCK = max(64 * 1024, _env_int("COSTVISTA_HTTP_RANGE_BLOCK", 4 * 1024 * 1024))
+RANGE_CACHE_BLOCKS = max(2, _env_int("COSTVISTA_HTTP_RANGE_CACHE_BLOCKS", 8))
+RANGE_TAIL = 256 * 1024  # prima richiesta: la coda del file (EOCD + directory centrale di uno ZIP)
+PART_STALE_SECONDS = 86400  # .part fermi da così tanto: download morti a metà (crash), si buttano
+
+_CONTENT_RANGE = re.compile(r"bytes\s+(\d+)-(\d+)/(\d+)")
+
+
+class RemoteChanged(Exception):
+    """Il file remoto è cambiato fra una richiesta Range e l'altra (ETag o dimensione)."""
+
+
+def _content_range(headers: httpx.Headers) -> Optional[Tuple[int, int, int]]:
+    """(primo, ultimo, totale) da Content-Range; None se manca o il totale è "*"."""
+    m = _CONTENT_RANGE.match(headers.get("Content-Range") or "")
+    return (int(m.group(1)), int(m.group(2)), int(m.group(3))) if m else None
+
+
+class Fetched:
+    """
+    Risposta di HttpPool.fetch(). `not_modified` è True se il server ha risposto 304:
+    in quel caso il body (se c'è) arriva dal mirror su disco e `validators` sono
+    quelli inviati (ancora validi).
+    """
+
+    def __init__(self, url: str, headers: httpx.Headers, status_code: int,
+                 body: AsyncIterator[bytes], not_modified: bool = False,
+                 validators: Optional[Dict[str, str]] = None, has_body: bool = True):
+        self.url = url
+        self.headers = headers
+        self.status_code = status_code
+        self.not_modified = not_modified
+        self._body = body
+        self.has_body = has_body
+        if validators is None:
+            validators = {"etag": headers.get("ETag"), "last_modified": headers.get("Last-Modified")}
+        self.validators = {k: v for k, v in validators.items() if v}
+
+    @property
+    def etag(self) -> Optional[str]:
+        return self.validators.get("etag")
+
+    @property
+    def last_modified(self) -> Optional[str]:
+        return self.validators.get("last_modified")
+
+    def aiter_bytes(self) -> AsyncIterator[bytes]:
+        return self._body
+
+    async def aread(self) -> bytes:
+        return b"".join([c async for c in self._body])
+
+
+class RangeSource:
+    """
+    File remoto ad accesso casuale via richieste Range (si apre con HttpPool.open_range).
+    Blocchi allineati di RANGE_BLOCK byte in una piccola cache LRU; se le letture sono
+    sequenziali si chiede in anticipo anche il blocco dopo, così rete e decompressione
+    si sovrappongono. La coda del file (prima richiesta) resta sempre in memoria.
+    `reader()` dà un file-like sincrono (seek/read/tell) per zipfile & co., da usare in
+    un thread: chiede i blocchi all'event loop. `not_modified`: il server ha risposto
+    304 al GET condizionale (nessun byte disponibile).
+    """
+
+    def __init__(self, pool: "HttpPool", url: str, size: int, tail_start: int, tail: bytes,
+                 validators: Dict[str, str], not_modified: bool = False):
+        self.pool = pool
+        self.url = url
+        self.size = size
+        self.tail_start = tail_start
+        self.tail = tail
+        self.validators = {k: v for k, v in validators.items() if v}
+        self.not_modified = not_modified
+        self.on_fetch: Optional[Callable[[int], None]] = None  # byte scaricati, blocco per blocco
+        self.stats = {"requests": 1, "bytes": len(tail)}
+        self._blocks: "OrderedDict[int, asyncio.Future[bytes]]" = OrderedDict()
+        self._last = -1
+
+    async def _fetch(self, start: int, end: int) -> bytes:
+        headers = {"Range": f"bytes={start}-{end - 1}", "Accept-Encoding": "identity"}
+        async with self.pool._host_sem(self.url):
+            r = await self.pool.client.get(self.url, headers=headers)
+        etag = r.headers.get("ETag")
+        cr = _content_range(r.headers)
+        if (r.status_code != 206 or cr is None or cr[2] != self.size or len(r.content) != end - start
+                or (etag and self.validators.get("etag") and etag != self.validators["etag"])):
+            r.raise_for_status()
+            raise RemoteChanged(f"{self.url} changed while it was being read.")
+        self.stats["requests"] += 1
+        self.stats["bytes"] += end - start
+        if self.on_fetch is not None:
+            self.on_fetch(end - start)
+        return r.content
+
+    def _block(self, i: int) -> "asyncio.Future[bytes]":
+        fut = self._blocks.get(i)
+        if fut is None:
+            start = i * RANGE_BLOCK
+            fut = self._blocks[i] = asyncio.ensure_future(self._fetch(start, min(self.tail_start, start + RANGE_BLOCK)))
+            while len(self._blocks) > RANGE_CACHE_BLOCKS:
+                self._blocks.popitem(last=False)
+        else:
+            self._blocks.move_to_end(i)
+        return fut
+
+    async def block(self, i: int) -> bytes:
+        fut = self._block(i)
+        if i == self._last + 1 and (i + 1) * RANGE_BLOCK < self.tail_start:
+            self._block(i + 1)  # read-ahead
+        self._last = i
+        return await asyncio.shield(fut)
+
+    def reader(self, loop: asyncio.AbstractEventLoop) -> "RangeReader":
+        return RangeReader(self, loop)
+
+    def close(self) -> None:
+        for fut in self._blocks.values():
+            fut.cancel()
+        self._blocks.clear()
+
+
+class RangeReader:
+    """File-like sincrono su una RangeSource (vedi RangeSource.reader). NON va usato
+       dal thread dell'event loop: aspetterebbe se stesso."""
+
+    def __init__(self, src: RangeSource, loop: asyncio.AbstractEventLoop):
+        self.src = src
+        self.loop = loop
+        self.pos = 0
+
+    def seekable(self) -> bool:
+        return True
+
+    def readable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.pos
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        base = {0: 0, 1: self.pos, 2: self.src.size}[whence]
+        self.pos = max(0, base + offset)
+        return self.pos
+
+    def read(self, n: Optional[int] = -1) -> bytes:
+        src = self.src
+        end = src.size if n is None or n < 0 else min(src.size, self.pos + n)
+        out = []
+        while self.pos < end:
+            if self.pos >= src.tail_start:
+                piece = src.tail[self.pos - src.tail_start:end - src.tail_start]
+            else:
+                i = self.pos // RANGE_BLOCK
+                data = asyncio.run_coroutine_threadsafe(src.block(i), self.loop).result()
+                off = self.pos - i * RANGE_BLOCK
+                piece = data[off:off + min(end, src.tail_start) - self.pos]
+            if not piece:
+                break
+            out.append(piece)
+            self.pos += len(piece)
+        return b"".join(out)
+
+    def close(self) -> None:
+        pass
+
+
+class HttpPool:
+    def __init__(self, *, timeout: float = 120, max_connections: int = 100,
+                 max_keepalive: int = 20, keepalive_expiry: float = 30,
+                 per_host: int = 8, http2: bool = True,
+                 mirror_dir: Optional[str] = None, mirror_max_bytes: int = 2 * 1024 ** 3,
+                 chunk_size: int = 256 * 1024):
+        self.client = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive,
+                keepalive_expiry=keepalive_expiry,
+            ),
+            http2=http2 and _HAS_H2,
+            follow_redirects=True,
+        )
+        self.per_host = per_host
+        self.chunk_size = chunk_size
+        self.mirror = Path(mirror_dir) if mirror_dir else None
+        self.mirror_max_bytes = mirror_max_bytes
+        self._host_sems: Dict[str, asyncio.Semaphore] = {}
+        if self.mirror:
+            self.mirror.mkdir(parents=True, exist_ok=True)
+
+    @classmethod
+    def from_env(cls) -> "HttpPool":
+        return cls(
+            timeout=_env_int("COSTVISTA_HTTP_TIMEOUT", 120),
+            max_connections=_env_int("COSTVISTA_HTTP_MAX_CONNECTIONS", 100),
+            max_keepalive=_env_int("COSTVISTA_HTTP_MAX_KEEPALIVE", 20),
+            keepalive_expiry=_env_int("COSTVISTA_HTTP_KEEPALIVE_EXPIRY", 30),
+            per_host=_env_int("COSTVISTA_HTTP_PER_HOST", 8),
+            http2=os.getenv("COSTVISTA_HTTP2", "1") != "0",
+            mirror_dir=os.getenv("COSTVISTA_HTTP_MIRROR_DIR") or None,
+            mirror_max_bytes=_env_int("COSTVISTA_HTTP_MIRROR_MAX_BYTES", 2 * 1024 ** 3),
+        )
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+    # ---------- per-host ----------
+    def _host_sem(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc.lower()
+        sem = self._host_sems.get(host)
+        if sem is None:
+            sem = self._host_sems[host] = asyncio.Semaphore(self.per_host)
+        return sem
+
+    # ---------- mirror + validator ----------
+    def _mirror_paths(self, url: str):
+        assert self.mirror is not None
+        h = hashlib.sha256(url.encode("utf-8")).hexdigest()[:32]
+        return self.mirror / f"{h}.body", self.mirror / f"{h}.meta.json"
+
+    def validators(self, url: str) -> Dict[str, str]:
+        """Validator salvati per url (solo se abbiamo anche il body nel mirror). Legge
+        dal disco: dall'event loop si chiama con asyncio.to_thread."""
+        if not self.mirror:
+            return {}
+        body, meta = self._mirror_paths(url)
+        if not body.exists() or not meta.exists():
+            return {}
+        try:
+            return json.loads(meta.read_text(encoding="utf-8")).get("validators") or {}
+        except Exception:
+            return {}
+
+    @staticmethod
+    def _conditional_headers(validators: Dict[str, str]) -> Dict[str, str]:
+        headers = {}
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+        return headers
+
+    async def _iter_mirror(self, path: Path) -> AsyncIterator[bytes]:
+        # I/O su disco nel default executor: un mirror di qualche GB non blocca l'event loop
+        f = await asyncio.to_thread(path.open, "rb")
+        try:
+            while True:
+                chunk = await asyncio.to_thread(f.read, self.chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+        finally:
+            f.close()
+
+    def _mirror_hit(self, body: Path) -> bool:
+        """Il body c'è ancora? Se sì lo segna come usato adesso (LRU di _prune_mirror)."""
+        try:
+            os.utime(body)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _open_part(self) -> Tuple[Any, Path]:
+        # un .part per download: due GET dello stesso url in parallelo non si mescolano
+        assert self.mirror is not None
+        fd, tmp = tempfile.mkstemp(dir=self.mirror, suffix=".part")
+        return os.fdopen(fd, "wb"), Path(tmp)
+
+    async def _tee_to_mirror(self, url: str, r: httpx.Response) -> AsyncIterator[bytes]:
+        """Passa i chunk al chiamante e li scrive nel mirror (fuori dall'event loop); il
+        file diventa valido (rename + meta) solo se il download arriva in fondo."""
+        body, meta = self._mirror_paths(url)
+        complete = False
+        f, tmp = await asyncio.to_thread(self._open_part)
+        try:
+            async for chunk in r.aiter_bytes(self.chunk_size):
+                await asyncio.to_thread(f.write, chunk)
+                yield chunk
+            complete = True
+        finally:
+            await asyncio.to_thread(self._finish_mirror, f, tmp, body, meta, url, r.headers, complete)
+
+    def _finish_mirror(self, f: Any, tmp: Path, body: Path, meta: Path, url: str,
+                       headers: httpx.Headers, complete: bool) -> None:
+        f.close()
+        if not complete:
+            tmp.unlink(missing_ok=True)
+            return
+        os.replace(tmp, body)
+        meta_tmp = tmp.with_name(tmp.stem + ".meta.part")  # anche il meta: mai mezzo scritto
+        meta_tmp.write_text(json.dumps({
+            "url": url,
+            "validators": {"etag": headers.get("ETag"), "last_modified": headers.get("Last-Modified")},
+        }), encoding="utf-8")
+        os.replace(meta_tmp, meta)
+        self._prune_mirror()
+
+    def _prune_mirror(self) -> None:
+        """Rispetta mirror_max_bytes togliendo i body usati meno di recente."""
+        assert self.mirror is not None
+        stale = time.time() - PART_STALE_SECONDS
+        for p in self.mirror.glob("*.part"):
+            try:
+                if p.stat().st_mtime < stale:
+                    p.unlink()
+            except FileNotFoundError:
+                pass
+        bodies = sorted(self.mirror.glob("*.body"), key=lambda p: p.stat().st_mtime)
+        total = sum(p.stat().st_size for p in bodies)
+        for p in bodies:
+            if total <= self.mirror_max_bytes:
+                break
+            total -= p.stat().st_size
+            p.unlink(missing_ok=True)
+            p.with_name(p.name[:-len(".body")] + ".meta.json").unlink(missing_ok=True)
+
+    # ---------- fetch ----------
+    @asynccontextmanager
+    async def fetch(self, url: str, validators: Optional[Dict[str, str]] = None) -> AsyncIterator[Fetched]:
+        """
+        GET in streaming con limite per host. `validators` ({"etag", "last_modified"})
+        hanno la precedenza su quelli del mirror; un 304 senza body nel mirror arriva
+        con body vuoto e not_modified=True (il chiamante deve avere già il risultato).
+        """
+        mirror_val = await asyncio.to_thread(self.validators, url)
+        sent = validators or mirror_val
+        headers = self._conditional_headers(sent)
+        async with self._host_sem(url):
+            async with self.client.stream("GET", url, headers=headers) as r:
+                if r.status_code == 304:
+                    body_path = self._mirror_paths(url)[0] if mirror_val and sent == mirror_val else None
+                    if body_path is not None and await asyncio.to_thread(self._mirror_hit, body_path):
+                        yield Fetched(url, r.headers, 304, self._iter_mirror(body_path),
+                                      not_modified=True, validators=sent)
+                    else:
+                        yield Fetched(url, r.headers, 304, _empty(), not_modified=True, validators=sent,
+                                      has_body=False)
+                    return
+                r.raise_for_status()
+                if self.mirror and (r.headers.get("ETag") or r.headers.get("Last-Modified")):
+                    body = self._tee_to_mirror(url, r)
+                else:
+                    body = r.aiter_bytes(self.chunk_size)
+                yield Fetched(url, r.headers, r.status_code, body)
+
+
+    # ---------- accesso casuale ----------
+    async def open_range(self, url: str, validators: Optional[Dict[str, str]] = None) -> Optional[RangeSource]:
+        """
+        Prima richiesta Range (condizionale come fetch): la coda del file, che per uno
+        ZIP contiene la directory centrale. None se il server non supporta Range
+        (risponde 200 col file intero): il chiamante ripiega sul download completo.
+        """
+        sent = validators or {}
+        headers = {**self._conditional_headers(sent), "Range": f"bytes=-{RANGE_TAIL}", "Accept-Encoding": "identity"}
+        async with self._host_sem(url):
+            async with self.client.stream("GET", url, headers=headers) as r:
+                if r.status_code == 304:
+                    return RangeSource(self, url, 0, 0, b"", sent, not_modified=True)
+                cr = _content_range(r.headers) if r.status_code == 206 else None
+                if cr is None:
+                    if r.status_code != 416:  # 416: file vuoto, ci pensa il download
+                        r.raise_for_status()
+                    return None  # il body (intero) non si legge: chiudendo si chiude la connessione
+                tail = await r.aread()
+                validators = {"etag": r.headers.get("ETag"), "last_modified": r.headers.get("Last-Modified")}
+        if len(tail) != cr[1] - cr[0] + 1:
+            return None
+        return RangeSource(self, url, cr[2], cr[0], tail, validators)
+
+
+async def _empty() -> AsyncIterator[bytes]:
+    return
+    yield b""  # pragma: no cover
+
+
+# ---------- istanza condivisa (lifespan) ----------
+_shared: Optional[HttpPool] = None
+
+
+async def start_shared() -> HttpPool:
+    global _shared
+    if _shared is None:
+        _shared = HttpPool.from_env()
+    return _shared
+
+
+async def stop_shared() -> None:
+    global _shared
+    if _shared is not None:
+        pool, _shared = _shared, None
+        await pool.aclose()
+
+
+@asynccontextmanager
+async def http_pool() -> AsyncIterator[HttpPool]:
+    """Il pool dell'app se il lifespan è attivo; altrimenti uno temporaneo (script/test)."""
+    if _shared is not None:
+        yield _shared
+        return
+    pool = HttpPool.from_env()
+    try:
+        yield pool
+    finally:
+        await pool.aclose()
+
@@ -0,0 +1,226 @@
+"""
+Indice persistente su disco (SQLite) delle righe normalizzate, per codice.
+
+Il primo parse completo di una sorgente scrive le righe normalizzate una volta
+sola; le richieste successive con pochi `codes` leggono solo quelle righe con una
+seek sull'indice (code -> seq) invece di riparsare tutto il file.
+
+Un indice è identificato da (source, index_month_hint) e ricorda l'identità del
+contenuto (`sid`: url+ETag/Last-Modified o sha256) da cui è stato costruito: se la
+sorgente cambia, il nuovo ingest sostituisce il vecchio.
+
+L'ingest gira anche nei processi worker (mrf_exec): niente transazione aperta per
+tutto il parse, ogni batch è una transazione breve e l'indice diventa visibile solo
+alla fine (complete=1). Un ingest "in corso" registrato in `sources` evita che un
+altro thread/processo rifaccia lo stesso contenuto; se il database resta bloccato
+oltre il timeout l'ingest si abbandona e il parse continua senza indice.
+
+Configurazione via env:
+  COSTVISTA_INDEX_DIR (disattivo)    COSTVISTA_INDEX_BATCH (5000 righe per insert)
+"""
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from datetime import datetime, timezone
+from contextlib import closing
+from pathlib import Path
+import json, os, sqlite3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    id INTEGER PRIMARY KEY,
+    source TEXT NOT NULL,
+    month TEXT NOT NULL,
+    sid TEXT NOT NULL,
+    inner TEXT,
+    keys TEXT NOT NULL,
+    row_count INTEGER NOT NULL DEFAULT 0,
+    complete INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sources_by_key ON sources (source, month, complete);
+CREATE TABLE IF NOT EXISTS rows (
+    src INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    row TEXT NOT NULL,
+    PRIMARY KEY (src, seq)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS codes (
+    src INTEGER NOT NULL,
+    code TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    PRIMARY KEY (src, code, seq)
+) WITHOUT ROWID;
+"""
+
+
+STALE_SECONDS = 3600  # un ingest "in corso" più vecchio di così è di un processo morto
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, "") or default)
+    except ValueError:
+        return default
+
+
+class CodeIndex:
+    def __init__(self, path: str, batch: int = 5000):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.batch = batch
+        with closing(self._connect()) as db:
+            db.executescript(_SCHEMA)
+
+    @classmethod
+    def from_env(cls) -> Optional["CodeIndex"]:
+        d = os.getenv("COSTVISTA_INDEX_DIR")
+        if not d:
+            return None
+        return cls(str(Path(d) / "codes.sqlite"), batch=_env_int("COSTVISTA_INDEX_BATCH", 5000))
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(str(self.path), timeout=30)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    # ---------- lettura ----------
+    def lookup(self, source: str, month: Optional[str], sid: str,
+               keys: Tuple[str, ...] = ("code",)) -> Optional[Dict[str, Any]]:
+        """Indice completo per (source, month) costruito dallo stesso contenuto `sid`
+        e con le stesse chiavi di codice; None altrimenti."""
+        with closing(self._connect()) as db:
+            row = db.execute(
+                "SELECT id, inner, row_count, keys FROM sources "
+                "WHERE source = ? AND month = ? AND sid = ? AND complete = 1 ORDER BY id DESC LIMIT 1",
+                (source, month or "", sid),
+            ).fetchone()
+        if row is None or json.loads(row[3]) != list(keys):
+            return None
+        return {"id": row[0], "inner": row[1], "rows": row[2]}
+
+    def query(self, src: int, codes: Iterable[str]) -> List[Dict[str, Any]]:
+        """Righe (in ordine d'arrivo) che hanno uno dei `codes` in una delle chiavi indicizzate."""
+        codes = sorted(set(map(str, codes)))
+        if not codes:
+            return []
+        marks = ",".join("?" * len(codes))
+        with closing(self._connect()) as db:
+            cur = db.execute(
+                f"SELECT r.row FROM rows r WHERE r.src = ? AND r.seq IN "
+                f"(SELECT c.seq FROM codes c WHERE c.src = ? AND c.code IN ({marks})) ORDER BY r.seq",
+                (src, src, *codes),
+            )
+            return [json.loads(r[0]) for r in cur]
+
+    # ---------- scrittura ----------
+    def ingest(self, rows: Iterable[Dict[str, Any]], source: str, month: Optional[str], sid: str,
+               inner: Optional[str] = None, keys: Tuple[str, ...] = ("code",)) -> Iterator[Dict[str, Any]]:
+        """
+        Passa le righe al chiamante scrivendole nell'indice. L'indice diventa visibile
+        (complete=1, e i vecchi per la stessa source/month vengono tolti) solo se il
+        chiamante consuma tutte le righe; un errore a metà lascia l'indice precedente.
+        """
+        try:
+            src = self._claim(source, month, sid, inner, keys)
+        except sqlite3.OperationalError:
+            src = None
+        if src is None:
+            # stesso contenuto già in indicizzazione altrove (o db bloccato): niente attese
+            yield from rows
+            return
+        db = self._connect()
+        done = False
+        try:
+            row_buf: List[Tuple[int, int, str]] = []
+            code_buf: List[Tuple[int, str, int]] = []
+            seq = 0
+            for r in rows:
+                if src is not None:
+                    row_buf.append((src, seq, json.dumps(r, default=str)))
+                    seen = set()
+                    for k in keys:
+                        if k in r:
+                            c = str(r.get(k))
+                            if c not in seen:
+                                seen.add(c)
+                                code_buf.append((src, c, seq))
+                    if len(row_buf) >= self.batch and not self._flush(db, row_buf, code_buf):
+                        self._discard(db, src)
+                        src = None  # db bloccato: si abbandona l'indice, le righe continuano
+                seq += 1
+                yield r
+            if src is not None and self._flush(db, row_buf, code_buf):
+                done = self._finish(db, src, source, month, seq)
+        finally:
+            if src is not None and not done:
+                self._discard(db, src)
+            db.close()
+
+    def _claim(self, source: str, month: Optional[str], sid: str, inner: Optional[str],
+               keys: Tuple[str, ...]) -> Optional[int]:
+        """Registra un ingest in corso (complete=0) e ne ritorna l'id; None se lo stesso
+        contenuto lo sta già indicizzando un altro thread o processo."""
+        now = datetime.now(timezone.utc)
+        with closing(self._connect()) as db:
+            db.execute("BEGIN IMMEDIATE")
+            busy = db.execute(
+                "SELECT 1 FROM sources WHERE source = ? AND month = ? AND sid = ? AND complete = 0 AND created_at > ?",
+                (source, month or "", sid, _ago(now, STALE_SECONDS)),
+            ).fetchone()
+            if busy:
+                db.rollback()
+                return None
+            src = db.execute(
+                "INSERT INTO sources (source, month, sid, inner, keys, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (source, month or "", sid, inner, json.dumps(list(keys)), now.isoformat()),
+            ).lastrowid
+            db.commit()
+        return src
+
+    @staticmethod
+    def _flush(db: sqlite3.Connection, row_buf: list, code_buf: list) -> bool:
+        """Un batch = una transazione breve. False se il db è rimasto bloccato oltre il timeout."""
+        try:
+            with db:
+                db.executemany("INSERT INTO rows (src, seq, row) VALUES (?, ?, ?)", row_buf)
+                db.executemany("INSERT INTO codes (src, code, seq) VALUES (?, ?, ?)", code_buf)
+        except sqlite3.OperationalError:
+            return False
+        finally:
+            row_buf.clear()
+            code_buf.clear()
+        return True
+
+    def _finish(self, db: sqlite3.Connection, src: int, source: str, month: Optional[str], count: int) -> bool:
+        """Rende visibile l'indice e toglie quelli vecchi della stessa source/month (non
+        quelli ancora in corso di altri: il loro _finish toglierà questo)."""
+        try:
+            with db:
+                db.execute("UPDATE sources SET complete = 1, row_count = ? WHERE id = ?", (count, src))
+                old = [i for (i,) in db.execute(
+                    "SELECT id FROM sources WHERE source = ? AND month = ? AND id < ? AND (complete = 1 OR created_at < ?)",
+                    (source, month or "", src, _ago(datetime.now(timezone.utc), STALE_SECONDS)),
+                )]
+                self._drop(db, old)
+        except sqlite3.OperationalError:
+            return False
+        return True
+
+    def _discard(self, db: sqlite3.Connection, src: int) -> None:
+        # best effort: se non riesce, il prossimo _finish della stessa source lo toglie da stale
+        try:
+            with db:
+                self._drop(db, [src])
+        except sqlite3.OperationalError:
+            pass
+
+    @staticmethod
+    def _drop(db: sqlite3.Connection, ids: List[int]) -> None:
+        for i in ids:
+            db.execute("DELETE FROM codes WHERE src = ?", (i,))
+            db.execute("DELETE FROM rows WHERE src = ?", (i,))
+            db.execute("DELETE FROM sources WHERE id = ?", (i,))
+
+
+def _ago(now: datetime, seconds: int) -> str:
+    return datetime.fromtimestamp(now.timestamp() - seconds, timezone.utc).isoformat()
@@ -0,0 +1,111 @@
+"""
+I/O a chunk per le sorgenti MRF: gunzip incrementale, decode UTF-8 incrementale
+e ponte async -> sync per far girare i parser (sincroni) in un thread mentre i
+byte arrivano dalla rete.
+
+Nessuna funzione qui tiene in memoria più di un chunk (+ l'output di zlib,
+limitato a OUT_CHUNK per passo).
+"""
+from typing import AsyncIterable, AsyncIterator, Callable, Iterable, Iterator, Optional, TypeVar
+import asyncio, codecs, itertools, zlib
+
+GZIP_MAGIC = b"\x1f\x8b"
+OUT_CHUNK = 1024 * 1024  # max byte decompressi prodotti per singola chiamata a zlib
+
+T = TypeVar("T")
+
+
+class GzipInflater:
+    """
+    Gunzip incrementale che gestisce anche gzip multi-member (file concatenati).
+    feed() ritorna pezzi di al più OUT_CHUNK byte, così un chunk compresso
+    molto "denso" non esplode in memoria tutto in una volta.
+    """
+
+    def __init__(self):
+        self._d = zlib.decompressobj(wbits=31)
+        self._started = False  # il member corrente ha già ricevuto byte
+        self._done = False  # trailing garbage dopo l'ultimo member
+
+    def feed(self, data: bytes) -> Iterator[bytes]:
+        while data and not self._done:
+            self._started = True
+            out = self._d.decompress(data, OUT_CHUNK)
+            if out:
+                yield out
+            if self._d.eof:
+                # fine member: l'eventuale resto è il member successivo
+                data = self._d.unused_data
+                if data and not data.startswith(GZIP_MAGIC):
+                    self._done = True  # padding/zeri in coda: come gzip, li ignoriamo
+                    return
+                self._d = zlib.decompressobj(wbits=31)
+                self._started = False
+            else:
+                data = self._d.unconsumed_tail
+
+    def flush(self) -> bytes:
+        if self._done or not self._started:
+            return b""
+        out = self._d.flush()
+        if not self._d.eof:
+            # member iniziato e mai finito (come l'EOFError di gzip.decompress)
+            raise zlib.error("Truncated gzip stream")
+        return out
+
+
+def iter_gunzip(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    inf = GzipInflater()
+    for chunk in chunks:
+        yield from inf.feed(chunk)
+    tail = inf.flush()
+    if tail:
+        yield tail
+
+
+def iter_maybe_gunzip(chunks: Iterable[bytes],
+                      gunzip: Callable[[Iterable[bytes]], Iterator[bytes]] = iter_gunzip) -> Iterator[bytes]:
+    """Gunzip (con `gunzip`, es. mrf_gzip.iter_gunzip) solo se i primi byte sono il
+    magic gzip (es. .gz già decodificato da Content-Encoding: in quel caso passa i
+    byte così come sono)."""
+    it = iter(chunks)
+    first = b""
+    for chunk in it:
+        first += chunk
+        if len(first) >= 2:
+            break
+    rest = itertools.chain((first,) if first else (), it)
+    yield from gunzip(rest) if first.startswith(GZIP_MAGIC) else rest
+
+
+def iter_decode(chunks: Iterable[bytes], encoding: str = "utf-8") -> Iterator[str]:
+    """Decode incrementale: i caratteri multi-byte spezzati fra chunk restano corretti."""
+    dec = codecs.getincrementaldecoder(encoding)(errors="replace")
+    for chunk in chunks:
+        s = dec.decode(chunk)
+        if s:
+            yield s
+    s = dec.decode(b"", final=True)
+    if s:
+        yield s
+
+
+def iter_sync(agen: AsyncIterable[T], loop: asyncio.AbstractEventLoop) -> Iterator[T]:
+    """
+    Consuma un async iterator da un thread worker: ogni next() chiede UN elemento
+    all'event loop. Niente prefetch, quindi la memoria resta limitata a un chunk.
+    """
+    it = agen.__aiter__()
+    while True:
+        fut = asyncio.run_coroutine_threadsafe(_anext(it), loop)
+        ok, item = fut.result()
+        if not ok:
+            return
+        yield item
+
+
+async def _anext(it: AsyncIterator[T]) -> "tuple[bool, Optional[T]]":
+    try:
+        return True, await it.__anext__()
+    except StopAsyncIteration:
+        return False, None
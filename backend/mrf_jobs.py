@@ -0,0 +1,190 @@
+"""
+Job in background per gli MRF troppo grandi per una richiesta sincrona.
+
+POST /api/jobs crea un job (stesso body di /api/summary) e risponde subito con l'id;
+il lavoro gira nel processo dell'app (al più COSTVISTA_JOB_WORKERS job alla volta,
+il parse passa comunque da mrf_exec) e GET /api/jobs/{id} riporta stato, fase e
+avanzamento (byte letti, righe parsate), con long-poll opzionale fino alla fine.
+
+Persistenza (SQLite): richiesta, stato e risultato finale (JSON compresso). Dopo un
+riavvio i job finiti restano consultabili e quelli rimasti a metà ripartono.
+Deduplica: una richiesta uguale (stessa sorgente e stessi parametri) a un job in
+corso, o finito da meno di COSTVISTA_JOBS_REUSE_SECONDS, riceve lo stesso job.
+
+Configurazione via env (default fra parentesi):
+  COSTVISTA_JOBS_DIR (<tmp>/costvista-jobs)   COSTVISTA_JOB_WORKERS (2)
+  COSTVISTA_JOBS_REUSE_SECONDS (3600)         COSTVISTA_JOBS_KEEP_SECONDS (7 giorni)
+"""
+from typing import Any, Dict, List, Optional, Tuple
+from datetime import datetime, timezone
+from contextlib import closing
+from pathlib import Path
+import asyncio, gzip, hashlib, json, os, sqlite3, tempfile, threading, time, uuid
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    key TEXT NOT NULL,
+    request TEXT NOT NULL,
+    status TEXT NOT NULL,
+    stage TEXT,
+    progress TEXT,
+    error TEXT,
+    result BLOB,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_by_key ON jobs (key, created_at);
+"""
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, "") or default)
+    except ValueError:
+        return default
+
+
+def _iso(ts: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat() if ts else None
+
+
+class Progress:
+    """Avanzamento di un job, aggiornato dalla pipeline (anche dai thread di parse)."""
+    __slots__ = ("stage", "bytes_read", "bytes_total", "rows_parsed")
+
+    def __init__(self):
+        self.stage = "queued"
+        self.bytes_read = 0
+        self.bytes_total: Optional[int] = None
+        self.rows_parsed = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"bytes_read": self.bytes_read, "bytes_total": self.bytes_total, "rows_parsed": self.rows_parsed}
+
+
+def job_key(request: Dict[str, Any]) -> str:
+    """Chiave di deduplica: la richiesta normalizzata (codici come insieme)."""
+    norm = dict(request, codes=sorted(set(map(str, request.get("codes") or []))))
+    return hashlib.sha256(json.dumps(norm, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class JobStore:
+    def __init__(self, path: str, reuse_seconds: int = 3600, keep_seconds: int = 7 * 86400):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.reuse_seconds = reuse_seconds
+        self.keep_seconds = keep_seconds
+        self.live: Dict[str, Progress] = {}  # job in corso in questo processo
+        self._done: Dict[str, asyncio.Event] = {}
+        self._lock = threading.Lock()  # create/find atomici (dedup)
+        with closing(self._connect()) as db:
+            db.executescript(_SCHEMA)
+
+    @classmethod
+    def from_env(cls) -> "JobStore":
+        d = os.getenv("COSTVISTA_JOBS_DIR") or str(Path(tempfile.gettempdir()) / "costvista-jobs")
+        return cls(str(Path(d) / "jobs.sqlite"),
+                   reuse_seconds=_env_int("COSTVISTA_JOBS_REUSE_SECONDS", 3600),
+                   keep_seconds=_env_int("COSTVISTA_JOBS_KEEP_SECONDS", 7 * 86400))
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(str(self.path), timeout=30)
+        db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    # ---------- creazione / dedup ----------
+    def submit(self, request: Dict[str, Any]) -> Tuple[str, bool]:
+        """(id, created): il job esistente per la stessa richiesta se è in corso o
+        finito bene da poco, altrimenti uno nuovo in coda."""
+        key = job_key(request)
+        now = time.time()
+        with self._lock, closing(self._connect()) as db:
+            row = db.execute(
+                "SELECT id FROM jobs WHERE key = ? AND (status IN ('queued', 'running') "
+                "OR (status = 'done' AND finished_at >= ?)) ORDER BY created_at DESC LIMIT 1",
+                (key, now - self.reuse_seconds),
+            ).fetchone()
+            if row is not None:
+                return row[0], False
+            job_id = uuid.uuid4().hex
+            db.execute("DELETE FROM jobs WHERE status NOT IN ('queued', 'running') AND finished_at < ?",
+                       (now - self.keep_seconds,))
+            db.execute("INSERT INTO jobs (id, key, request, status, stage, created_at) VALUES (?, ?, ?, 'queued', 'queued', ?)",
+                       (job_id, key, json.dumps(request), now))
+            db.commit()
+        return job_id, True
+
+    def unfinished(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """Job rimasti in coda o a metà (es. dopo un riavvio), in ordine di arrivo."""
+        with closing(self._connect()) as db:
+            rows = db.execute("SELECT id, request FROM jobs WHERE status IN ('queued', 'running') ORDER BY created_at").fetchall()
+        return [(i, json.loads(r)) for i, r in rows]
+
+    # ---------- stato ----------
+    def track(self, job_id: str) -> Progress:
+        """Il job è in coda in questo processo: da qui in poi lo stato live è in memoria."""
+        return self.live.setdefault(job_id, Progress())
+
+    def start(self, job_id: str) -> Progress:
+        prog = self.track(job_id)
+        prog.stage = "starting"
+        with closing(self._connect()) as db:
+            db.execute("UPDATE jobs SET status = 'running', stage = ?, started_at = ? WHERE id = ?",
+                       (prog.stage, time.time(), job_id))
+            db.commit()
+        return prog
+
+    def finish(self, job_id: str, result: Optional[Dict[str, Any]] = None,
+               error: Optional[Dict[str, Any]] = None) -> None:
+        """Salva il risultato (o l'errore). Da un thread: poi wake() sull'event loop."""
+        prog = self.live.get(job_id)
+        blob = gzip.compress(json.dumps(result).encode("utf-8"), 6) if result is not None else None
+        with closing(self._connect()) as db:
+            db.execute(
+                "UPDATE jobs SET status = ?, stage = ?, progress = ?, error = ?, result = ?, finished_at = ? WHERE id = ?",
+                ("error" if error is not None else "done", "error" if error is not None else "done",
+                 json.dumps(prog.snapshot()) if prog else None, json.dumps(error) if error is not None else None,
+                 blob, time.time(), job_id),
+            )
+            db.commit()
+        self.live.pop(job_id, None)
+
+    def wake(self, job_id: str) -> None:
+        """Sveglia chi è in long-poll su questo job."""
+        ev = self._done.pop(job_id, None)
+        if ev is not None:
+            ev.set()
+
+    def get(self, job_id: str, with_result: bool = True) -> Optional[Dict[str, Any]]:
+        with closing(self._connect()) as db:
+            row = db.execute(
+                "SELECT id, request, status, stage, progress, error, created_at, started_at, finished_at, "
+                + ("result" if with_result else "NULL") + " FROM jobs WHERE id = ?", (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        jid, request, status, stage, progress, error, created, started, finished, blob = row
+        prog = self.live.get(jid)
+        job: Dict[str, Any] = {
+            "id": jid, "status": status,
+            "stage": prog.stage if prog is not None else stage,
+            "progress": prog.snapshot() if prog is not None else (json.loads(progress) if progress else None),
+            "request": json.loads(request),
+            "created_at": _iso(created), "started_at": _iso(started), "finished_at": _iso(finished),
+        }
+        if error:
+            job["error"] = json.loads(error)
+        if blob is not None:
+            job["result"] = json.loads(gzip.decompress(blob))
+        return job
+
+    async def wait(self, job_id: str, timeout: float) -> None:
+        """Long-poll: ritorna quando il job finisce o dopo `timeout` secondi."""
+        if timeout <= 0 or job_id not in self.live:
+            return
+        ev = self._done.setdefault(job_id, asyncio.Event())
+        try:
+            await asyncio.wait_for(ev.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
@@ -0,0 +1,539 @@
+"""
+Lettore JSON incrementale (pull/event-based) per i file MRF.
+
+Non carica mai l'intero documento: consuma chunk di testo, materializza solo
+i sotto-alberi piccoli (un elemento di array, un negotiated_rate CMS) e salta
+il resto senza costruire oggetti. Così la memoria resta ~costante anche per
+file in-network da diversi GB.
+
+Uso tipico:
+    fmt, cur = sniff(chunks)        # "json" | "ndjson" | "csv"
+    rows = iter_json_rows(cur)      # generatore di dict "piatti"
+"""
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+import itertools, json, re
+
+# stringa JSON: fino alla prossima " non escapata (può essere spezzata fra chunk)
+_STR_END = re.compile(r'["\\]')
+_STRUCT = re.compile(r'[\[\]{}"]')
+_SCALAR_END = re.compile(r'[\s,\]}]')
+_WS = " \t\r\n"
+
+# chiavi CMS Table of Contents (index) -> contengono URL dei file in_network
+INDEX_KEYS = ("in_network_files", "reporting_structure", "files")
+# liste di oggetti che non sono righe tariffarie (CMS in-network / allowed amounts)
+SKIP_KEYS = ("provider_references", "out_of_network")
+# campi scalari di un item in_network CMS riportati su ogni riga
+CMS_ITEM_FIELDS = (
+    "negotiation_arrangement", "name", "billing_code_type", "billing_code_type_version",
+    "billing_code", "description",
+)
+# campi di negotiated_prices[] CMS
+CMS_PRICE_FIELDS = (
+    "negotiated_type", "negotiated_rate", "expiration_date", "service_code",
+    "billing_class", "billing_code_modifier", "additional_information",
+)
+
+# un array di oggetti prima di "data" si tiene da parte (si preferisce "data", come
+# faceva il parse non in streaming) finché è così corto; oltre sono le righe e si va in streaming
+HOLD_ROWS = 1000
+
+NDJSON_SNIFF_BYTES = 1024 * 1024  # oltre questa lunghezza la prima riga non è NDJSON
+
+# test sul testo grezzo di un record: False = scartalo senza materializzarlo
+Keep = Callable[[str], bool]
+# codici che compaiono identici nel testo (CSV e JSON: niente escape possibili)
+_PLAIN_CODE = re.compile(r"[A-Za-z0-9._\-]+\Z")
+
+
+class RecordPrefilter:
+    """
+    Predicate pushdown del filtro `codes`: un record (riga CSV/NDJSON, elemento di
+    array JSON, item in_network CMS) passa se nel suo testo compare almeno uno dei
+    codici. È un sovrainsieme del filtro esatto (che va comunque applicato dopo):
+    serve solo a non costruire/normalizzare le righe che sicuramente non servono.
+    `skipped` conta i record scartati.
+    """
+
+    def __init__(self, codes: Iterable[str]):
+        self.codes = sorted({str(c) for c in codes})
+        self.skipped = 0
+        # con tanti codici una sola regex in alternativa batte il loop di `in`
+        self._rx = re.compile("|".join(map(re.escape, self.codes))) if len(self.codes) > 8 else None
+
+    @classmethod
+    def build(cls, codes: Iterable[str]) -> Optional["RecordPrefilter"]:
+        """None se non ci sono codici o se qualcuno potrebbe comparire "escapato" nel testo."""
+        codes = [str(c) for c in codes]
+        if not codes or not all(_PLAIN_CODE.match(c) for c in codes):
+            return None
+        return cls(codes)
+
+    def __call__(self, text: str) -> bool:
+        if self._rx is not None:
+            ok = self._rx.search(text) is not None
+        else:
+            ok = any(c in text for c in self.codes)
+        if not ok:
+            self.skipped += 1
+        return ok
+
+
+class IndexFileDetected(Exception):
+    """Il documento è un CMS Table of Contents: `urls` sono i file in_network."""
+    def __init__(self, urls: List[str]):
+        super().__init__("index_detected")
+        self.urls = urls
+
+
+class JsonShapeError(ValueError):
+    """JSON/NDJSON con una forma che non sappiamo trasformare in righe."""
+
+
+class NoRowsFound(JsonShapeError):
+    """JSON valido ma senza un array di oggetti utilizzabile come righe."""
+
+
+class JsonCursor:
+    """
+    Cursore su una sequenza di chunk di testo JSON.
+    Tiene in buffer solo la parte non ancora consumata (+ il valore corrente).
+    """
+
+    def __init__(self, chunks: Iterable[str]):
+        self._it = iter(chunks)
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self._skipping = False  # in skip() il testo già scandito si può scartare
+
+    # ---------- buffer ----------
+    def _fill(self) -> int:
+        """Aggiunge un chunk al buffer. Ritorna quanti caratteri sono stati scartati
+        in testa (già consumati), -1 se EOF."""
+        if self.eof:
+            return -1
+        for chunk in self._it:
+            if not chunk:
+                continue
+            dropped = self.pos
+            self.buf = self.buf[self.pos:] + chunk
+            self.pos = 0
+            return dropped
+        self.eof = True
+        return -1
+
+    def peek(self) -> str:
+        """Prossimo carattere non-whitespace (non consumato); "" a EOF."""
+        while True:
+            buf, i, n = self.buf, self.pos, len(self.buf)
+            while i < n and buf[i] in _WS:
+                i += 1
+            self.pos = i
+            if i < n:
+                return buf[i]
+            if self._fill() < 0:
+                return ""
+
+    def peek_inside(self) -> str:
+        """Con il cursore su '[' o '{': primo carattere non-ws dopo l'apertura."""
+        self.peek()
+        i = self.pos + 1
+        while True:
+            buf, n = self.buf, len(self.buf)
+            while i < n and buf[i] in _WS:
+                i += 1
+            if i < n:
+                return buf[i]
+            dropped = self._fill()
+            if dropped < 0:
+                return ""
+            i -= dropped
+
+    def take(self, ch: str) -> None:
+        got = self.peek()
+        if got != ch:
+            raise json.JSONDecodeError(f"Expected {ch!r}", self.buf, self.pos)
+        self.pos += 1
+
+    def remaining(self) -> Iterator[str]:
+        """Testo non consumato + resto dei chunk (per ripiegare su CSV)."""
+        rest = self.buf[self.pos:]
+        self.buf, self.pos = "", 0
+        if rest:
+            yield rest
+        yield from self._it
+
+    # ---------- valori ----------
+    def _more(self, i: int) -> int:
+        """Legge un altro chunk durante la scansione; ritorna i riallineato (-1 a EOF)."""
+        if self._skipping:
+            self.pos = i  # non serve tenere il valore: libera memoria
+        dropped = self._fill()
+        return -1 if dropped < 0 else i - dropped
+
+    def _scan_end(self) -> int:
+        """Indice (nel buffer) di fine del valore che inizia a pos, leggendo chunk se serve.
+        Non materializza nulla: salta stringhe e conta le parentesi."""
+        first = self.peek()
+        if not first:
+            raise json.JSONDecodeError("Unexpected EOF", self.buf, self.pos)
+        i = self.pos
+        if first == '"':
+            return self._scan_string(i + 1)
+        if first not in "[{":
+            while True:
+                m = _SCALAR_END.search(self.buf, i + 1)
+                if m:
+                    return m.start()
+                if self.eof or self._fill() < 0:
+                    return len(self.buf)
+                i = self.pos - 1
+        depth = 0
+        while True:
+            m = _STRUCT.search(self.buf, i)
+            if not m:
+                i = self._more(len(self.buf))
+                if i < 0:
+                    raise json.JSONDecodeError("Unexpected EOF", self.buf, len(self.buf))
+                continue
+            ch = m.group()
+            i = m.end()
+            if ch == '"':
+                i = self._scan_string(i)
+            elif ch in "[{":
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return i
+
+    def _scan_string(self, i: int) -> int:
+        """Da i (dopo la " di apertura) fino a dopo la " di chiusura."""
+        while True:
+            m = _STR_END.search(self.buf, i)
+            if not m:
+                i = self._more(len(self.buf))
+                if i < 0:
+                    raise json.JSONDecodeError("Unterminated string", self.buf, len(self.buf))
+                continue
+            if m.group() == '"':
+                return m.end()
+            # escape: salta il carattere successivo (anche se è nel prossimo chunk)
+            i = m.end() + 1
+            while i > len(self.buf):
+                over = i - len(self.buf)
+                i = self._more(len(self.buf))
+                if i < 0:
+                    raise json.JSONDecodeError("Unterminated string", self.buf, len(self.buf))
+                i += over
+
+    def value(self) -> Any:
+        """Materializza il prossimo valore JSON e lo consuma."""
+        end = self._scan_end()
+        start = self.pos
+        self.pos = end
+        return json.loads(self.buf[start:end])
+
+    def value_if(self, keep: Keep) -> Tuple[bool, Any]:
+        """Come value(), ma il testo del valore passa prima da `keep`: se lo scarta
+        il valore viene consumato senza json.loads. -> (tenuto, valore|None)"""
+        end = self._scan_end()
+        start = self.pos
+        self.pos = end
+        text = self.buf[start:end]
+        if not keep(text):
+            return False, None
+        return True, json.loads(text)
+
+    def skip(self) -> None:
+        """Consuma il prossimo valore JSON senza costruirlo (né tenerlo in buffer)."""
+        self._skipping = True
+        try:
+            self.pos = self._scan_end()
+        finally:
+            self._skipping = False
+
+    # ---------- contenitori ----------
+    def items(self) -> Iterator[str]:
+        """Itera le chiavi di un oggetto. Dopo ogni chiave il chiamante DEVE
+        consumare il valore (value/skip/items/elements) prima del next()."""
+        self.take("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.take(":")
+            yield key
+            ch = self.peek()
+            self.pos += 1
+            if ch == "}":
+                return
+            if ch != ",":
+                raise json.JSONDecodeError("Expected ',' or '}'", self.buf, self.pos - 1)
+
+    def elements(self) -> Iterator[int]:
+        """Itera gli elementi di un array (stesso protocollo di items())."""
+        self.take("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        idx = 0
+        while True:
+            yield idx
+            idx += 1
+            ch = self.peek()
+            self.pos += 1
+            if ch == "]":
+                return
+            if ch != ",":
+                raise json.JSONDecodeError("Expected ',' or ']'", self.buf, self.pos - 1)
+
+
+# ---------------- sniffing formato ----------------
+def sniff(chunks: Iterable[str]) -> Tuple[str, JsonCursor]:
+    """
+    Decide il formato guardando solo l'inizio del testo:
+    - "ndjson": la prima riga è un oggetto JSON completo e segue altro testo
+    - "json":   inizia con '{' o '['
+    - "csv":    tutto il resto (usare cur.remaining() per rileggere il testo)
+    """
+    cur = JsonCursor(chunks)
+    if cur.peek() == "\ufeff":
+        cur.pos += 1
+    first = cur.peek()
+    if first not in ("{", "["):
+        return "csv", cur
+    if first == "{":
+        nl = cur.buf.find("\n", cur.pos)
+        while nl < 0 and len(cur.buf) - cur.pos < NDJSON_SNIFF_BYTES and not cur.eof:
+            start = len(cur.buf) - cur.pos
+            cur._fill()
+            nl = cur.buf.find("\n", cur.pos + start)
+        if 0 <= nl - cur.pos <= NDJSON_SNIFF_BYTES:
+            try:
+                obj = json.loads(cur.buf[cur.pos:nl])
+            except ValueError:
+                obj = None
+            if isinstance(obj, dict) and _has_more(cur, nl + 1):
+                return "ndjson", cur
+    return "json", cur
+
+
+def _has_more(cur: JsonCursor, i: int) -> bool:
+    """C'è testo non-whitespace da i in poi? (non consuma)"""
+    while True:
+        if cur.buf[i:].strip():
+            return True
+        dropped = cur._fill()
+        if dropped < 0:
+            return False
+        i -= dropped
+
+
+def iter_ndjson_rows(cur: JsonCursor, keep: Optional[Keep] = None, lineno: int = 0) -> Iterator[Dict[str, Any]]:
+    """Una riga = un oggetto JSON. Righe vuote ignorate. Con `keep` le righe scartate
+    non vengono nemmeno decodificate (la prima passa sempre: da lei si fa il mapping).
+    `lineno`: righe che precedono il testo (per gli errori, se è una fetta del file);
+    la regola della prima riga vale solo per la prima del file."""
+    pending = ""
+    first = lineno == 0
+    for chunk in cur.remaining():
+        pending += chunk
+        if "\n" not in chunk:
+            continue
+        lines = pending.split("\n")
+        pending = lines.pop()
+        for ln in lines:
+            lineno += 1
+            if ln.strip():
+                if keep is not None and not first and not keep(ln):
+                    continue
+                first = False
+                yield _ndjson_obj(ln, lineno)
+    if pending.strip() and (keep is None or first or keep(pending)):
+        yield _ndjson_obj(pending, lineno + 1)
+
+
+def _ndjson_obj(line: str, lineno: int) -> Dict[str, Any]:
+    try:
+        obj = json.loads(line)
+    except ValueError:
+        raise JsonShapeError(f"Invalid NDJSON at line {lineno}.")
+    if not isinstance(obj, dict):
+        raise JsonShapeError(f"NDJSON line {lineno} is not an object.")
+    return obj
+
+
+# ---------------- walker JSON ----------------
+def _urls_from(seq: Any, urls: List[str], only_in_network: bool = False) -> None:
+    if not isinstance(seq, list):
+        return
+    for item in seq:
+        if not isinstance(item, dict):
+            continue
+        if only_in_network and not str(item.get("type", "")).lower().startswith("in"):
+            continue
+        loc = item.get("location") or item.get("url") or item.get("link")
+        if isinstance(loc, str) and loc.strip():
+            urls.append(loc.strip())
+
+
+def _array_objects(cur: JsonCursor, keep: Optional[Keep]) -> Iterator[Dict[str, Any]]:
+    """Oggetti di un array; con `keep` i sotto-alberi scartati non vengono decodificati.
+    Il primo oggetto passa sempre (da lui si calcola il mapping degli header)."""
+    first = True
+    for _ in cur.elements():
+        if keep is not None and not first:
+            ok, obj = cur.value_if(keep)
+            if not ok:
+                continue
+        else:
+            obj = cur.value()
+        if isinstance(obj, dict):
+            first = False
+            yield obj
+
+
+def iter_json_rows(cur: JsonCursor, keep: Optional[Keep] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Righe da un documento JSON, in streaming:
+    - [ {...}, ... ]                       -> ogni oggetto
+    - { in_network: [...] } (CMS)          -> una riga per negotiated_price, appiattita
+    - { data: [...] } / primo array di oggetti -> ogni oggetto ("data" ha la precedenza,
+      salvo un array di più di HOLD_ROWS oggetti che viene prima)
+    - CMS Table of Contents                -> IndexFileDetected(urls), anche se ci sono righe
+    Solleva NoRowsFound se non trova righe. `keep` (vedi RecordPrefilter) salta i
+    record che non possono contenere i codici richiesti.
+    """
+    ch = cur.peek()
+    if ch == "[":
+        n = 0
+        for obj in _array_objects(cur, keep):
+            n += 1
+            yield obj
+        if not n:
+            raise NoRowsFound("no rows")
+        return
+    if ch != "{":
+        raise NoRowsFound("no rows")
+
+    top: Dict[str, Any] = {}
+    urls: List[str] = []
+    held: Optional[List[Dict[str, Any]]] = None  # primo array di oggetti in attesa di "data"
+    n = 0
+    for key in cur.items():
+        nxt = cur.peek()
+        if key in INDEX_KEYS and nxt == "[":
+            v = cur.value()
+            if key == "reporting_structure":
+                for rs in v:
+                    if isinstance(rs, dict):
+                        _urls_from(rs.get("in_network_files"), urls)
+            elif key == "files":
+                before = len(urls)
+                _urls_from(v, urls, only_in_network=True)
+                if len(urls) == before and not n and held is None and v and isinstance(v[0], dict):
+                    held = [obj for obj in v if isinstance(obj, dict)]
+            else:
+                _urls_from(v, urls)
+            continue
+        if nxt != "[" or n or key in SKIP_KEYS:
+            if nxt in "[{" or key in top:
+                cur.skip()
+            else:
+                top[key] = cur.value()
+            continue
+        if key == "in_network":
+            for row in _iter_cms_in_network(cur, top, keep):
+                n += 1
+                yield row
+            continue
+        # array di oggetti (anche vuoto): "data" vince,
+        # altrimenti il primo
+        if cur.peek_inside() not in "{]" or (held is not None and key != "data"):
+            cur.skip()
+            continue
+        objs = _array_objects(cur, keep)
+        if key != "data":
+            held = list(itertools.islice(objs, HOLD_ROWS + 1))
+            if len(held) <= HOLD_ROWS:
+                continue  # array finito: si vede se dopo c'è "data"
+            objs = itertools.chain(held, objs)  # troppo lungo per essere un contorno: sono le righe
+        held = None
+        if urls:
+            raise IndexFileDetected(list(dict.fromkeys(urls)))
+        for obj in objs:
+            n += 1
+            yield obj
+        if not n:
+            break
+
+    # un index resta un index anche se ha un array di oggetti
+    if urls:
+        raise IndexFileDetected(list(dict.fromkeys(urls)))
+    if not n:
+        for obj in held or ():
+            n += 1
+            yield obj
+    if not n:
+        raise NoRowsFound("no rows")
+
+
+def _iter_cms_in_network(cur: JsonCursor, top: Dict[str, Any], keep: Optional[Keep] = None) -> Iterator[Dict[str, Any]]:
+    """in_network[].negotiated_rates[].negotiated_prices[] -> righe piatte.
+    Con `keep`, se billing_code & co. arrivano prima dei negotiated_rates e non
+    passano il test, l'intero sotto-albero dei rate viene saltato senza buffer."""
+    emitted = False
+    for _ in cur.elements():
+        if cur.peek() != "{":
+            cur.skip()
+            continue
+        item: Dict[str, Any] = {}
+        if "reporting_entity_name" in top:
+            item["reporting_entity_name"] = top["reporting_entity_name"]
+        pending: List[Dict[str, Any]] = []  # rate arrivati prima di billing_code
+        dropped = False
+        for key in cur.items():
+            if dropped:
+                cur.skip()
+            elif key == "negotiated_rates" and cur.peek() == "[":
+                if (keep is not None and emitted and "billing_code" in item
+                        and not keep(" ".join(map(str, item.values())))):
+                    dropped = True
+                    cur.skip()
+                    continue
+                for _ in cur.elements():
+                    rate = cur.value()
+                    if not isinstance(rate, dict):
+                        continue
+                    if "billing_code" in item:
+                        for row in _cms_rows(item, rate):
+                            emitted = True
+                            yield row
+                    else:
+                        pending.append(rate)
+            elif key in CMS_ITEM_FIELDS and cur.peek() not in "[{":
+                item[key] = cur.value()
+            else:
+                cur.skip()
+        for rate in pending:
+            for row in _cms_rows(item, rate):
+                emitted = True
+                yield row
+
+
+def _cms_rows(item: Dict[str, Any], rate: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    refs = rate.get("provider_references")
+    for price in rate.get("negotiated_prices") or []:
+        if not isinstance(price, dict):
+            continue
+        row = dict(item)
+        for k in CMS_PRICE_FIELDS:
+            if k in price:
+                v = price[k]
+                row[k] = ",".join(map(str, v)) if isinstance(v, list) else v
+        if refs is not None:
+            row["provider_references"] = refs
+        yield row
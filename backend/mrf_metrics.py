@@ -0,0 +1,430 @@
+"""
+Strumentazione della pipeline: tempo, byte/righe e memoria per fase + /metrics.
+
+Fasi, nell'ordine della pipeline: hash (upload), fetch (rete/disco/spool), unzip,
+gunzip, decode, sniff (JSON / NDJSON / CSV), parse, normalize (solo JSON: nei CSV è
+già dentro parse), summarize, serialize. I tempi sono ESCLUSIVI: una fase si misura
+attorno ai suoi next() meno il tempo delle fasi annidate dentro (stack per thread,
+e per task asyncio nella parte async della pipeline). Chunk di byte/testo misurati
+per chunk, righe a blocchi di ROW_BLOCK: niente costo per riga.
+
+Una richiesta con una Trace attiva (TRACE) raccoglie i numeri: in meta.timings se
+il client li chiede e negli istogrammi di /metrics (formato Prometheus) se
+COSTVISTA_METRICS=1. Senza Trace ogni hook è un `TRACE.get()` che ritorna
+l'iteratore così com'è. I worker in processo hanno una Trace propria: il
+chiamante fa `merge()` del loro `export()`.
+
+Memoria: con COSTVISTA_TIMINGS_MEMORY=1 gira tracemalloc e ogni fase riporta il
+picco allocato rispetto all'inizio della richiesta (tracemalloc è globale: con
+richieste concorrenti il picco include anche le altre). Rallenta parecchio: è
+per il debugging, non per la produzione.
+
+Configurazione via env (default fra parentesi):
+  COSTVISTA_METRICS (0)   COSTVISTA_TIMINGS_MEMORY (0)
+"""
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from itertools import islice
+import asyncio, os, threading, time, tracemalloc, weakref
+
+T = TypeVar("T")
+
+
+def _env_flag(name: str) -> bool:
+    return os.getenv(name, "").strip().lower() in ("1", "true", "yes", "on")
+
+
+METRICS = _env_flag("COSTVISTA_METRICS")
+MEMORY = _env_flag("COSTVISTA_TIMINGS_MEMORY")
+ROW_BLOCK = 1024  # righe misurate per volta
+MB = 1024 * 1024
+
+# fase -> (unità di quello che produce, fa parte della catena in -> out?)
+STAGES: Dict[str, Tuple[Optional[str], bool]] = {
+    "hash": ("bytes", False),
+    "fetch": ("bytes", True),
+    "unzip": ("bytes", True),
+    "gunzip": ("bytes", True),
+    "decode": ("chars", True),
+    "sniff": (None, False),
+    "parse": ("rows", True),
+    "normalize": ("rows", False),  # 1:1 e solo per i JSON: fuori dalla catena
+    "summarize": ("codes", True),
+    "serialize": ("bytes", False),
+}
+
+TRACE: ContextVar[Optional["Trace"]] = ContextVar("TRACE", default=None)
+
+# statistiche grezze di una fase: [secondi, quantità prodotta, picco di memoria, quantità in ingresso]
+# (l'ingresso si registra solo dove non è l'uscita della fase prima, es. righe filtrate)
+Stats = Dict[str, List[float]]
+
+
+class Trace:
+    """Numeri per fase di una richiesta (o di un worker). Thread-safe: ogni thread
+       scrive nella sua tabella, si sommano in `snapshot()`."""
+
+    def __init__(self):
+        if MEMORY and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.memory = tracemalloc.is_tracing()
+        self.base = tracemalloc.get_traced_memory()[0] if self.memory else 0
+        self.t0 = time.perf_counter()
+        self.format: Optional[str] = None
+        self.done = False
+        self._local = threading.local()
+        self._tables: List[Stats] = []
+        self._tasks: "weakref.WeakKeyDictionary[asyncio.Task[Any], List[List[float]]]" = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    # ---------- misura ----------
+    def _table(self) -> Stats:
+        table = getattr(self._local, "table", None)
+        if table is None:
+            table = self._local.table = {}
+            with self._lock:
+                self._tables.append(table)
+        return table
+
+    def _stack(self) -> List[List[float]]:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _astack(self) -> List[List[float]]:
+        # le fasi async di richieste diverse si alternano sullo stesso thread: stack per task
+        task = asyncio.current_task()
+        stack = self._tasks.get(task)  # type: ignore[arg-type]
+        if stack is None:
+            stack = self._tasks[task] = []  # type: ignore[index]
+        return stack
+
+    def _begin(self, stack: List[List[float]]) -> float:
+        if self.memory:
+            if stack:  # il picco visto fin qui appartiene anche alla fase che ci contiene
+                stack[-1][1] = max(stack[-1][1], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        stack.append([0.0, 0])  # [secondi delle fasi annidate, picco]
+        return time.perf_counter()
+
+    def _end(self, stack: List[List[float]], t0: float, stage: Optional[str], n: int) -> None:
+        dt = time.perf_counter() - t0
+        child, peak = stack.pop()
+        if self.memory:
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+        if stack:
+            stack[-1][0] += dt
+            if peak > stack[-1][1]:
+                stack[-1][1] = peak
+        if stage is None:
+            return  # fase "trasparente": conta solo per chi la contiene
+        st = self._table().get(stage)
+        if st is None:
+            st = self._table()[stage] = [0.0, 0, 0, 0]
+        st[0] += dt - child
+        st[1] += n
+        if peak > st[2]:
+            st[2] = peak
+
+    def wrap(self, items: Iterable[T], stage: Optional[str], count: Optional[Callable[[T], int]] = len) -> Iterator[T]:
+        """`items` misurato elemento per elemento (chunk). stage=None: il tempo passato
+           qui dentro non si attribuisce a nessuna fase, ma non finisce nemmeno in quella
+           che la contiene (es. il parser che aspetta i chunk dall'event loop)."""
+        it = iter(items)
+        while True:
+            stack = self._stack()  # il generatore può essere ripreso da un altro thread
+            t0 = self._begin(stack)
+            try:
+                item = next(it)
+            except StopIteration:
+                self._end(stack, t0, stage, 0)
+                return
+            except BaseException:
+                self._end(stack, t0, stage, 0)
+                raise
+            self._end(stack, t0, stage, count(item) if count is not None else 0)
+            yield item
+
+    def wrap_rows(self, rows: Iterable[T], stage: str) -> Iterator[T]:
+        """Come wrap ma a blocchi di ROW_BLOCK righe (si leggono un blocco avanti)."""
+        it = iter(rows)
+        while True:
+            stack = self._stack()
+            t0 = self._begin(stack)
+            try:
+                block = list(islice(it, ROW_BLOCK))
+            except BaseException:
+                self._end(stack, t0, stage, 0)
+                raise
+            self._end(stack, t0, stage, len(block))
+            if not block:
+                return
+            yield from block
+
+    async def awrap(self, items: AsyncIterable[T], stage: str, count: Callable[[T], int] = len) -> AsyncIterator[T]:
+        it = items.__aiter__()
+        while True:
+            stack = self._astack()
+            t0 = self._begin(stack)
+            try:
+                item = await it.__anext__()
+            except StopAsyncIteration:
+                self._end(stack, t0, stage, 0)
+                return
+            except BaseException:
+                self._end(stack, t0, stage, 0)
+                raise
+            self._end(stack, t0, stage, count(item))
+            yield item
+
+    @contextmanager
+    def span(self, stage: str) -> Iterator[None]:
+        stack = self._stack()
+        t0 = self._begin(stack)
+        try:
+            yield
+        finally:
+            self._end(stack, t0, stage, 0)
+
+    def add(self, stage: str, n: int = 0, n_in: int = 0) -> None:
+        st = self._table().setdefault(stage, [0.0, 0, 0, 0])
+        st[1] += n
+        st[3] += n_in
+
+    # ---------- risultati ----------
+    def snapshot(self) -> Stats:
+        """Statistiche grezze sommate fra i thread, picchi relativi all'inizio (picklabile)."""
+        out: Stats = {}
+        with self._lock:
+            tables = list(self._tables)
+        for table in tables:
+            for stage, (sec, n, peak, n_in) in list(table.items()):
+                st = out.setdefault(stage, [0.0, 0, 0, 0])
+                st[0] += sec
+                st[1] += n
+                st[2] = max(st[2], peak - self.base if peak else 0)
+                st[3] += n_in
+        return out
+
+    def export(self) -> Dict[str, Any]:
+        """Quello che un worker rimanda al chiamante (picklabile), vedi merge()."""
+        return {"format": self.format, "stages": self.snapshot()}
+
+    def merge(self, data: Optional[Dict[str, Any]]) -> None:
+        """Aggiunge i numeri di un worker (export() di un'altra Trace)."""
+        if not data:
+            return
+        if self.format is None:
+            self.format = data["format"]
+        table = self._table()
+        for stage, (sec, n, peak, n_in) in data["stages"].items():
+            st = table.setdefault(stage, [0.0, 0, 0, 0])
+            st[0] += sec
+            st[1] += n
+            if peak and peak + self.base > st[2]:
+                st[2] = peak + self.base
+            st[3] += n_in
+
+    def report(self) -> Dict[str, Any]:
+        """Il blocco meta.timings: ms per fase, quantità in/out, picco allocato."""
+        stats = self.snapshot()
+        stages: Dict[str, Dict[str, Any]] = {}
+        prev: Optional[Tuple[str, float]] = None  # (unità, quantità) della fase precedente in catena
+        for stage, (unit, chained) in STAGES.items():
+            st = stats.get(stage)
+            if st is None:
+                continue
+            sec, n, peak, n_in = st
+            d: Dict[str, Any] = {"ms": round(sec * 1000, 2)}
+            if chained and prev is not None:
+                d[prev[0] + "_in"] = n_in or prev[1]
+            if unit is not None:
+                d[unit + "_out"] = n
+            if self.memory:
+                d["peak_alloc_mb"] = round(peak / MB, 2)
+            stages[stage] = d
+            if chained and unit is not None:
+                prev = (unit, n)
+        return {
+            "total_ms": round((time.perf_counter() - self.t0) * 1000, 2),
+            "format": self.format,
+            "stages": stages,
+            "memory": "tracemalloc" if self.memory else None,
+        }
+
+    def server_timing(self) -> str:
+        """Header Server-Timing (i devtools dei browser lo mostrano nella timeline)."""
+        parts = [f"{s};dur={st[0] * 1000:.2f}" for s, st in self.snapshot().items() if s in STAGES]
+        parts.append(f"total;dur={(time.perf_counter() - self.t0) * 1000:.2f}")
+        return ", ".join(parts)
+
+    def finish(self, route: str) -> None:
+        """Fine richiesta: negli istogrammi di /metrics (una volta sola)."""
+        if self.done:
+            return
+        self.done = True
+        if METRICS:
+            REGISTRY.observe(route, self.format or "none", self.snapshot(), time.perf_counter() - self.t0)
+
+
+# ---------- hook per la pipeline (no-op senza Trace) ----------
+def start(requested: bool) -> Optional[Trace]:
+    """Trace per la richiesta corrente se il client vuole i timings o se /metrics è attivo."""
+    if not (requested or METRICS):
+        return None
+    trace = Trace()
+    TRACE.set(trace)
+    return trace
+
+
+@contextmanager
+def collect(enabled: bool) -> Iterator[Optional[Trace]]:
+    """Trace propria per un worker (processo del pool): il chiamante fa merge() di export()."""
+    if not enabled:
+        yield None
+        return
+    trace = Trace()
+    token = TRACE.set(trace)
+    try:
+        yield trace
+    finally:
+        TRACE.reset(token)  # i processi del pool servono altre richieste
+
+
+def active() -> bool:
+    return TRACE.get() is not None
+
+
+def wrap(items: Iterable[T], stage: Optional[str], count: Optional[Callable[[T], int]] = len) -> Iterable[T]:
+    trace = TRACE.get()
+    return items if trace is None else trace.wrap(items, stage, count)
+
+
+def wrap_rows(rows: Iterable[T], stage: str) -> Iterable[T]:
+    trace = TRACE.get()
+    return rows if trace is None else trace.wrap_rows(rows, stage)
+
+
+def awrap(items: AsyncIterable[T], stage: str, count: Callable[[T], int] = len) -> AsyncIterable[T]:
+    trace = TRACE.get()
+    return items if trace is None else trace.awrap(items, stage, count)
+
+
+def span(stage: str) -> Any:
+    trace = TRACE.get()
+    return nullcontext() if trace is None else trace.span(stage)
+
+
+def add(stage: str, n: int = 0, n_in: int = 0) -> None:
+    trace = TRACE.get()
+    if trace is not None:
+        trace.add(stage, n, n_in)
+
+
+def set_format(fmt: str) -> None:
+    trace = TRACE.get()
+    if trace is not None and trace.format is None:
+        trace.format = fmt
+
+
+def merge(data: Optional[Dict[str, Any]]) -> None:
+    trace = TRACE.get()
+    if trace is not None:
+        trace.merge(data)
+
+
+# ---------- Prometheus ----------
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _num(v: float) -> str:
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    def esc(v: str) -> str:
+        return v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return ",".join(f'{k}="{esc(v)}"' for k, v in zip(names, values))
+
+
+class Histogram:
+    """Istogramma Prometheus minimale (cumulativo per bucket, con _sum e _count)."""
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...], buckets: Tuple[float, ...] = STAGE_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        self._series: Dict[Tuple[str, ...], List[float]] = {}  # label -> [count per bucket..., +Inf, sum]
+
+    def observe(self, values: Tuple[str, ...], v: float) -> None:
+        s = self._series.get(values)
+        if s is None:
+            s = self._series[values] = [0.0] * (len(self.buckets) + 2)
+        for i, b in enumerate(self.buckets):
+            if v <= b:
+                s[i] += 1
+        s[-2] += 1
+        s[-1] += v
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for values, s in sorted(self._series.items()):
+            lb = _labels(self.labels, values)
+            for b, c in zip(self.buckets, s):
+                out.append(f'{self.name}_bucket{{{lb},le="{b:g}"}} {_num(c)}')
+            out.append(f'{self.name}_bucket{{{lb},le="+Inf"}} {_num(s[-2])}')
+            out.append(f"{self.name}_sum{{{lb}}} {s[-1]:.6f}")
+            out.append(f"{self.name}_count{{{lb}}} {_num(s[-2])}")
+        return out
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...]):
+        self.name, self.help, self.labels = name, help, labels
+        self._series: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, values: Tuple[str, ...], v: float = 1) -> None:
+        self._series[values] = self._series.get(values, 0) + v
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        out += [f"{self.name}{{{_labels(self.labels, k)}}} {_num(v)}" for k, v in sorted(self._series.items())]
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = Histogram("costvista_request_seconds",
+                                  "Request duration by route and input format (serialization included).",
+                                  ("route", "format"))
+        self.stages = Histogram("costvista_stage_seconds",
+                                "Exclusive time per pipeline stage and input format, per request.",
+                                ("stage", "format"))
+        self.items = Counter("costvista_stage_output_total",
+                             "Bytes/chars/rows/codes produced by each pipeline stage.",
+                             ("stage", "format", "unit"))
+        self.peak = Histogram("costvista_stage_peak_alloc_bytes",
+                              "Peak traced allocation per stage (only with COSTVISTA_TIMINGS_MEMORY=1).",
+                              ("stage", "format"),
+                              buckets=tuple(float(MB << i) for i in range(0, 13, 2)))
+
+    def observe(self, route: str, fmt: str, stats: Stats, seconds: float) -> None:
+        with self._lock:
+            self.requests.observe((route, fmt), seconds)
+            for stage, (sec, n, peak, _) in stats.items():
+                unit = STAGES.get(stage, (None, False))[0]
+                self.stages.observe((stage, fmt), sec)
+                if unit is not None:
+                    self.items.inc((stage, fmt, unit), n)
+                if peak:
+                    self.peak.observe((stage, fmt), peak)
+
+    def render(self) -> str:
+        with self._lock:
+            lines = self.requests.render() + self.stages.render() + self.items.render() + self.peak.render()
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
@@ -0,0 +1,146 @@
+"""
+Formati di risposta per le route con righe (/api/parse, /api/summary, /api/summary_upload).
+
+- "json" (default): il documento unico di sempre;
+- "ndjson" (`format=ndjson` o `Accept: application/x-ndjson`): chunked, una riga
+  JSON per oggetto. La prima riga è la risposta SENZA `rows` (summary, count, meta),
+  poi una riga per ogni record, nell'ordine di sempre. Il client può disegnare il
+  summary appena arriva la prima riga e le tabelle man mano; lato server non si
+  costruisce mai il documento intero;
+- "columnar" (`format=columnar` o `Accept: application/vnd.costvista.columnar+json`):
+  stessa risposta, ma `rows` diventa un oggetto a colonne (layout "columnar-v1"):
+
+    {"layout": "columnar-v1", "length": N, "columns": [
+       {"name": "provider_name", "type": "dict", "values": ["Zelis", "OptiHealth", ...],
+        "index_width": 1, "indices": "<base64>", "absent": 2},
+       {"name": "negotiated_rate", "type": "f64", "data": "<base64>"},
+       ...]}
+
+  Colonne nell'ordine in cui le chiavi compaiono nelle righe. "f64": la chiave c'è in
+  tutte le righe ed è sempre un float -> N float64 little-endian. "dict": valori
+  distinti una volta sola (qualsiasi valore JSON) e N indici interi senza segno
+  little-endian larghi `index_width` byte (1, 2 o 4); se presente, `absent` è
+  l'indice che vuol dire "chiave assente in questa riga" (values[absent] è null).
+  decode_columnar() è il riferimento per ricostruire le righe.
+"""
+from typing import Any, Dict, Iterator, List, Optional
+from array import array
+import base64, json, sys
+
+RESPONSE_FORMATS = ("json", "ndjson", "columnar")
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "columnar": "application/vnd.costvista.columnar+json"}
+COLUMNAR_LAYOUT = "columnar-v1"
+NDJSON_BATCH = 1000  # righe per chunk HTTP
+
+
+def negotiate(fmt: Optional[str], accept: str) -> str:
+    """Formato richiesto: il campo `format` vince sull'header Accept. ValueError se sconosciuto."""
+    if fmt:
+        f = fmt.strip().lower()
+        if f not in RESPONSE_FORMATS:
+            raise ValueError(f"Unknown format: {fmt}. Use one of: {', '.join(RESPONSE_FORMATS)}.")
+        return f
+    for fmt_name, media in MEDIA_TYPES.items():
+        if media in (accept or "").lower():
+            return fmt_name
+    return "json"
+
+
+def _dumps(obj: Any) -> str:
+    # stessi parametri di JSONResponse di Starlette
+    return json.dumps(obj, ensure_ascii=False, allow_nan=False, separators=(",", ":"), default=str)
+
+
+def ndjson_chunks(res: Dict[str, Any]) -> Iterator[bytes]:
+    """Testata (tutto tranne `rows`) e poi le righe, a blocchi di NDJSON_BATCH."""
+    head = {k: v for k, v in res.items() if k != "rows"}
+    yield (_dumps(head) + "\n").encode("utf-8")
+    rows = res.get("rows") or []
+    for i in range(0, len(rows), NDJSON_BATCH):
+        yield "".join(_dumps(r) + "\n" for r in rows[i:i + NDJSON_BATCH]).encode("utf-8")
+
+
+# ---------- columnar ----------
+_ABSENT = object()
+_INDEX_TYPES = ((1, "B", 0xFF), (2, "H", 0xFFFF), (4, "I", 0xFFFFFFFF))
+
+
+def _packed(a: array) -> str:
+    if sys.byteorder == "big":
+        a.byteswap()
+    return base64.b64encode(a.tobytes()).decode("ascii")
+
+
+def _unpacked(code: str, data: str) -> array:
+    a = array(code)
+    a.frombytes(base64.b64decode(data))
+    if sys.byteorder == "big":
+        a.byteswap()
+    return a
+
+
+def _column(name: str, vals: List[Any]) -> Dict[str, Any]:
+    if all(type(v) is float for v in vals):
+        return {"name": name, "type": "f64", "data": _packed(array("d", vals))}
+    ids: Dict[Any, int] = {}
+    if all(type(v) is str or v is _ABSENT for v in vals):
+        # caso tipico (stringhe): la stringa stessa è la chiave del dizionario
+        idx = [ids.setdefault(v, len(ids)) for v in vals]
+        values = [None if v is _ABSENT else v for v in ids]
+    else:
+        # tipi misti: 1, 1.0 e True sono uguali come chiavi dict -> chiave col tipo
+        # (liste/oggetti: la loro forma JSON)
+        firsts: List[Any] = []
+        idx = []
+        for v in vals:
+            k = v if v is _ABSENT else (type(v).__name__, v if isinstance(v, (str, int, float, bool, type(None)))
+                                        else json.dumps(v, sort_keys=True, default=str))
+            i = ids.get(k)
+            if i is None:
+                i = ids[k] = len(firsts)
+                firsts.append(None if v is _ABSENT else v)
+            idx.append(i)
+        values = firsts
+    width, code, _ = next(t for t in _INDEX_TYPES if len(values) <= t[2])
+    col = {"name": name, "type": "dict", "values": values, "index_width": width, "indices": _packed(array(code, idx))}
+    if _ABSENT in ids:
+        col["absent"] = ids[_ABSENT]
+    return col
+
+
+def columnar_rows(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Righe -> oggetto "columnar-v1" (vedi docstring del modulo)."""
+    names: Dict[str, None] = {}
+    first = rows[0] if rows else {}
+    keys0 = tuple(first)
+    for r in rows:
+        if tuple(r) != keys0 or r is first:  # quasi sempre le righe hanno le stesse chiavi
+            names.update(dict.fromkeys(r))
+    cols = [_column(n, [r.get(n, _ABSENT) for r in rows]) for n in names]
+    return {"layout": COLUMNAR_LAYOUT, "length": len(rows), "columns": cols}
+
+
+def decode_columnar(obj: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Inverso di columnar_rows (riferimento per i client)."""
+    n = obj["length"]
+    rows: List[Dict[str, Any]] = [{} for _ in range(n)]
+    for col in obj["columns"]:
+        name = col["name"]
+        if col["type"] == "f64":
+            for r, v in zip(rows, _unpacked("d", col["data"])):
+                r[name] = v
+            continue
+        code = next(c for w, c, _ in _INDEX_TYPES if w == col["index_width"])
+        values, absent = col["values"], col.get("absent")
+        for r, i in zip(rows, _unpacked(code, col["indices"])):
+            if i != absent:
+                r[name] = values[i]
+    return rows
+
+
+def columnar_body(res: Dict[str, Any]) -> bytes:
+    """Risposta completa in formato columnar (summary/meta come in JSON)."""
+    out = dict(res)
+    if "rows" in out:
+        out["rows"] = columnar_rows(out["rows"])
+    return _dumps(out).encode("utf-8")
@@ -0,0 +1,222 @@
+"""
+Profili di schema: header della sorgente -> mapping canonico + convertitore di riga.
+
+Ogni payer pubblica sempre gli stessi header: il mapping (match esatto, "contains",
+hook AI) si calcola una volta per firma di header e si riusa. La firma è l'hash
+degli header nell'ordine e del vocabolario CANON_FIELDS, quindi se il vocabolario
+cambia i profili vecchi semplicemente non vengono più trovati.
+
+Per ogni profilo si compila (una volta) un convertitore che porta la riga allo
+schema canonico in un solo passaggio e SENZA copiarla: aggiunge le chiavi
+canoniche in coda (stesso ordine di _apply_mapping_to_row) e fa le coerzioni.
+Due varianti:
+  - fixed: tutte le righe hanno tutti gli header (CSV) -> solo assegnazioni,
+    nessun controllo per riga;
+  - loose: righe JSON, le chiavi possono mancare -> controlli come prima.
+Per i CSV che non devono restituire le righe, `projection()` dice quali colonne
+leggere (per indice) per costruire righe "slim" con le sole chiavi che servono.
+
+Persistenza opzionale (JSON su disco): i profili sopravvivono ai riavvii e sono
+condivisi fra i processi del pool, così i formati ricorrenti saltano il mapping.
+
+Configurazione via env:
+  COSTVISTA_SCHEMA_DIR (disattivo)   COSTVISTA_SCHEMA_MAX_PROFILES (1024)
+"""
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from pathlib import Path
+import hashlib, json, os, tempfile, threading
+
+Row = Dict[str, Any]
+Converter = Callable[[Row], Row]
+# campi testuali canonici ripuliti (str + strip) se presenti
+TEXT_FIELDS = ("code", "description", "provider_name", "rate_type")
+RATE_FIELD = "negotiated_rate"
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, "") or default)
+    except ValueError:
+        return default
+
+
+def compile_converter(headers: Sequence[str], mapping: Dict[str, str], coerce: Callable[[Any], float],
+                      fixed: bool = False) -> Converter:
+    """Genera il convertitore per questi header/mapping (vedi docstring del modulo).
+       Equivale a _apply_mapping_to_row + coerzioni di iter_normalized, ma in place."""
+    present = set(headers)
+    lines: List[str] = ["def convert(row):"]
+    for src, canon in mapping.items():
+        if src == canon:
+            continue  # i nomi canonici mappano su sé stessi: mai da copiare
+        if fixed:
+            if canon in present:
+                continue
+            present.add(canon)
+            lines.append(f"    row[{canon!r}] = row[{src!r}]")
+        else:
+            lines.append(f"    if {canon!r} not in row and {src!r} in row:")
+            lines.append(f"        row[{canon!r}] = row[{src!r}]")
+    if fixed:
+        rate = f"row[{RATE_FIELD!r}]" if RATE_FIELD in present else "None"
+        lines.append(f"    row[{RATE_FIELD!r}] = coerce({rate})")
+        for k in TEXT_FIELDS:
+            if k in present:
+                lines.append(f"    row[{k!r}] = str(row[{k!r}] or '').strip()")
+    else:
+        lines.append(f"    row[{RATE_FIELD!r}] = coerce(row.get({RATE_FIELD!r}))")
+        for k in TEXT_FIELDS:
+            lines.append(f"    if {k!r} in row:")
+            lines.append(f"        row[{k!r}] = str(row[{k!r}] or '').strip()")
+    lines.append("    return row")
+    ns: Dict[str, Any] = {"coerce": coerce}
+    exec("\n".join(lines), ns)  # noqa: S102 - sorgente generato qui, nomi via repr()
+    return ns["convert"]
+
+
+def compile_slim_builder(cols: Sequence[Tuple[str, Optional[int], str]],
+                         coerce_block: Callable[[List[Any]], List[float]]) -> Callable[[List[List[str]]], List[Row]]:
+    """Genera il costruttore delle righe "slim" da un blocco di record CSV (liste di
+       stringhe lunghe almeno quanto la colonna più a destra di `cols`): le tariffe
+       si convertono in blocco con `coerce_block`, poi una sola list comprehension."""
+    fields: List[str] = []
+    rate = "None"
+    for key, i, kind in cols:
+        if kind == "rate":
+            if i is not None:
+                rate = f"[r[{i}] for r in block]"
+            fields.append(f"{key!r}: x")
+        elif kind == "text":
+            fields.append(f"{key!r}: r[{i}].strip()")
+        else:
+            fields.append(f"{key!r}: r[{i}]")
+    src = (
+        "def build(block):\n"
+        + (f"    rates = coerce_block({rate})\n" if rate != "None" else "    rates = [coerce_block([None])[0]] * len(block)\n")
+        + "    return [{" + ", ".join(fields) + "} for r, x in zip(block, rates)]"
+    )
+    ns: Dict[str, Any] = {"coerce_block": coerce_block}
+    exec(src, ns)  # noqa: S102 - come compile_converter
+    return ns["build"]
+
+
+class SchemaProfile:
+    """Mapping risolto per una firma di header, con i convertitori compilati al primo uso."""
+    __slots__ = ("signature", "headers", "mapping", "_coerce", "_fixed", "_loose")
+
+    def __init__(self, signature: str, headers: List[str], mapping: Dict[str, str],
+                 coerce: Callable[[Any], float]):
+        self.signature = signature
+        self.headers = headers
+        self.mapping = mapping
+        self._coerce = coerce
+        self._fixed: Optional[Converter] = None
+        self._loose: Optional[Converter] = None
+
+    def converter(self, fixed: bool = False) -> Converter:
+        if fixed:
+            if self._fixed is None:
+                self._fixed = compile_converter(self.headers, self.mapping, self._coerce, fixed=True)
+            return self._fixed
+        if self._loose is None:
+            self._loose = compile_converter(self.headers, self.mapping, self._coerce)
+        return self._loose
+
+    def projection(self, extra: Sequence[str] = ()) -> List[Tuple[str, Optional[int], str]]:
+        """Colonne per le righe "slim" (solo quello che serve a summary/filtri):
+           (chiave, indice della colonna o None se manca, "text" | "rate" | "raw").
+           I valori sono quelli che darebbe il convertitore fixed per quelle chiavi;
+           `extra` sono header da tenere così come sono (es. codici alternativi)."""
+        last = {h: i for i, h in enumerate(self.headers)}  # header doppi: vince l'ultimo, come in dict(zip())
+        src = {k: last[k] for k in (*TEXT_FIELDS, RATE_FIELD) if k in last}
+        for h, canon in self.mapping.items():
+            if canon not in src and h in last:
+                src[canon] = last[h]
+        cols: List[Tuple[str, Optional[int], str]] = [(k, src[k], "text") for k in TEXT_FIELDS if k in src]
+        cols.append((RATE_FIELD, src.get(RATE_FIELD), "rate"))
+        cols += [(h, last[h], "raw") for h in extra if h in last and h not in src]
+        return cols
+
+
+class SchemaRegistry:
+    """Profili per firma di header: in memoria e (se c'è `path`) su un file JSON."""
+
+    def __init__(self, build: Callable[[List[str]], Dict[str, str]], coerce: Callable[[Any], float],
+                 vocabulary: Any, path: Optional[str] = None, max_profiles: int = 1024):
+        self.build = build
+        self.coerce = coerce
+        self.vocab_hash = hashlib.sha1(json.dumps(vocabulary, sort_keys=True).encode()).hexdigest()
+        self.path = Path(path) if path else None
+        self.max_profiles = max_profiles
+        self._profiles: Dict[str, SchemaProfile] = {}
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+        if self.path is not None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            for sig, p in self._read().items():
+                self._profiles[sig] = SchemaProfile(sig, p["headers"], p["mapping"], coerce)
+
+    @classmethod
+    def from_env(cls, build: Callable[[List[str]], Dict[str, str]], coerce: Callable[[Any], float],
+                 vocabulary: Any) -> "SchemaRegistry":
+        d = os.getenv("COSTVISTA_SCHEMA_DIR")
+        return cls(build, coerce, vocabulary, path=str(Path(d) / "profiles.json") if d else None,
+                   max_profiles=_env_int("COSTVISTA_SCHEMA_MAX_PROFILES", 1024))
+
+    def signature(self, headers: Sequence[str]) -> str:
+        return hashlib.sha1(json.dumps([self.vocab_hash, list(headers)]).encode("utf-8")).hexdigest()
+
+    def profile(self, headers: Sequence[str]) -> SchemaProfile:
+        """Profilo per questi header; se è nuovo si calcola il mapping e si salva."""
+        headers = [h for h in headers if h is not None]
+        sig = self.signature(headers)
+        prof = self._profiles.get(sig)
+        if prof is not None:
+            self.stats["hits"] += 1
+            return prof
+        self.stats["misses"] += 1
+        prof = SchemaProfile(sig, headers, self.build(headers), self.coerce)
+        with self._lock:
+            if len(self._profiles) < self.max_profiles:
+                self._profiles[sig] = prof
+                if self.path is not None:
+                    self._save(prof)
+        return prof
+
+    def converter(self, headers: Sequence[str], fixed: bool = False) -> Converter:
+        return self.profile(headers).converter(fixed)
+
+    def adopt(self, headers: Sequence[str], mapping: Dict[str, str]) -> SchemaProfile:
+        """Profilo con un mapping già calcolato altrove (es. dal processo che ha letto
+           l'header, per i worker che parsano le altre fette dello stesso file)."""
+        sig = self.signature(headers)
+        prof = self._profiles.get(sig)
+        if prof is not None and prof.mapping == mapping:
+            return prof
+        prof = SchemaProfile(sig, list(headers), dict(mapping), self.coerce)
+        with self._lock:
+            if len(self._profiles) < self.max_profiles:
+                self._profiles[sig] = prof
+        return prof
+
+    # ---------- disco ----------
+    def _read(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:  # type: ignore[arg-type]
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        profiles = data.get("profiles") if isinstance(data, dict) else None
+        return profiles if isinstance(profiles, dict) else {}
+
+    def _save(self, prof: SchemaProfile) -> None:
+        # rilegge prima di scrivere: altri processi del pool possono aver aggiunto profili
+        profiles = self._read()
+        profiles[prof.signature] = {"headers": prof.headers, "mapping": prof.mapping}
+        try:
+            fd, tmp = tempfile.mkstemp(dir=str(self.path.parent), suffix=".tmp")  # type: ignore[union-attr]
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"profiles": profiles}, f)
+            os.replace(tmp, self.path)  # type: ignore[arg-type]
+        except OSError:
+            pass  # la persistenza è solo un'ottimizzazione
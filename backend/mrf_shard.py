@@ -0,0 +1,107 @@
+"""
+Parse a fette di un file grande (CSV o NDJSON non compresso, su disco) in più processi.
+
+Il file si taglia in N range di byte, uno per worker. I tagli vanno spostati su
+un inizio di record: per l'NDJSON basta il primo '\\n' (nelle stringhe JSON gli a
+capo sono sempre escapati), per il CSV no, un campo quotato può contenere a capo.
+Quindi due passate, entrambe in parallelo:
+  1) `scan`: ogni worker conta virgolette e '\\n' nel suo range "nominale"; le somme
+     prefisse danno, a ogni taglio, la parità delle virgolette (dentro/fuori da un
+     campo quotato) e il numero di riga;
+  2) `align` + `read`: ogni worker sposta il suo inizio e la sua fine al primo '\\n'
+     fuori dalle virgolette (stessa regola per i due vicini, quindi i range si
+     toccano senza buchi né sovrapposizioni) e parsa solo quei byte.
+Vale l'ipotesi di _keep_records: virgolette bilanciate, "" per l'escape (niente
+escapechar). '\\n' e '"' non compaiono mai dentro un carattere UTF-8 multi-byte,
+quindi ogni range si decodifica per conto suo.
+
+Configurazione via env (default fra parentesi):
+  COSTVISTA_SHARD_MIN_BYTES (64MB, 0 = mai)   COSTVISTA_SHARD_BYTES (16MB, minimo per fetta)
+"""
+from typing import Iterator, List, Optional, Tuple
+import os
+
+READ_CHUNK = 256 * 1024
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, "") or default)
+    except ValueError:
+        return default
+
+
+SHARD_MIN_BYTES = _env_int("COSTVISTA_SHARD_MIN_BYTES", 64 * 1024 * 1024)
+SHARD_BYTES = max(1, _env_int("COSTVISTA_SHARD_BYTES", 16 * 1024 * 1024))
+
+
+def shard_count(size: int, workers: int) -> int:
+    """Quante fette per un file di `size` byte (1 = niente sharding)."""
+    if SHARD_MIN_BYTES <= 0 or size < SHARD_MIN_BYTES or workers < 2:
+        return 1
+    return max(1, min(workers, size // SHARD_BYTES))
+
+
+def cuts(start: int, end: int, n: int) -> List[int]:
+    """Tagli nominali (non allineati) di [start, end) in n pezzi: n + 1 posizioni."""
+    return [start + (end - start) * i // n for i in range(n)] + [end]
+
+
+def read(path: str, start: int, end: int, chunk: int = READ_CHUNK) -> Iterator[bytes]:
+    """I byte [start, end) del file, a chunk."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        left = end - start
+        while left > 0:
+            data = f.read(min(chunk, left))
+            if not data:
+                return
+            left -= len(data)
+            yield data
+
+
+def scan(path: str, start: int, end: int, quote: Optional[bytes]) -> Tuple[int, int]:
+    """(virgolette, '\\n') in [start, end). quote=None: le virgolette non contano (NDJSON)."""
+    quotes = lines = 0
+    for data in read(path, start, end):
+        lines += data.count(b"\n")
+        if quote is not None:
+            quotes += data.count(quote)
+    return quotes, lines
+
+
+def align(path: str, pos: int, odd: bool, quote: Optional[bytes], size: int) -> Tuple[int, int]:
+    """(inizio del primo record dopo pos, '\\n' in [pos, inizio)). `odd`: a pos si è
+       dentro un campo quotato (virgolette dispari da inizio dati). Il record inizia dopo
+       il primo '\\n' >= pos fuori dalle virgolette; `size` se non ce n'è."""
+    skipped = 0
+    for data in read(path, pos, size):
+        i = 0
+        while True:
+            nl = data.find(b"\n", i)
+            if quote is not None:
+                q = data.count(quote, i, len(data) if nl < 0 else nl)
+                odd ^= q % 2 == 1
+            if nl < 0:
+                break
+            skipped += 1
+            if not odd:
+                return pos + nl + 1, skipped
+            i = nl + 1
+        pos += len(data)
+    return size, skipped
+
+
+def record_end(data: bytes, start: int, quote: Optional[bytes]) -> int:
+    """Fine (dopo il '\\n') del record che inizia a `start` in `data`; -1 se non finisce lì."""
+    odd = False
+    i = start
+    while True:
+        nl = data.find(b"\n", i)
+        if nl < 0:
+            return -1
+        if quote is not None:
+            odd ^= data.count(quote, i, nl) % 2 == 1
+        if not odd:
+            return nl + 1
+        i = nl + 1
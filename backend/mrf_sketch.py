@@ -0,0 +1,213 @@
+"""
+Modalità approssimata (approx=true) per le statistiche per codice.
+
+Per ogni codice teniamo solo:
+- uno sketch di quantili KLL (mergeable) per p25/median/p75;
+- un max-heap limitato ai top-k provider più economici;
+- count, min, max e la prima descrizione (esatti).
+
+Garanzie (KLL, Karnin-Lang-Liberty 2016, con k = APPROX_K = 200):
+- memoria per codice limitata a ~3k valori (≈ 5KB), indipendente dal numero di tariffe;
+- errore di rango dei quantili ≤ ~1.65% di n con probabilità ≥ 99%
+  (es. su 1M tariffe, la "median" restituita sta fra il rango 483.5k e 516.5k);
+- finché un codice ha meno di k tariffe lo sketch non compatta mai e il risultato
+  è IDENTICO alla modalità esatta;
+- count/min/max/top3/description sono sempre esatti.
+
+Gli sketch sono mergeable: ApproxSummaryBuilder.merge() combina risultati
+parziali (chunk, file, processi) senza i valori grezzi.
+"""
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import heapq, math, random
+from mrf_engine import median_sorted, percentile_sorted
+
+APPROX_K = 200
+APPROX_RANK_ERROR = 0.0165  # errore di rango normalizzato tipico per k=200 (99% conf.)
+
+
+class KLLSketch:
+    """Sketch KLL minimale: compattatori per livello, capacità k * c^(profondità)."""
+
+    def __init__(self, k: int = APPROX_K, c: float = 2.0 / 3.0, seed: int = 0):
+        self.k = k
+        self.c = c
+        self.levels: List[List[float]] = [[]]
+        self.n = 0
+        self.size = 0
+        self._limit = self._max_size()  # ricalcolato solo quando cambia il numero di livelli
+        self._rng = random.Random(seed)  # deterministico: stesse righe -> stessa risposta
+
+    def _capacity(self, h: int) -> int:
+        depth = len(self.levels) - h - 1
+        return max(2, int(math.ceil(self.k * (self.c ** depth))))
+
+    def _max_size(self) -> int:
+        return sum(self._capacity(h) for h in range(len(self.levels)))
+
+    def update(self, x: float) -> None:
+        self.levels[0].append(x)
+        self.n += 1
+        self.size += 1
+        if self.size >= self._limit:
+            self._compress()
+
+    def _compress(self) -> None:
+        while self.size >= self._max_size():
+            for h, lvl in enumerate(self.levels):
+                if len(lvl) >= self._capacity(h):
+                    if h + 1 == len(self.levels):
+                        self.levels.append([])
+                        self._limit = self._max_size()
+                    lvl.sort()
+                    # se dispari il primo elemento resta a questo livello
+                    keep = lvl[:1] if len(lvl) % 2 else []
+                    pairs = lvl[len(keep):]
+                    promoted = pairs[self._rng.randint(0, 1)::2]
+                    self.levels[h + 1].extend(promoted)
+                    self.levels[h] = keep
+                    self.size += len(promoted) + len(keep) - len(lvl)
+                    break
+
+    def merge(self, other: "KLLSketch") -> None:
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+        self._limit = self._max_size()
+        for h, lvl in enumerate(other.levels):
+            self.levels[h].extend(lvl)
+        self.n += other.n
+        self.size = sum(len(l) for l in self.levels)
+        self._compress()
+
+    @property
+    def exact(self) -> bool:
+        """Nessuna compattazione: lo sketch contiene tutti i valori."""
+        return len(self.levels) == 1
+
+    def weighted(self) -> List[Tuple[float, int]]:
+        items = [(x, 1 << h) for h, lvl in enumerate(self.levels) for x in lvl]
+        items.sort(key=lambda t: t[0])
+        return items
+
+    def value_at_rank(self, items: List[Tuple[float, int]], r: int) -> float:
+        """Valore (stimato) di rango r (0-based) nella sequenza ordinata completa."""
+        cum = 0
+        for x, w in items:
+            cum += w
+            if r < cum:
+                return x
+        return items[-1][0]
+
+
+class _CodeAgg:
+    __slots__ = ("sketch", "count", "min", "max", "desc", "top")
+
+    def __init__(self, seed: int):
+        self.sketch = KLLSketch(seed=seed)
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self.desc: Optional[str] = None
+        self.top: List[Tuple[float, int, str]] = []  # max-heap (-rate, -seq, provider)
+
+
+class ApproxSummaryBuilder:
+    """Stessa interfaccia di mrf_engine.SummaryBuilder, memoria costante per codice."""
+
+    def __init__(self, top_k: int = 3):
+        self.top_k = top_k
+        self.codes: Dict[str, _CodeAgg] = {}
+        self._seq = 0  # ordine d'arrivo globale: a parità di tariffa vince la riga arrivata prima
+
+    def add(self, r: Dict[str, Any]) -> None:
+        self.add_rows((r,))
+
+    def add_rows(self, rows: Iterable[Dict[str, Any]]) -> None:
+        codes, top_k = self.codes, self.top_k
+        for r in rows:
+            code = str(r.get("code", "")).strip()
+            if not code:
+                continue
+            agg = codes.get(code)
+            if agg is None:
+                agg = codes[code] = _CodeAgg(seed=len(codes))
+            if agg.desc is None:
+                d = str(r.get("description") or "")
+                if d:
+                    agg.desc = d.strip()
+            v = float(r.get("negotiated_rate") or 0)
+            agg.sketch.update(v)
+            agg.count += 1
+            if v < agg.min:
+                agg.min = v
+            if v > agg.max:
+                agg.max = v
+            self._seq += 1
+            item = (-v, -self._seq, str(r.get("provider_name") or ""))
+            if len(agg.top) < top_k:
+                heapq.heappush(agg.top, item)
+            elif item > agg.top[0]:
+                heapq.heapreplace(agg.top, item)
+
+    def merge(self, other: "ApproxSummaryBuilder") -> None:
+        """Aggiunge i risultati di `other` come se le sue righe arrivassero dopo le nostre."""
+        offset = self._seq
+        for code, o in other.codes.items():
+            agg = self.codes.get(code)
+            if agg is None:
+                agg = self.codes[code] = _CodeAgg(seed=len(self.codes))
+            agg.sketch.merge(o.sketch)
+            agg.count += o.count
+            agg.min = min(agg.min, o.min)
+            agg.max = max(agg.max, o.max)
+            if agg.desc is None:
+                agg.desc = o.desc
+            for v, s, p in o.top:
+                item = (v, s - offset, p)
+                if len(agg.top) < self.top_k:
+                    heapq.heappush(agg.top, item)
+                elif item > agg.top[0]:
+                    heapq.heapreplace(agg.top, item)
+        self._seq += other._seq
+
+    def __len__(self) -> int:
+        return sum(a.count for a in self.codes.values())
+
+    def summary(self, top_k: int = 3) -> List[Dict[str, Any]]:
+        out = []
+        for code, agg in self.codes.items():
+            if not agg.count:
+                continue
+            p25, med, p75 = _quantiles(agg.sketch)
+            top = sorted(agg.top, reverse=True)[:top_k]
+            out.append({
+                "code": code, "description": agg.desc or "", "count": agg.count,
+                "min": float(agg.min), "median": med, "p25": p25, "p75": p75,
+                "max": float(agg.max),
+                "top3": [{"provider_name": p, "negotiated_rate": -v} for v, _, p in top],
+            })
+        out.sort(key=lambda s: s["code"])
+        return out
+
+
+def _quantiles(sk: KLLSketch) -> Tuple[float, float, float]:
+    """(p25, median, p75) con le stesse formule della modalità esatta: se lo sketch
+    non ha compattato sono i valori esatti, altrimenti ranghi stimati interpolati."""
+    items = sk.weighted()
+    n = sk.n
+    if sk.exact:
+        s = [x for x, _ in items]
+        return percentile_sorted(s, 25), median_sorted(s), percentile_sorted(s, 75)
+
+    def at(r: int) -> float:
+        return sk.value_at_rank(items, r)
+
+    def pct(p: float) -> float:
+        k = (n - 1) * (p / 100.0)
+        f = int(k); c = min(f + 1, n - 1)
+        lo = at(f)
+        return float(lo if f == c else lo + (at(c) - lo) * (k - f))
+
+    m = n // 2
+    med = float(at(m)) if n % 2 else (at(m - 1) + at(m)) / 2.0
+    return pct(25), med, pct(75)
+
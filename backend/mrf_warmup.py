@@ -0,0 +1,143 @@
+"""
+Warm-up all'avvio: dopo un deploy (o un'istanza nuova dell'autoscaling) i primi utenti
+pagherebbero fetch + parse + summary degli stessi pochi file popolari. Il lifespan
+legge un manifest di sorgenti e le porta nella cache dei risultati in background,
+al più COSTVISTA_WARMUP_CONCURRENCY alla volta (il parse passa comunque da mrf_exec).
+
+Liveness e readiness sono separate: /health risponde sempre se il processo è vivo,
+/health/ready dà 503 finché il warm-up non è finito (ogni sorgente ok o in errore:
+una sorgente rotta non tiene fuori l'istanza) o finché non sono passati
+COSTVISTA_WARMUP_READY_TIMEOUT secondi; dopo si prende traffico e il warm-up continua.
+
+Manifest JSON: una lista, oppure {"sources": [...]}. Ogni voce è un url/path o un
+oggetto coi campi di /api/summary (url, include_rows, approx, all_members, inner, ...).
+
+Configurazione via env (default fra parentesi):
+  COSTVISTA_WARMUP_MANIFEST (warmup.json accanto a main.py; vuoto = niente warm-up)
+  COSTVISTA_WARMUP_CONCURRENCY (2)   COSTVISTA_WARMUP_READY_TIMEOUT (300)
+"""
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from pathlib import Path
+import asyncio, json, os, time
+
+DEFAULT_MANIFEST = Path(__file__).resolve().parent / "warmup.json"
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, "") or default)
+    except ValueError:
+        return default
+
+
+def load_manifest(path: str) -> List[Dict[str, Any]]:
+    """Le voci del manifest come dict con almeno "url"."""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get("sources")
+    if not isinstance(data, list):
+        raise ValueError("Warm-up manifest must be a list or { sources: [...] }.")
+    out: List[Dict[str, Any]] = []
+    for item in data:
+        if isinstance(item, str):
+            item = {"url": item}
+        if not isinstance(item, dict) or not isinstance(item.get("url"), str):
+            raise ValueError(f"Invalid warm-up manifest entry: {item!r}")
+        out.append(item)
+    return out
+
+
+class WarmUp:
+    """Stato del warm-up (per /health/ready) e il task che lo esegue."""
+
+    def __init__(self, sources: List[Dict[str, Any]], manifest: Optional[str] = None,
+                 concurrency: int = 2, ready_timeout: float = 300.0, error: Optional[str] = None):
+        self.sources = sources
+        self.manifest = manifest
+        self.concurrency = max(1, concurrency)
+        self.ready_timeout = ready_timeout
+        self.error = error  # manifest illeggibile: niente warm-up, ma lo si dice
+        self.items: List[Dict[str, Any]] = [{"url": s["url"], "status": "pending"} for s in sources]
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    @classmethod
+    def from_env(cls) -> "WarmUp":
+        path = os.getenv("COSTVISTA_WARMUP_MANIFEST")
+        if path is None:
+            path = str(DEFAULT_MANIFEST) if DEFAULT_MANIFEST.exists() else ""
+        sources: List[Dict[str, Any]] = []
+        error = None
+        if path:
+            try:
+                sources = load_manifest(path)
+            except (OSError, ValueError) as e:
+                error = f"{type(e).__name__}: {e}"
+        return cls(sources, manifest=path or None,
+                   concurrency=_env_int("COSTVISTA_WARMUP_CONCURRENCY", 2),
+                   ready_timeout=_env_int("COSTVISTA_WARMUP_READY_TIMEOUT", 300), error=error)
+
+    @property
+    def ready(self) -> bool:
+        if not self.sources or self.finished_at is not None:
+            return True
+        if self.started_at is None:
+            return False
+        return time.monotonic() - self.started_at >= self.ready_timeout
+
+    def start(self, warm: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]) -> None:
+        """Avvia il warm-up in background: `warm(voce)` porta la sorgente in cache e
+           ritorna qualche dettaglio da mostrare nello stato."""
+        if self._task is None and self.sources:
+            self.started_at = time.monotonic()
+            self._task = asyncio.get_running_loop().create_task(self._run(warm))
+
+    async def stop(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self, warm: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]) -> None:
+        sem = asyncio.Semaphore(self.concurrency)
+
+        async def _one(src: Dict[str, Any], item: Dict[str, Any]) -> None:
+            async with sem:
+                item["status"] = "running"
+                t0 = time.perf_counter()
+                try:
+                    item.update(await warm(src))
+                    item["status"] = "ok"
+                except Exception as e:  # una sorgente che fallisce non ferma le altre
+                    item["status"] = "error"
+                    item["error"] = {
+                        "status_code": getattr(e, "status_code", None) or 500,
+                        "detail": getattr(e, "detail", None) or f"{type(e).__name__}: {e}",
+                    }
+                item["elapsed_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+
+        try:
+            await asyncio.gather(*(_one(s, i) for s, i in zip(self.sources, self.items)))
+        finally:
+            self.finished_at = time.monotonic()
+
+    def status(self) -> Dict[str, Any]:
+        done = sum(i["status"] in ("ok", "error") for i in self.items)
+        out: Dict[str, Any] = {
+            "manifest": self.manifest,
+            "total": len(self.items),
+            "done": done,
+            "failed": sum(i["status"] == "error" for i in self.items),
+            "finished": self.finished_at is not None,
+            "sources": self.items,
+        }
+        if self.started_at is not None:
+            end = self.finished_at if self.finished_at is not None else time.monotonic()
+            out["elapsed_ms"] = round((end - self.started_at) * 1000, 1)
+        if self.error:
+            out["error"] = self.error
+        return out
@@ -0,0 +1,5 @@
+# i moduli del backend sono file piatti accanto a main.py: i test li importano così
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,38 @@
+import pytest
+
+import main
+from mrf_json import RecordPrefilter
+
+
+def _text_chunks(text, size=64):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def _codes(rows):
+    return [(r["code"], r["rate"]) for r in rows]
+
+
+SINGLE_QUOTED = (
+    "code,description,rate\n"
+    "'A1','Cast, 12\" arm',10.5\n"
+    "'B2','Splint\nmulti-line',20\n"
+    "'A1','Boot 8\"',30\n"
+    "'C3','plain',40\n"
+    "'D4','note\nsecond line',50\n"
+) * 500  # ben oltre i 4KB di sniff: il prefiltro lavora sul resto
+
+
+@pytest.mark.parametrize("code", ["A1", "B2", "C3", "D4"])
+def test_prefilter_uses_sniffed_quotechar(code):
+    full = [r for r in main.iter_csv(_text_chunks(SINGLE_QUOTED)) if r["code"] == code]
+    keep = RecordPrefilter.build([code])
+    filtered = [r for r in main.iter_csv(_text_chunks(SINGLE_QUOTED), keep=keep) if r["code"] == code]
+    assert len(full) in (500, 1000) and keep.skipped > 0
+    assert _codes(filtered) == _codes(full)
+
+
+def test_prefilter_double_quotes_with_newlines():
+    text = 'code,description,rate\n' + ('"A1","x\ny",1\n"B2","z",2\n' * 1000)
+    keep = RecordPrefilter.build(["B2"])
+    rows = [r for r in main.iter_csv(_text_chunks(text), keep=keep) if r["code"] == "B2"]
+    assert len(rows) == 1000 and keep.skipped > 0
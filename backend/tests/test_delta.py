@@ -0,0 +1,53 @@
+import asyncio
+
+import pytest
+
+import main
+from mrf_cache import ResultCache
+from mrf_delta import DigestStore
+
+SAMPLE = "data/sample_hospital_mrf.csv"
+
+
+@pytest.fixture
+def fresh(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "DELTAS", DigestStore(str(tmp_path / "digests.sqlite")))
+    monkeypatch.setattr(main, "RESULT_CACHE", ResultCache())
+
+
+def _inc(series, month):
+    req = main.SummaryReq(url=SAMPLE, include_rows=False, incremental=True, series=series, month=month)
+    return asyncio.run(main._summary(req))["meta"]
+
+
+def test_counts_follow_this_requests_previous_month(fresh):
+    first = _inc("s1", "2025-01")
+    n = first["incremental"]["resummarized"]
+    assert n > 0 and first["incremental"]["carried_forward"] == 0
+    assert first["incremental"]["previous_month"] is None
+    # stessa entry dalla cache, ma ora c'è il mese prima: tutto riportato
+    second = _inc("s1", "2025-02")
+    assert second["cache"]["hit"]
+    assert second["incremental"]["previous_month"] == "2025-01"
+    assert (second["incremental"]["resummarized"], second["incremental"]["carried_forward"]) == (0, n)
+    assert second["incremental"]["delta"]["unchanged"] == n
+    # e un'altra serie, senza storia, sulla stessa entry in cache
+    other = _inc("s2", "2025-02")
+    assert other["cache"]["hit"]
+    assert (other["incremental"]["resummarized"], other["incremental"]["carried_forward"]) == (n, 0)
+
+
+def test_coalesced_followers_get_their_own_counts(fresh):
+    n = _inc("s1", "2025-01")["incremental"]["resummarized"]
+    main.RESULT_CACHE = ResultCache()  # niente cache: le due richieste condividono un solo parse
+
+    async def both():
+        reqs = [main.SummaryReq(url=SAMPLE, include_rows=False, incremental=True, series=s, month="2025-02")
+                for s in ("s1", "s2")]
+        return await asyncio.gather(*(main._summary(r) for r in reqs))
+
+    a, b = (r["meta"] for r in asyncio.run(both()))
+    assert a["cache"].get("coalesced") or b["cache"].get("coalesced")
+    assert (a["incremental"]["resummarized"], a["incremental"]["carried_forward"]) == (0, n)
+    assert (b["incremental"]["resummarized"], b["incremental"]["carried_forward"]) == (n, 0)
+    assert b["incremental"]["previous_month"] is None and b["incremental"]["delta"] is None
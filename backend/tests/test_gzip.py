@@ -0,0 +1,73 @@
+import gzip
+import zlib
+
+import pytest
+
+import mrf_gzip
+from mrf_io import iter_gunzip, iter_maybe_gunzip
+
+TEXT = b"".join(b'{"code":"%d","rate":%d.5}\n' % (i % 977, i) for i in range(200000))
+MULTI = b"".join(gzip.compress(TEXT[i:i + 100000]) for i in range(0, len(TEXT), 100000))
+
+
+def _chunks(data, size=64 * 1024):
+    return (data[i:i + size] for i in range(0, len(data), size))
+
+
+@pytest.fixture(params=[1, 4], ids=["serial", "parallel"])
+def gunzip(request, monkeypatch):
+    monkeypatch.setattr(mrf_gzip, "SHARD_BYTES", 64 * 1024)
+    yield lambda chunks: mrf_gzip.iter_gunzip(chunks, threads=request.param)
+    mrf_gzip.shutdown()
+
+
+@pytest.mark.parametrize("cut", [-4, -20, None])
+def test_truncated_single_member_raises(cut):
+    data = gzip.compress(TEXT)
+    data = data[:len(data) // 2] if cut is None else data[:cut]
+    with pytest.raises(zlib.error):
+        b"".join(iter_gunzip(_chunks(data)))
+    with pytest.raises(EOFError):
+        gzip.decompress(data)  # stesso comportamento di prima
+
+
+def test_truncated_multi_member_raises(gunzip):
+    with pytest.raises(zlib.error):
+        b"".join(gunzip(_chunks(MULTI[:-20])))
+
+
+def test_multi_member(gunzip):
+    assert b"".join(gunzip(_chunks(MULTI))) == TEXT
+
+
+def test_trailing_padding_is_ignored(gunzip):
+    assert b"".join(gunzip(_chunks(MULTI + b"\0" * 1000))) == TEXT
+
+
+def test_empty_input(gunzip):
+    assert b"".join(gunzip(iter(()))) == b""
+
+
+def test_inflate_output_is_capped():
+    data = gzip.compress(b"\0" * 1_000_000) * 2
+    assert b"".join(mrf_gzip._inflate(data, True, 2_000_000)) == b"\0" * 2_000_000
+    assert mrf_gzip._inflate(data, True, 1_999_999) is None
+    assert mrf_gzip._inflate(data, True, 10) is None
+
+
+def test_compressible_shards_fall_back_to_serial(monkeypatch, gunzip):
+    # member tutti zeri: ~1000x, la fetta supera il tetto e si finisce di fila
+    monkeypatch.setattr(mrf_gzip, "SHARD_MAX_OUT", 1024 * 1024)
+    member = b"\0" * (8 * 1024 * 1024)
+    data = gzip.compress(member, 1) * 12 + MULTI
+    assert b"".join(gunzip(_chunks(data))) == member * 12 + TEXT
+
+
+
+@pytest.mark.parametrize("size", [1, 64 * 1024])
+def test_maybe_gunzip(size):
+    head = TEXT[:100000]
+    assert b"".join(iter_maybe_gunzip(_chunks(gzip.compress(head), size))) == head
+    # .gz remoto già decodificato da Content-Encoding: passa così com'è
+    assert b"".join(iter_maybe_gunzip(_chunks(head, size))) == head
+    assert b"".join(iter_maybe_gunzip(iter(()))) == b""
@@ -0,0 +1,62 @@
+import asyncio
+
+import httpx
+
+import mrf_http
+
+URL = "http://mrf.test/plan.json"
+
+
+def _pool(tmp_path, handler):
+    pool = mrf_http.HttpPool(mirror_dir=str(tmp_path), chunk_size=4)
+    pool.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return pool
+
+
+def test_concurrent_downloads_do_not_mix_in_the_mirror(tmp_path):
+    bodies = iter([b"a" * 64, b"b" * 64])
+
+    def handler(req):
+        if req.headers.get("If-None-Match") == '"v1"':
+            return httpx.Response(304, headers={"ETag": '"v1"'})
+        return httpx.Response(200, content=next(bodies), headers={"ETag": '"v1"'})
+
+    async def run():
+        pool = _pool(tmp_path, handler)
+        async with pool.fetch(URL) as r1, pool.fetch(URL) as r2:
+            it1, it2 = r1.aiter_bytes().__aiter__(), r2.aiter_bytes().__aiter__()
+            got1, got2 = [], []
+            for _ in range(16):  # chunk alternati: le due scritture si intrecciano
+                got1.append(await it1.__anext__())
+                got2.append(await it2.__anext__())
+            for it, got in ((it1, got1), (it2, got2)):
+                async for c in it:
+                    got.append(c)
+        assert await asyncio.to_thread(pool.validators, URL) == {"etag": '"v1"', "last_modified": None}
+        async with pool.fetch(URL) as r3:
+            assert r3.not_modified
+            mirrored = await r3.aread()
+        await pool.aclose()
+        return b"".join(got1), b"".join(got2), mirrored
+
+    a, b, mirrored = asyncio.run(run())
+    assert (a, b) == (b"a" * 64, b"b" * 64)
+    assert mirrored in (a, b)
+    assert not list(tmp_path.glob("*.part"))
+
+
+def test_interrupted_download_leaves_no_mirror(tmp_path):
+    def handler(req):
+        return httpx.Response(200, content=b"x" * 64, headers={"ETag": '"v1"'})
+
+    async def run():
+        pool = _pool(tmp_path, handler)
+        async with pool.fetch(URL) as r:
+            it = r.aiter_bytes().__aiter__()
+            await it.__anext__()
+            await it.aclose()
+        await pool.aclose()
+        return await asyncio.to_thread(pool.validators, URL)
+
+    assert asyncio.run(run()) == {}
+    assert not list(tmp_path.glob("*.part")) and not list(tmp_path.glob("*.body"))
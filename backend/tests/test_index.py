@@ -0,0 +1,71 @@
+import threading
+
+from mrf_index import CodeIndex
+
+
+def _rows(n, tag):
+    return ({"code": str(i % 7), "tag": tag, "i": i} for i in range(n))
+
+
+def test_interleaved_ingests_do_not_lock(tmp_path):
+    # due ingest aperti insieme (come due worker): nessuno tiene il db fra un batch e l'altro
+    idx = CodeIndex(str(tmp_path / "codes.sqlite"), batch=10)
+    a = idx.ingest(_rows(100, "a"), "a.csv", None, "sid-a")
+    b = idx.ingest(_rows(100, "b"), "b.csv", None, "sid-b")
+    got = [(next(a), next(b)) for _ in range(100)]
+    assert len(got) == 100 and next(a, None) is None and next(b, None) is None
+    for source, sid, tag in (("a.csv", "sid-a", "a"), ("b.csv", "sid-b", "b")):
+        info = idx.lookup(source, None, sid)
+        assert info is not None and info["rows"] == 100
+        rows = idx.query(info["id"], ["3"])
+        assert [r["i"] for r in rows] == [i for i in range(100) if i % 7 == 3]
+        assert {r["tag"] for r in rows} == {tag}
+
+
+def test_concurrent_writers(tmp_path):
+    path = str(tmp_path / "codes.sqlite")
+    start = threading.Barrier(4)
+    errors = []
+
+    def _run(k):
+        try:
+            start.wait()
+            for _ in CodeIndex(path, batch=50).ingest(_rows(2000, str(k)), f"{k}.csv", None, f"sid-{k}"):
+                pass
+        except Exception as e:  # pragma: no cover - il test fallisce sotto
+            errors.append(e)
+
+    threads = [threading.Thread(target=_run, args=(k,)) for k in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors
+    idx = CodeIndex(path)
+    assert all(idx.lookup(f"{k}.csv", None, f"sid-{k}")["rows"] == 2000 for k in range(4))
+
+
+def test_same_content_is_indexed_once(tmp_path):
+    idx = CodeIndex(str(tmp_path / "codes.sqlite"), batch=10)
+    first = idx.ingest(_rows(50, "x"), "x.csv", None, "sid")
+    next(first)
+    # stesso contenuto mentre il primo è in corso: le righe passano, niente secondo indice
+    assert len(list(idx.ingest(_rows(50, "x"), "x.csv", None, "sid"))) == 50
+    assert idx.lookup("x.csv", None, "sid") is None
+    assert len(list(first)) == 49
+    assert idx.lookup("x.csv", None, "sid")["rows"] == 50
+
+
+def test_partial_ingest_is_discarded(tmp_path):
+    idx = CodeIndex(str(tmp_path / "codes.sqlite"), batch=10)
+    assert len(list(idx.ingest(_rows(30, "old"), "y.csv", None, "sid-1"))) == 30
+    gen = idx.ingest(_rows(30, "new"), "y.csv", None, "sid-2")
+    for _ in range(25):
+        next(gen)
+    gen.close()  # il client se n'è andato a metà
+    assert idx.lookup("y.csv", None, "sid-2") is None
+    assert idx.lookup("y.csv", None, "sid-1")["rows"] == 30
+    # e lo stesso contenuto si può indicizzare di nuovo subito
+    assert len(list(idx.ingest(_rows(30, "new"), "y.csv", None, "sid-2"))) == 30
+    assert idx.lookup("y.csv", None, "sid-2")["rows"] == 30
+    assert idx.lookup("y.csv", None, "sid-1") is None
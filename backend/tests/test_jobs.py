@@ -0,0 +1,58 @@
+import asyncio
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+from fastapi import HTTPException
+
+import main
+from mrf_jobs import JobStore
+
+REQUEST = {"url": "data/sample_hospital_mrf.csv", "include_rows": False}
+
+
+@pytest.fixture
+def jobs(tmp_path, monkeypatch):
+    store = JobStore(str(tmp_path / "jobs.sqlite"))
+    monkeypatch.setattr(main, "JOBS", store)
+    return store
+
+
+def _run(store, monkeypatch, fail):
+    async def summary(req):
+        raise fail
+    monkeypatch.setattr(main, "_summary", summary)
+    job_id, _ = store.submit(REQUEST)
+    store.track(job_id)
+    asyncio.run(main._run_job(job_id, REQUEST))
+    return store.get(job_id)
+
+
+@pytest.mark.parametrize("fail, status", [
+    (HTTPException(404, "Not found"), 404),
+    (ValueError("bad"), 500),
+    (BrokenProcessPool("worker died"), 500),
+    (RuntimeError("boom"), 500),
+    (KeyError("x"), 500),
+])
+def test_failed_job_is_not_left_running(jobs, monkeypatch, fail, status):
+    job = _run(jobs, monkeypatch, fail)
+    assert job["status"] == "error" and job["stage"] == "error"
+    assert job["error"]["status_code"] == status
+    assert job["finished_at"] is not None and "result" not in job
+    assert jobs.live == {} and jobs.unfinished() == []
+
+
+def test_job_done(jobs):
+    job_id, created = jobs.submit(REQUEST)
+    jobs.track(job_id)
+    asyncio.run(main._run_job(job_id, REQUEST))
+    job = jobs.get(job_id)
+    assert created and job["status"] == "done" and "error" not in job
+    assert job["result"]["summary"]
+    assert jobs.submit(REQUEST) == (job_id, False)  # finito bene: riusato
+
+
+def test_failed_job_not_reused(jobs, monkeypatch):
+    job = _run(jobs, monkeypatch, RuntimeError("boom"))
+    new_id, created = jobs.submit(REQUEST)
+    assert created and new_id != job["id"]
@@ -0,0 +1,41 @@
+import json
+
+import pytest
+
+from mrf_json import IndexFileDetected, NoRowsFound, iter_json_rows, sniff
+
+
+def _rows(doc, size=7):
+    text = json.dumps(doc)
+    fmt, cur = sniff(iter([text[i:i + size] for i in range(0, len(text), size)]))
+    assert fmt == "json"
+    return list(iter_json_rows(cur))
+
+
+def test_data_key_wins_over_earlier_array():
+    assert _rows({"meta": [{"a": 1}], "data": [{"b": 2}]}) == [{"b": 2}]
+    assert _rows({"meta": [], "data": [{"b": 2}]}) == [{"b": 2}]
+
+
+def test_first_array_without_data_key():
+    assert _rows({"meta": [{"a": 1}], "x": 3, "other": [{"c": 1}]}) == [{"a": 1}]
+
+
+def test_empty_data_is_no_rows():
+    with pytest.raises(NoRowsFound):
+        _rows({"data": [], "meta": [{"a": 1}]})
+
+
+def test_long_leading_array_is_streamed():
+    rows = _rows({"rates": [{"a": i} for i in range(1500)], "data": [{"b": 2}]}, size=4096)
+    assert len(rows) == 1500 and rows[-1] == {"a": 1499}
+
+
+@pytest.mark.parametrize("doc", [
+    {"in_network_files": [{"location": "http://x/a.json"}], "data": [{"b": 2}]},
+    {"data": [{"b": 2}], "reporting_structure": [{"in_network_files": [{"location": "http://x/a.json"}]}]},
+])
+def test_index_detected_even_with_rows(doc):
+    with pytest.raises(IndexFileDetected) as e:
+        _rows(doc)
+    assert e.value.urls == ["http://x/a.json"]
@@ -0,0 +1,103 @@
+import random
+
+import pytest
+
+from mrf_engine import SummaryBuilder
+from mrf_sketch import APPROX_RANK_ERROR, ApproxSummaryBuilder, KLLSketch
+
+
+def _rows(n, codes=("A", "B", "C"), seed=1):
+    rnd = random.Random(seed)
+    return [{"code": codes[i % len(codes)], "description": f"desc {codes[i % len(codes)]}",
+             "provider_name": f"P{i}", "negotiated_rate": float(rnd.randrange(1000))} for i in range(n)]
+
+
+def _parts(rows, k):
+    step = -(-len(rows) // k)
+    return [rows[i:i + step] for i in range(0, len(rows), step)]
+
+
+def _merged(cls, rows, k):
+    out = cls()
+    for part in _parts(rows, k):
+        b = cls()
+        b.add_rows(part)
+        out.merge(b)
+    return out
+
+
+def _rank_error(values, x):
+    s = sorted(values)
+    lo = sum(v < x for v in s)
+    hi = sum(v <= x for v in s)
+    return lo, hi
+
+
+def test_kll_merge_small_is_exact():
+    vals = [float(v) for v in random.Random(2).sample(range(10_000), 150)]
+    a, b, whole = KLLSketch(), KLLSketch(), KLLSketch()
+    for v in vals[:70]:
+        a.update(v)
+    for v in vals[70:]:
+        b.update(v)
+    for v in vals:
+        whole.update(v)
+    a.merge(b)
+    assert a.exact and a.n == len(vals)
+    assert a.weighted() == whole.weighted()
+
+
+@pytest.mark.parametrize("parts", [1, 2, 7])
+def test_kll_merge_rank_error(parts):
+    vals = [float(v) for v in range(50_000)]
+    random.Random(3).shuffle(vals)
+    sk = KLLSketch()
+    for chunk in _parts(vals, parts):
+        part = KLLSketch(seed=len(chunk))
+        for v in chunk:
+            part.update(v)
+        sk.merge(part)
+    assert sk.n == len(vals) and not sk.exact
+    items = sk.weighted()
+    assert sum(w for _, w in items) == len(vals)
+    n = len(vals)
+    for q in (0.01, 0.25, 0.5, 0.75, 0.99):
+        r = int(q * n)
+        x = sk.value_at_rank(items, r)  # valori 0..n-1: il valore è il suo rango vero
+        assert abs(x - r) <= APPROX_RANK_ERROR * n
+
+
+def test_approx_merge_matches_exact_below_k():
+    rows = _rows(3 * 150)  # 150 tariffe per codice: sotto k, nessuna compattazione
+    exact = SummaryBuilder()
+    exact.add_rows(rows)
+    for k in (1, 2, 5):
+        assert _merged(ApproxSummaryBuilder, rows, k).summary() == exact.summary()
+        assert _merged(SummaryBuilder, rows, k).summary() == exact.summary()
+
+
+def test_approx_merge_large():
+    rows = _rows(3 * 20_000)
+    whole = ApproxSummaryBuilder()
+    whole.add_rows(rows)
+    merged = _merged(ApproxSummaryBuilder, rows, 6)
+    assert len(merged) == len(rows)
+    by_code = {c: [r["negotiated_rate"] for r in rows if r["code"] == c] for c in "ABC"}
+    for w, m in zip(whole.summary(), merged.summary()):
+        exact_fields = ("code", "description", "count", "min", "max", "top3")
+        assert {f: m[f] for f in exact_fields} == {f: w[f] for f in exact_fields}
+        vals = by_code[m["code"]]
+        for f, q in (("p25", 0.25), ("median", 0.5), ("p75", 0.75)):
+            lo, hi = _rank_error(vals, m[f])
+            r = q * len(vals)
+            assert lo - APPROX_RANK_ERROR * len(vals) <= r <= hi + APPROX_RANK_ERROR * len(vals)
+
+
+def test_top3_ties_keep_arrival_order_across_merge():
+    rows = [{"code": "A", "provider_name": f"P{i}", "negotiated_rate": 5.0} for i in range(10)]
+    merged = _merged(ApproxSummaryBuilder, rows, 4)
+    top = merged.summary()[0]["top3"]
+    assert [t["provider_name"] for t in top] == ["P0", "P1", "P2"]
+    exact = SummaryBuilder()
+    exact.add_rows(rows)
+    assert top == exact.summary()[0]["top3"]
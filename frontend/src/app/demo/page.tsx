@@ -41,6 +41,9 @@ function isDemoPath(x: string): x is DemoPath {
   return (DEMO_PATHS as readonly string[]).includes(x);
 }
 
+// righe per pagina quando si analizza un URL: la prima pagina arriva subito
+const ROWS_PAGE_SIZE = 2000;
+
 /* ============================
    Types
 ============================ */
@@ -76,7 +79,15 @@ type Summary = {
   top3: TopItem[];
 };
 
-type Meta = { source?: string; source_inner?: string | null; fetched_at?: string; index_month_hint?: string | null };
+type PageMeta = { offset: number; limit: number | null; total_rows: number; next_cursor: string | null };
+
+type Meta = {
+  source?: string;
+  source_inner?: string | null;
+  fetched_at?: string;
+  index_month_hint?: string | null;
+  page?: PageMeta; // solo con limit/cursor
+};
 
 type ApiSummaryResponse = {
   rows?: Row[];
@@ -870,14 +881,23 @@ useEffect(() => {
   setProgress(0);
 
   try {
-    const resp = await fetch(`${API}/api/summary`, {
-      method: "POST",
-      headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ url: hrefOrLocalPath, include_rows: true }),
-      signal: ctrl.signal,
-    });
-
-    const raw: unknown = await resp.json().catch(() => ({} as unknown));
+    const request = (limit?: number) =>
+      fetch(`${API}/api/summary`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        // prima pagina subito, le altre in background (vedi sotto)
+        body: JSON.stringify({ url: hrefOrLocalPath, include_rows: true, ...(limit ? { limit } : {}) }),
+        signal: ctrl.signal,
+      });
+
+    let resp = await request(ROWS_PAGE_SIZE);
+    let raw: unknown = await resp.json().catch(() => ({} as unknown));
+    const firstErr = (hasDetail(raw) ? (raw as { detail: unknown }).detail : raw) as ApiError | null;
+    if (resp.status === 400 && typeof firstErr === "object" && firstErr?.error === "pagination_unavailable") {
+      // sorgente senza ETag/Last-Modified (o risultato troppo grande per la cache): tutto in una risposta
+      resp = await request();
+      raw = await resp.json().catch(() => ({} as unknown));
+    }
     const body: unknown = hasDetail(raw) ? (raw as { detail: unknown }).detail : raw;
 
     if (!resp.ok) {
@@ -935,6 +955,23 @@ useEffect(() => {
     } catch {}
 
     setProgress(100);
+    setLoading(false);
+
+    // righe restanti: pagina per pagina dal risultato in cache del backend
+    let next = payload.meta?.page?.next_cursor ?? null;
+    while (next && !ctrl.signal.aborted) {
+      const pageResp = await fetch(`${API}/api/summary`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ url: hrefOrLocalPath, include_rows: true, cursor: next }),
+        signal: ctrl.signal,
+      });
+      if (!pageResp.ok) break;
+      const page = (await pageResp.json()) as ApiSummaryResponse;
+      const more = (page.rows ?? []) as Row[];
+      setAllRows((prev) => prev.concat(more)); // l'effect su allRows aggiorna anche rows
+      next = page.meta?.page?.next_cursor ?? null;
+    }
   } catch (err) {
     // ignoriamo abort come errore visuale
     if ((err as { name?: string } | null)?.name === "AbortError") return;